@@ -1,250 +1,1163 @@
-import json
 import asyncio
+import logging
 from spade.agent import Agent
-from spade.behaviour import CyclicBehaviour, OneShotBehaviour
+from spade.behaviour import OneShotBehaviour
 from spade.message import Message
-from datetime import datetime
 import random
 
+from capacity import CapacityLedger, Compartments
+from codec import MessageCodec
+from inbox import MailboxBehaviour, NoMailbox
+from journal import SHOP_ABANDONED, SHOP_DELIVERED, SHOP_REQUESTED
+from log import AgentLogger
+from negotiation import ProposalRound, select_cover
+from retry import RetryPolicy
+from route import Route, Stop, euclidean_distance, service_start
+from sim_clock import RealTimeClock, SECONDS_PER_HOUR
+
+# Тариф по умолчанию: 10 у.е. за км
+DEFAULT_TARIFF_PER_KM = 10
+# Простой в ожидании открытия окна приема: у.е. за час
+DEFAULT_WAITING_COST_PER_HOUR = 100
+
+
+def format_hour(hours):
+    """Часы от полуночи в виде ЧЧ:ММ"""
+    minutes = int(round(hours * 60))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
 
 class DeliveryVehicleAgent(Agent):
     """Агент-автомобиль доставки"""
 
-    def __init__(self, jid, password, capacity, speed=50):
+    def __init__(self, jid, password, capacity, speed=50, clock=None,
+                 tariff_per_km=DEFAULT_TARIFF_PER_KM, cost_engine=None, reservation_ttl=10.0,
+                 service_time=0.0, improve_routes=True, improve_moves=50,
+                 waiting_cost_per_hour=DEFAULT_WAITING_COST_PER_HOUR, spatial_index=None, codec="json",
+                 metrics=None, position=(0, 0), max_concurrent_requests=1, pricing_executor=None,
+                 journal=None, compartments=None, distance=None):
         super().__init__(jid, password)
+        self.clock = clock or RealTimeClock()
+        self.codec = MessageCodec(codec)
+        self.log = AgentLogger("Vehicle", self.name)
+        self.cost_engine = cost_engine
+        self.spatial_index = spatial_index
+        self.metrics = metrics
+        self.journal = journal
         self.capacity = capacity
         self.speed = speed
-        self.current_load = 0
-        self.current_position = (0, 0)
-        self.schedule = []
+        self.tariff_per_km = tariff_per_km
+        self.waiting_cost_per_hour = waiting_cost_per_hour
+        # Отсеки (товарные и температурные зоны); без описания - один общий
+        self.compartments = Compartments(capacity, compartments)
+        self.ledger = CapacityLedger(capacity, reservation_ttl, self.compartments)
+        # Параллельный расчет ставок: число одновременно обрабатываемых запросов
+        # и пул (потоков или процессов) для расчета вставки по снимку маршрута
+        self.max_concurrent_requests = max_concurrent_requests
+        self.pricing_executor = pricing_executor
+        self.current_position = tuple(position)
+        # Расстояние между точками: по прямой или по графу дорог (road_graph.RoadDistance)
+        self.distance = distance or euclidean_distance
+        # Пройденный путь, км
+        self.odometer = 0.0
+        # Подтвержденные заказы: маршрут из нескольких остановок
+        self.route = Route(self.current_position, speed, service_time=service_time, distance=self.distance)
+        self.improve_routes = improve_routes
+        self.improve_moves = improve_moves
+        self.improving = False
+        self.delivering = False
         self.available = True
+        # Магазины, ждущие освобождения места: jid -> (shop_id, нужный объем)
+        self.capacity_subscribers = {}
 
-    class ReceiveRequestBehaviour(CyclicBehaviour):
-        """Поведение для приема запросов от магазинов"""
+    @property
+    def current_load(self):
+        """Подтвержденный груз (без учета временных резервов)"""
+        return self.ledger.committed
 
-        async def run(self):
-            msg = await self.receive(timeout=10)
-            if msg:
-                try:
-                    request_data = json.loads(msg.body)
-                    msg_type = request_data.get("type")
-
-                    if msg_type == "delivery_request":
-                        print(f"\n[Vehicle {self.agent.name}] >> Получен ЗАПРОС от {request_data.get('shop_id')}")
-                        await self.handle_delivery_request(msg, request_data)
-                    elif msg_type == "query_availability":
-                        await self.handle_availability_query(msg)
+    class ReceiveRequestBehaviour(MailboxBehaviour):
+        """Поведение для приема запросов от магазинов"""
 
-                except json.JSONDecodeError:
-                    print(f"[Vehicle {self.agent.name}] Ошибка: Неверный формат JSON в сообщении")
+        role = "vehicle"
+        # Запросы только читают состояние и резервируют место синхронно,
+        # поэтому их можно обрабатывать параллельно; подтверждения - строго по очереди
+        concurrent = frozenset({"delivery_request", "batch_delivery_request"})
+        # Повтор запроса не должен резервировать место второй раз, повтор подтверждения - грузить заказ дважды
+        idempotent = frozenset({"delivery_request", "batch_delivery_request", "accept_delivery", "reject_delivery"})
+        handlers = {
+            "delivery_request": "handle_delivery_request",
+            "batch_delivery_request": "handle_batch_request",
+            "accept_delivery": "handle_accept",
+            "reject_delivery": "handle_reject",
+            "subscribe_capacity": "handle_subscribe",
+            "query_availability": "handle_availability_query",
+        }
 
         async def handle_delivery_request(self, msg, request_data):
             """Обработка запроса на доставку с подробным расчетом"""
-            shop_id = request_data.get("shop_id")
+            self.agent.log.debug(">> Получен ЗАПРОС от %s", request_data.get("shop_id"))
+            self.agent.sync_route()
+            quote = await self.evaluate_request(request_data)
+            shop_id = quote["shop_id"]
+
+            response = Message(to=str(msg.sender), thread=msg.thread)
+            response.set_metadata("performative", "propose")
+
+            # Подробный расчет нужен только при отладке: не форматируем его зря
+            if self.agent.log.isEnabledFor(logging.DEBUG):
+                self.log_quote(quote)
+
+            self.reserve(quote, msg.thread)
+
+            proposal = self.build_proposal(quote)
+            if proposal["can_deliver"]:
+                self.agent.log.info("<< Отправлено ПРЕДЛОЖЕНИЕ для %s: Стоимость %.2f", shop_id, quote["cost"],
+                                    extra={"event": "proposal", "shop_id": shop_id, "cost": quote["cost"]})
+                if self.agent.journal is not None:
+                    self.agent.journal.record("bid", vehicle=str(self.agent.jid.bare), shop=str(msg.sender.bare),
+                                              shop_id=shop_id, cost=quote["cost"])
+            else:
+                self.agent.log.info("<< Отправлен ОТКАЗ для %s (%s)", shop_id, proposal["reason"],
+                                    extra={"event": "refusal", "shop_id": shop_id, "reason": proposal["reason"]})
+                if self.agent.metrics is not None:
+                    self.agent.metrics.rejection(proposal["reason"])
+
+            self.agent.codec.pack(response, proposal)
+            await self.send(response)
+
+        async def handle_batch_request(self, msg, request_data):
+            """Обработка пакета заказов: один ответ с вектором предложений"""
+            orders = request_data.get("orders", [])
+            self.agent.log.debug(">> Получен ПАКЕТ из %d заказов", len(orders))
+            self.agent.sync_route()
+            quotes = await asyncio.gather(*(self.evaluate_request(order) for order in orders))
+            # Заказы пакета оценены против одного и того же свободного места:
+            # резерв по очереди не дает одному автомобилю пообещать его дважды.
+            # Отказ магазина приходит в его переговоры (conversation_id заказа)
+            if request_data.get("reserve", True):
+                for order, quote in zip(orders, quotes):
+                    self.reserve(quote, order.get("conversation_id"))
+            bids = [self.build_proposal(quote) for quote in quotes]
+
+            response = Message(to=str(msg.sender), thread=msg.thread)
+            response.set_metadata("performative", "propose")
+            self.agent.codec.pack(response, {
+                "type": "batch_delivery_proposal",
+                "vehicle_id": self.agent.name,
+                "batch_id": request_data.get("batch_id"),
+                "bids": bids
+            })
+
+            accepted = sum(1 for bid in bids if bid["can_deliver"])
+            self.agent.log.info("<< Ответ на пакет: %d предложений, %d отказов", accepted, len(bids) - accepted,
+                                extra={"event": "batch_bids", "batch_id": request_data.get("batch_id"),
+                                       "proposals": accepted, "refusals": len(bids) - accepted})
+            await self.send(response)
+
+        def reserve(self, quote, conversation):
+            """Резерв места под предложение сразу, до ответа магазина.
+
+            Так параллельные запросы и заказы одного пакета не получат одно
+            и то же место. Резерв синхронный и заново проверяет свободное
+            место после расчета.
+            """
+            if not quote["can_deliver"]:
+                return
+            reservation = self.agent.ledger.reserve(
+                quote["shop_id"], quote["load"], self.agent.clock.now(),
+                location=quote["location"], time_window=quote["time_window"],
+                estimated_time=quote["delivery_time"], cost=quote["cost"], conversation=conversation
+            )
+            quote["can_deliver"] = reservation is not None
+            # Место успел занять параллельный запрос: отказ по вместимости, а не "занят"
+            quote["reserve_failed"] = reservation is None
+
+        def log_quote(self, quote):
+            log = self.agent.log
+            log.debug("-- Логика расчета для %s --", quote["shop_id"])
+            status = "ПЕРЕГРУЗ" if not quote["is_capacity_ok"] else "ЧАСТИЧНО" if quote["partial"] else "OK"
+            log.debug("   1. Вместимость: Требуется %s | Свободно %s | Берем %s | Статус: %s",
+                      quote["order_quantity"], quote["free_space"], quote["products"], status)
+            log.debug("   2. Дистанция: %.2f км (от %s до %s)", quote["distance"], self.agent.current_position,
+                      quote["location"])
+            log.debug("   3. Стоимость: %.2f км * %s у.е. = %.2f у.е.", quote["distance"], quote["tariff_per_km"],
+                      quote["cost"])
+            if quote["is_time_ok"]:
+                log.debug("   4. Окно приема %s: прибытие в %s, ожидание %.2f ч", quote["time_window"],
+                          format_hour(quote["arrival_time"]), quote["waiting_time"])
+            else:
+                log.debug("   4. Окно приема %s: НЕ УСПЕВАЕТ", quote["time_window"])
+
+        async def evaluate_request(self, request_data):
+            """Расчет вместимости, дистанции и стоимости по одному заказу.
+
+            Стоимость - это прирост длины маршрута при самой дешевой вставке
+            остановки (маргинальная стоимость), а не поездка из текущей точки.
+            Если автомобиль приезжает до открытия окна приема, к стоимости
+            добавляется простой; если не успевает до закрытия - отказ.
+            """
             products = request_data.get("products", {})
             location = tuple(request_data.get("location", [0, 0]))
+            time_window = request_data.get("time_window")
+            now = self.agent.clock.day_hours()
+            route = self.agent.route
 
-            # 1. Анализ груза
-            request_quantity = sum(products.values())
-            current_free_space = self.agent.capacity - self.agent.current_load
+            # 1. Анализ груза по отсекам (с учетом мест, зарезервированных под
+            # другие предложения). Если весь заказ не помещается, предлагаются
+            # позиции, которые помещаются: магазин соберет заказ из частей
+            offer, load = self.agent.fit_products(products)
+            current_free_space = self.agent.ledger.free(self.agent.clock.now())
+            is_capacity_ok = bool(offer)
 
-            # Проверка условий
-            is_capacity_ok = request_quantity <= current_free_space
-            can_deliver = self.agent.available and is_capacity_ok
+            # 2-3. Логистика и стоимость. У свободного автомобиля маршрут пуст,
+            # и готовое значение берется из матриц движка, если он подключен;
+            # иначе - самая дешевая вставка в текущий маршрут с учетом окон приема
+            tariff_per_km = self.agent.tariff_per_km
+            cached = None
+            if self.agent.cost_engine is not None and not route and not self.agent.delivering:
+                cached = self.agent.cost_engine.quote(self.agent.jid.bare, request_data.get("shop_id"))
 
-            # 2. Расчет логистики
-            distance = self.calculate_distance(self.agent.current_position, location)
-            delivery_time = distance / self.agent.speed if self.agent.speed > 0 else float('inf')
+            if cached is not None:
+                distance, travel_time, cost = cached
+                begin = service_start(now + travel_time, time_window)
+                waiting_time = begin - (now + travel_time) if begin is not None else 0.0
+            else:
+                insertion = await self.price_insertion(location, time_window)
+                if insertion is None:
+                    distance, begin, waiting_time = self.calculate_distance(route.start, location), None, 0.0
+                else:
+                    distance, _, begin, waiting_time = insertion
+                cost = distance * tariff_per_km
 
-            # 3. Расчет стоимости (Тариф: 10 у.е. за км)
-            tariff_per_km = 10
-            cost = distance * tariff_per_km
+            is_time_ok = begin is not None
+            delivery_time = begin - now if is_time_ok else float('inf')
+            cost += waiting_time * self.agent.waiting_cost_per_hour
 
-            response = Message(to=str(msg.sender))
-            response.set_metadata("performative", "propose")
+            return {
+                "shop_id": request_data.get("shop_id"),
+                "location": location,
+                "products": offer,
+                "load": load,
+                "partial": offer != products,
+                "order_quantity": sum(products.values()),
+                "request_quantity": sum(offer.values()),
+                "free_space": current_free_space,
+                "free_load": self.agent.ledger.free_load(self.agent.clock.now()),
+                "is_capacity_ok": is_capacity_ok,
+                "time_window": time_window,
+                "is_time_ok": is_time_ok,
+                "can_deliver": self.agent.available and is_capacity_ok and is_time_ok,
+                "distance": distance,
+                "delivery_time": delivery_time,
+                "arrival_time": begin,
+                "waiting_time": waiting_time,
+                "tariff_per_km": tariff_per_km,
+                "cost": cost
+            }
+
+        async def price_insertion(self, location, time_window):
+            """Самая дешевая вставка остановки в маршрут.
 
-            print(f"[Vehicle {self.agent.name}] -- Логика расчета для {shop_id} --")
-            print(
-                f"   1. Вместимость: Требуется {request_quantity} | Свободно {current_free_space} | Статус: {'OK' if is_capacity_ok else 'ПЕРЕГРУЗ'}")
-            print(f"   2. Дистанция: {distance:.2f} км (от {self.agent.current_position} до {location})")
-            print(f"   3. Стоимость: {distance:.2f} км * {tariff_per_km} у.е. = {cost:.2f} у.е.")
+            С пулом расчет идет по снимку маршрута в отдельном потоке или
+            процессе, не блокируя цикл событий. Маршрут за это время может
+            измениться - ставка тогда приблизительна, но при подтверждении
+            вставка все равно ищется заново по актуальному маршруту.
+            """
+            route = self.agent.route
+            executor = self.agent.pricing_executor
+            if executor is None:
+                return route.insertion_cost(location, time_window)
+            snapshot = route.copy()
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, snapshot.insertion_cost, location, time_window)
 
-            if can_deliver:
-                proposal = {
+        def build_proposal(self, quote):
+            """Формирование предложения (или отказа) по результатам расчета"""
+            if quote["can_deliver"]:
+                return {
                     "type": "delivery_proposal",
                     "vehicle_id": self.agent.name,
+                    "shop_id": quote["shop_id"],
                     "can_deliver": True,
-                    "cost": cost,
-                    "estimated_time": delivery_time,
-                    "distance": distance,
-                    "capacity_available": current_free_space
-                }
-                print(f"[Vehicle {self.agent.name}] << Отправлено ПРЕДЛОЖЕНИЕ: Стоимость {cost:.2f}")
-            else:
-                proposal = {
-                    "type": "delivery_proposal",
-                    "vehicle_id": self.agent.name,
-                    "can_deliver": False,
-                    "reason": "Недостаточная вместимость или занят"
+                    "cost": quote["cost"],
+                    "estimated_time": quote["delivery_time"],
+                    "arrival_time": quote["arrival_time"],
+                    "waiting_time": quote["waiting_time"],
+                    "distance": quote["distance"],
+                    "capacity_available": quote["free_space"],
+                    "products": quote["products"],
+                    # Груз по отсекам автомобиля и свободное место в них (для глобального назначения)
+                    "load": quote["load"],
+                    "free_load": quote["free_load"]
                 }
-                print(f"[Vehicle {self.agent.name}] << Отправлен ОТКАЗ (нет места или занят)")
+            return {
+                "type": "delivery_proposal",
+                "vehicle_id": self.agent.name,
+                "shop_id": quote["shop_id"],
+                "can_deliver": False,
+                "reason": self.refusal_reason(quote)
+            }
+
+        def refusal_reason(self, quote):
+            if not quote["is_capacity_ok"] or quote.get("reserve_failed"):
+                return "Недостаточная вместимость"
+            if not quote["is_time_ok"]:
+                return "Не успевает в окно приема"
+            return "Автомобиль занят"
+
+        async def handle_accept(self, msg, data):
+            """Подтверждение заказа магазином: резерв превращается в груз"""
+            shop_id = data.get("shop_id")
+            shop_jid = data.get("shop_jid") or str(msg.sender.bare)
+            products = data.get("products", {})
+            load = self.agent.compartments.load(products)
+            location = tuple(data.get("location", self.agent.current_position))
+            time_window = data.get("time_window")
+
+            # Маршрут мог измениться после предложения: позиция вставки
+            # ищется заново, и окно приема может оказаться уже недостижимым
+            self.agent.sync_route()
+            insertion = self.agent.route.insertion_cost(location, time_window)
+            if load is None:
+                self.agent.ledger.release(shop_id)
+                await self.send_rejection(shop_id, shop_jid, "Нет отсека для товара", msg.thread)
+                return
+            if insertion is None:
+                self.agent.ledger.release(shop_id)
+                await self.send_rejection(shop_id, shop_jid, "Окно приема уже недостижимо", msg.thread)
+                await self.agent.notify_capacity(self)
+                return
+
+            reservation = self.agent.ledger.commit(
+                shop_id, self.agent.clock.now(), load=load, location=location
+            )
+            if reservation is None:
+                await self.send_rejection(shop_id, shop_jid, "Резерв истек, а свободного места уже нет", msg.thread)
+                return
+
+            stop = Stop(shop_id, shop_jid, reservation.details.get("location", location),
+                        reservation.quantity, time_window, conversation_id=msg.thread, products=products)
+            self.agent.route.insert(stop, insertion[1])
+            if self.agent.journal is not None:
+                self.agent.journal.record("accept", vehicle=str(self.agent.jid.bare), shop=shop_jid,
+                                          shop_id=shop_id, location=stop.location, quantity=stop.quantity,
+                                          time_window=time_window, conversation_id=msg.thread,
+                                          products=products)
+            self.agent.report_load()
+            await self.agent.report_position(self)
 
-            response.body = json.dumps(proposal)
+            response = Message(to=shop_jid, thread=msg.thread)
+            response.set_metadata("performative", "confirm")
+            self.agent.codec.pack(response, {
+                "type": "delivery_confirmed",
+                "vehicle_id": self.agent.name,
+                "shop_id": shop_id
+            })
+            self.agent.log.info("Заказ %s ПОДТВЕРЖДЕН. Загрузка %s/%s, остановок в маршруте: %d",
+                                shop_id, self.agent.current_load, self.agent.capacity, len(self.agent.route),
+                                extra={"event": "confirmed", "shop_id": shop_id, "load": self.agent.current_load,
+                                       "stops": len(self.agent.route)})
+            await self.send(response)
+
+            # Доставки выполняются по маршруту одним поведением
+            if not self.agent.delivering:
+                self.agent.delivering = True
+                self.agent.add_behaviour(self.agent.ExecuteDeliveryBehaviour())
+
+            # Улучшение маршрута идет отдельным поведением, не задерживая ответы
+            if self.agent.improve_routes and len(self.agent.route) >= 3 and not self.agent.improving:
+                self.agent.improving = True
+                self.agent.add_behaviour(self.agent.ImproveRouteBehaviour())
+
+        async def send_rejection(self, shop_id, shop_jid, reason, thread=None):
+            response = Message(to=shop_jid, thread=thread)
+            response.set_metadata("performative", "failure")
+            self.agent.codec.pack(response, {
+                "type": "delivery_rejected",
+                "vehicle_id": self.agent.name,
+                "shop_id": shop_id,
+                "reason": reason
+            })
+            self.agent.log.info("Заказ %s ОТКЛОНЕН: %s", shop_id, reason,
+                                extra={"event": "rejected", "shop_id": shop_id, "reason": reason})
+            if self.agent.metrics is not None:
+                self.agent.metrics.rejection(reason)
             await self.send(response)
 
-        async def handle_availability_query(self, msg):
+        async def handle_reject(self, msg, data):
+            """Магазин выбрал другой автомобиль: резерв освобождается"""
+            if self.agent.ledger.release(data.get("shop_id"), conversation=msg.thread):
+                await self.agent.notify_capacity(self)
+
+        def handle_subscribe(self, msg, data):
+            """Подписка магазина на освобождение места (одно уведомление на подписку).
+
+            Подписка запоминается, только если места сейчас не хватает: при
+            отказе по другой причине (окно приема) уведомление не поможет.
+            """
+            quantity = data.get("quantity", 0)
+            if quantity > self.agent.ledger.free(self.agent.clock.now()):
+                self.agent.capacity_subscribers[str(msg.sender.bare)] = (data.get("shop_id"), quantity)
+
+        async def handle_availability_query(self, msg, data):
             response = Message(to=str(msg.sender))
             response.set_metadata("performative", "inform")
-            response.body = json.dumps({
+            self.agent.codec.pack(response, {
                 "type": "availability_response",
                 "available": self.agent.available
             })
             await self.send(response)
 
         def calculate_distance(self, pos1, pos2):
-            return ((pos1[0] - pos2[0]) ** 2 + (pos1[1] - pos2[1]) ** 2) ** 0.5
+            return self.agent.calculate_distance(pos1, pos2)
+
+    class ExecuteDeliveryBehaviour(NoMailbox, OneShotBehaviour):
+        """Объезд остановок маршрута по порядку"""
 
-    class ExecuteDeliveryBehaviour(OneShotBehaviour):
         async def run(self):
-            if self.agent.schedule:
-                delivery = self.agent.schedule.pop(0)
-                print(f"[Vehicle {self.agent.name}] Начинаю доставку в {delivery['shop_id']}...")
-                await asyncio.sleep(delivery['estimated_time'])
-
-                confirm_msg = Message(to=delivery['shop_jid'])
-                confirm_msg.set_metadata("performative", "inform")
-                confirm_msg.body = json.dumps({
-                    "type": "delivery_completed",
-                    "vehicle_id": self.agent.name,
-                    "shop_id": delivery['shop_id']
-                })
-                await self.send(confirm_msg)
-                self.agent.available = True
-                print(f"[Vehicle {self.agent.name}] Доставка в {delivery['shop_id']} завершена.")
+            started_at = self.agent.clock.now()
+            try:
+                while self.agent.route:
+                    stop, _ = self.agent.route.pop_next()
+                    await self.deliver(stop)
+            finally:
+                self.agent.delivering = False
+                if self.agent.metrics is not None:
+                    self.agent.metrics.vehicle_busy(self.agent.name, self.agent.clock.now() - started_at)
+
+        async def deliver(self, stop):
+            self.agent.log.info("Начинаю доставку в %s...", stop.shop_id)
+            # Время в пути считается от текущей позиции: после предыдущих доставок она изменилась
+            distance = self.agent.calculate_distance(self.agent.current_position, stop.location)
+            travel_time = distance / self.agent.speed if self.agent.speed > 0 else 0
+            await self.agent.clock.sleep(travel_time * SECONDS_PER_HOUR)
+
+            # Ранний приезд: ожидание открытия окна приема
+            if stop.time_window is not None:
+                wait = stop.time_window[0] - self.agent.clock.day_hours()
+                if wait > 0:
+                    await self.agent.clock.sleep(wait * SECONDS_PER_HOUR)
+            if self.agent.route.service_time > 0:
+                await self.agent.clock.sleep(self.agent.route.service_time * SECONDS_PER_HOUR)
+
+            self.agent.move_to(stop.location)
+            self.agent.ledger.complete(self.agent.compartments.load(stop.products))
+            if self.agent.journal is not None:
+                self.agent.journal.record("deliver", vehicle=str(self.agent.jid.bare), shop=stop.shop_jid,
+                                          shop_id=stop.shop_id, conversation_id=stop.conversation_id,
+                                          position=self.agent.current_position,
+                                          odometer=self.agent.odometer)
+            self.agent.report_load()
+            await self.agent.report_position(self)
+            await self.agent.notify_capacity(self)
+
+            confirm_msg = Message(to=stop.shop_jid, thread=stop.conversation_id)
+            confirm_msg.set_metadata("performative", "inform")
+            self.agent.codec.pack(confirm_msg, {
+                "type": "delivery_completed",
+                "vehicle_id": self.agent.name,
+                "shop_id": stop.shop_id
+            })
+            await self.send(confirm_msg)
+            self.agent.log.info("Доставка в %s завершена.", stop.shop_id,
+                                extra={"event": "delivered", "shop_id": stop.shop_id})
+
+    class ReportPositionBehaviour(NoMailbox, OneShotBehaviour):
+        """Первый отчет о позиции после запуска"""
+
+        async def run(self):
+            await self.agent.report_position(self)
+
+    class ImproveRouteBehaviour(NoMailbox, OneShotBehaviour):
+        """Фоновое улучшение маршрута (2-opt и перенос остановок)"""
+
+        async def run(self):
+            try:
+                route = self.agent.route
+                gain = 0.0
+                for _ in range(self.agent.improve_moves):
+                    # Одно улучшение за шаг, между шагами обрабатываются сообщения
+                    moved = route.improve(max_moves=1)
+                    if moved <= 0:
+                        break
+                    gain += moved
+                    await asyncio.sleep(0)
+                if gain > 0:
+                    self.agent.log.info("Маршрут улучшен на %.2f км (длина %.2f км)", gain, route.length())
+            finally:
+                self.agent.improving = False
+
+    def calculate_distance(self, pos1, pos2):
+        return self.distance(pos1, pos2)
+
+    def sync_route(self):
+        """Привязка начала маршрута к текущей позиции и модельному времени"""
+        now = self.clock.day_hours()
+        if not self.delivering:
+            self.route.set_start(self.current_position, now)
+        elif self.route.start_time < now:
+            # В пути: маршрут продолжается от точки назначения, но не раньше текущего момента
+            self.route.set_start(self.route.start, now)
+
+    async def report_position(self, behaviour):
+        """Отчет о позиции и свободном месте для пространственного индекса.
+
+        Общий индекс (в одном процессе) обновляется напрямую, подписчикам
+        из "position_listeners" (магазины других шардов, см.
+        shard.position_listeners) уходит сообщение position_report.
+        """
+        free_capacity = self.capacity - self.ledger.committed
+        if self.spatial_index is not None:
+            self.spatial_index.update(self.jid.bare, self.current_position, free_capacity)
+
+        listeners = self.get("position_listeners") or []
+        if listeners:
+            messages = [Message(to=listener, metadata={"performative": "inform"}) for listener in listeners]
+            self.codec.pack_many(messages, {
+                "type": "position_report",
+                "vehicle_id": self.name,
+                "position": self.current_position,
+                "free_capacity": free_capacity
+            })
+            for msg in messages:
+                await behaviour.send(msg)
+
+    async def notify_capacity(self, behaviour):
+        """Уведомление подписчиков, чьему заказу теперь хватает свободного места"""
+        if not self.capacity_subscribers:
+            return
+        free = self.ledger.free(self.clock.now())
+        ready = [jid for jid, (_, quantity) in self.capacity_subscribers.items() if quantity <= free]
+        if not ready:
+            return
+
+        messages = [Message(to=jid, metadata={"performative": "inform"}) for jid in ready]
+        self.codec.pack_many(messages, {
+            "type": "capacity_available",
+            "vehicle_id": self.name,
+            "free_capacity": free
+        })
+        for jid, msg in zip(ready, messages):
+            del self.capacity_subscribers[jid]
+            await behaviour.send(msg)
+        self.log.debug("Уведомлены о свободном месте (%s): %s", free, ", ".join(ready))
+
+    def planned_distance(self):
+        """Пройденный путь плюс оставшаяся часть маршрута (с текущим перегоном), км"""
+        return (self.odometer + self.calculate_distance(self.current_position, self.route.start)
+                + self.route.length())
+
+    def report_load(self):
+        """Текущая загрузка для метрик (доля подтвержденного груза)"""
+        if self.metrics is not None:
+            self.metrics.vehicle_load(self.name, self.ledger.committed, self.capacity)
+
+    def fit_products(self, products):
+        """Часть заказа, которая помещается в свободное место.
+
+        Возвращает (товары, вектор груза по отсекам): весь заказ, если он
+        помещается, иначе - каждую позицию, урезанную в одной пропорции
+        внутри отсека и всего автомобиля. Так части от разных автомобилей
+        вместе покрывают все позиции, а не только самые крупные; остаток
+        магазин отдаст другим автомобилям.
+        """
+        now = self.clock.now()
+        load = self.compartments.load(products)
+        if load is not None and self.ledger.fits(load, now):
+            return dict(products), load
+
+        free = self.ledger.free_load(now)
+        total = self.ledger.free(now)
+        index = {}
+        wanted = [0] * len(free)
+        for product, quantity in products.items():
+            i = self.compartments.index(product)
+            if i is not None:
+                index[product] = i
+                wanted[i] += quantity
+
+        share = [min(1.0, max(f, 0) / w) if w else 0.0 for f, w in zip(free, wanted)]
+        scaled = {product: products[product] * share[i] for product, i in index.items()}
+        requested = sum(scaled.values())
+        if requested > total:
+            scaled = {product: q * max(total, 0) / requested for product, q in scaled.items()}
+
+        offer = {product: int(q) for product, q in scaled.items()}
+        load = [0] * len(free)
+        for product, quantity in offer.items():
+            load[index[product]] += quantity
+        # Остаток от округления вниз - по единице позициям с наибольшей дробной частью
+        spare = total - sum(load)
+        for product in sorted(scaled, key=lambda p: offer[p] - scaled[p]):
+            i = index[product]
+            if spare < 1:
+                break
+            if offer[product] < products[product] and load[i] < free[i]:
+                offer[product] += 1
+                load[i] += 1
+                spare -= 1
+        return {product: q for product, q in offer.items() if q > 0}, load
+
+    def move_to(self, position):
+        """Перемещение автомобиля (с обновлением строки в движке стоимости)"""
+        self.odometer += self.calculate_distance(self.current_position, position)
+        self.current_position = tuple(position)
+        if self.cost_engine is not None:
+            self.cost_engine.move_vehicle(self.jid.bare, self.current_position)
+
+    def restore(self, state):
+        """Восстановление из журнала: позиция и подтвержденные, но не доставленные заказы.
+
+        Резервы не восстанавливаются: они живут секунды, и магазины,
+        не получившие подтверждения, проводят переговоры заново.
+        """
+        if state["position"] is not None:
+            self.current_position = tuple(state["position"])
+            if self.cost_engine is not None:
+                self.cost_engine.move_vehicle(self.jid.bare, self.current_position)
+        self.odometer = state["odometer"]
+        self.route.set_start(self.current_position, self.clock.day_hours())
+
+        now = self.clock.now()
+        for key, data in state["stops"].items():
+            time_window = tuple(data["time_window"]) if data["time_window"] is not None else None
+            stop = Stop(data["shop_id"], data["shop"], tuple(data["location"]), data["quantity"], time_window,
+                        data.get("conversation_id"), data["products"])
+            self.ledger.commit(key, now, load=self.compartments.load(stop.products))
+            # Окно приема могло пройти, пока агент был остановлен: доставка с опозданием в конце маршрута
+            if self.route.insert(stop) is None:
+                self.route.insert(stop, len(self.route))
+        if state["stops"]:
+            self.log.info("Восстановлено из журнала: остановок %d, загрузка %s/%s",
+                          len(self.route), self.current_load, self.capacity,
+                          extra={"event": "restored", "stops": len(self.route), "load": self.current_load})
 
     async def setup(self):
-        print(f"[INFO] Автомобиль {self.name} запущен (JID: {self.jid})")
-        self.add_behaviour(self.ReceiveRequestBehaviour())
+        self.log.info("Автомобиль запущен (JID: %s)", self.jid)
+        if self.journal is not None:
+            state = self.journal.vehicle_state(self.jid.bare)
+            if state is not None:
+                self.restore(state)
+        self.add_behaviour(self.ReceiveRequestBehaviour(self.max_concurrent_requests))
+        self.add_behaviour(self.ReportPositionBehaviour())
+        if self.route:
+            self.delivering = True
+            self.add_behaviour(self.ExecuteDeliveryBehaviour())
+        self.report_load()
 
 
 class ShopAgent(Agent):
     """Агент-магазин"""
 
-    def __init__(self, jid, password, shop_id, location, time_window, needs):
+    def __init__(self, jid, password, shop_id, location, time_window, needs, clock=None,
+                 proposal_timeout=4.0, spatial_index=None, candidate_count=None, search_radius=None,
+                 codec="json", metrics=None, rng=None, retry_policy=None, subscribe_capacity=False,
+                 journal=None):
         super().__init__(jid, password)
+        self.clock = clock or RealTimeClock()
+        self.codec = MessageCodec(codec)
+        self.log = AgentLogger("Shop", shop_id)
+        # Источник случайных задержек: с заданным зерном запуск воспроизводим
+        self.rng = rng or random.Random()
         self.shop_id = shop_id
         self.location = location
         self.time_window = time_window
         self.needs = needs
-        self.proposals = []
+        self.proposal_timeout = proposal_timeout
+        # Выбор получателей запроса: k ближайших автомобилей по индексу
+        self.spatial_index = spatial_index
+        self.candidate_count = candidate_count
+        self.search_radius = search_radius
+        self.failed_rounds = 0
+        # Повторы запроса: задержка по политике, досрочное пробуждение по уведомлению автомобиля
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.subscribe_capacity = subscribe_capacity
+        self.wakeup = asyncio.Event()
+        self.metrics = metrics
+        self.journal = journal
+        # Момент первого запроса текущего заказа и число повторов (для метрик)
+        self.requested_at = None
+        self.retries = 0
+        # Открытые раунды по conversation_id (thread): ответ на закрытый
+        # или чужой раунд не находит корзины и отбрасывается
+        self.rounds = {}
+        # Заказ может быть разделен между автомобилями. outstanding - товары,
+        # еще не отданные ни одному автомобилю; parts - отданные части:
+        # (conversation_id, jid автомобиля) -> {"products", "confirmed"}.
+        # Подтверждение, отклонение и доставка принимаются только по частям
+        self.outstanding = dict(needs)
+        self.parts = {}
         self.request_sent = False
         self.best_proposal_selected = False
 
-    class SendRequestBehaviour(OneShotBehaviour):
+    class SendRequestBehaviour(NoMailbox, OneShotBehaviour):
+        """Рассылка запроса, ожидание предложений и выбор победителя"""
+
+        def __init__(self, delay=None):
+            super().__init__()
+            # Задержка повтора по политике; для первого запроса - небольшой случайный разброс
+            self.delay = delay
+
         async def run(self):
-            await asyncio.sleep(random.uniform(0.5, 2.0))
+            delay = self.delay if self.delay is not None else self.agent.rng.uniform(0.5, 2.0)
+            # Повтор начинается раньше, если автомобиль сообщил об освободившемся месте
+            if await self.agent.clock.wait_for(self.agent.wakeup.wait(), delay) and self.delay is not None:
+                self.agent.log.info("Автомобиль сообщил о свободном месте. Повтор запроса без ожидания")
 
-            print(f"\n[Shop {self.agent.shop_id}] >> Формирование заказа")
-            print(f"[Shop {self.agent.shop_id}] Потребности: {self.agent.needs}")
+            # После закрытия окна приема доставка сегодня уже невозможна
+            if self.agent.time_window and self.agent.clock.day_hours() > self.agent.time_window[1]:
+                self.agent.log.info("Окно приема %s закрыто. Запросы на сегодня прекращены.",
+                                    self.agent.time_window)
+                self.agent.order_abandoned("window_closed")
+                return
+
+            self.agent.log.debug(">> Формирование заказа. Потребности: %s", self.agent.outstanding)
 
             try:
                 vehicles = self.agent.get("vehicles")
             except KeyError:
                 vehicles = []
 
-            if not vehicles:
-                print(f"[Shop {self.agent.shop_id}] ОШИБКА: Нет известных автомобилей.")
+            # В режиме диспетчера запрос уходит одному диспетчеру,
+            # который сам собирает пакет и рассылает его автомобилям
+            dispatcher = self.agent.get("dispatcher")
+            recipients = [dispatcher] if dispatcher else self.select_vehicles(vehicles)
+
+            if not recipients:
+                self.agent.log.error("Нет известных автомобилей.")
                 return
 
             request = {
                 "type": "delivery_request",
                 "shop_id": self.agent.shop_id,
                 "location": self.agent.location,
-                "products": self.agent.needs,
+                "products": self.agent.outstanding,
                 "time_window": self.agent.time_window,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": self.agent.clock.datetime().isoformat()
             }
 
-            print(f"[Shop {self.agent.shop_id}] Рассылка запроса {len(vehicles)} автомобилям...")
-            for vehicle_jid in vehicles:
-                msg = Message(to=vehicle_jid)
-                msg.set_metadata("performative", "request")
-                msg.body = json.dumps(request)
+            round_ = ProposalRound(recipients, self.agent.clock.now(), self.agent.proposal_timeout,
+                                   products=dict(self.agent.outstanding))
+            self.agent.rounds[round_.conversation_id] = round_
+            if self.agent.requested_at is None:
+                self.agent.requested_at = round_.started_at
+                if self.agent.metrics is not None:
+                    self.agent.metrics.order_requested()
+
+            if dispatcher:
+                self.agent.log.info("Отправка запроса диспетчеру %s...", dispatcher)
+            else:
+                self.agent.log.info("Рассылка запроса %d автомобилям...", len(recipients))
+            # Тело запроса кодируется один раз для всех получателей
+            messages = [Message(to=jid, thread=round_.conversation_id, metadata={"performative": "request"})
+                        for jid in recipients]
+            self.agent.codec.pack_many(messages, request)
+            for msg in messages:
                 await self.send(msg)
 
             self.agent.request_sent = True
+            if self.agent.journal is not None:
+                self.agent.journal.record("request", shop=str(self.agent.jid.bare), shop_id=self.agent.shop_id,
+                                          retries=self.agent.retries)
 
-    class ReceiveProposalBehaviour(CyclicBehaviour):
-        async def run(self):
-            msg = await self.receive(timeout=1)
-            if msg:
-                try:
-                    data = json.loads(msg.body)
-                    msg_type = data.get("type")
-
-                    if msg_type == "delivery_proposal":
-                        vid = data.get('vehicle_id')
-                        cost = data.get('cost')
-
-                        if data.get("can_deliver"):
-                            print(f"[Shop {self.agent.shop_id}] Принято предложение от {vid}: Стоимость {cost:.2f}")
-                            self.agent.proposals.append(data)
-                            # Сохраняем JID отправителя для ответа
-                            self.agent.proposals[-1]["vehicle_jid"] = str(msg.sender)
-                        else:
-                            print(f"[Shop {self.agent.shop_id}] Получен отказ от {vid}: {data.get('reason')}")
-
-                    elif msg_type == "delivery_completed":
-                        print(f"[Shop {self.agent.shop_id}] ТОВАР ПОЛУЧЕН от {data.get('vehicle_id')}. Заказ закрыт.")
-                        self.agent.best_proposal_selected = False
-
-                except json.JSONDecodeError:
-                    pass
-
-            # Логика выбора лучшего предложения
-            if self.agent.request_sent and not self.agent.best_proposal_selected:
-                # Ждем сбора всех предложений (эмуляция ожидания 4 сек)
-                await asyncio.sleep(4)
-                await self.select_best_proposal()
-
-        async def select_best_proposal(self):
-            if not self.agent.proposals:
-                print(f"[Shop {self.agent.shop_id}] ВНИМАНИЕ: Нет активных предложений. Повтор запроса...")
+            # Ждем ответов всех автомобилей, но не дольше дедлайна раунда
+            await round_.wait(self.agent.clock)
+            round_.close(self.agent.clock.now())
+            self.agent.log.info("Раунд завершен за %.3f с: ответили %d/%d", round_.latency,
+                                len(round_.responded), len(round_.expected),
+                                extra={"event": "round_closed", "latency": round_.latency,
+                                       "responded": len(round_.responded), "expected": len(round_.expected)})
+            if self.agent.metrics is not None:
+                self.agent.metrics.round_closed("shop", round_)
+                self.agent.metrics.proposals_received(len(round_.proposals))
+
+            await self.select_best_proposal(round_)
+
+        def select_vehicles(self, vehicles):
+            """Получатели запроса: k ближайших автомобилей с достаточным свободным местом.
+
+            Без индекса (или без k) запрос уходит всем автомобилям. Если в
+            радиусе поиска подходящих нет, радиус удваивается, а затем
+            ограничение снимается. После неудачных раундов k растет вдвое.
+            """
+            index = self.agent.spatial_index
+            k = self.agent.candidate_count
+            if index is None or not k or not len(index):
+                return vehicles
+
+            k = min(k * 2 ** self.agent.failed_rounds, len(vehicles))
+            # Заказ можно разделить до единиц товара: полезен любой автомобиль со свободным местом
+            quantity = 1
+            radius = self.agent.search_radius
+            radii = [radius, radius * 2, radius * 4, None] if radius is not None else [None]
+
+            for r in radii:
+                candidates = index.nearest(self.agent.location, k, min_capacity=quantity, max_radius=r)
+                if candidates:
+                    if r != radius:
+                        self.agent.log.info("Радиус поиска расширен до %s",
+                                            "всей карты" if r is None else f"{r:g} км")
+                    return candidates
+
+            # Свободного места нет ни у кого по данным индекса: спрашиваем всех
+            return vehicles
+
+        async def select_best_proposal(self, round_):
+            self.agent.rounds.pop(round_.conversation_id, None)
+
+            if round_.assignment is not None:
+                # Диспетчер распределил заказ: подтверждение автомобилю отправляется
+                # отсюда, пока раунд открыт, поэтому опоздавшее назначение не исполняется
+                assigned = round_.assignment
+                self.agent.log.info("РЕШЕНИЕ: Диспетчер назначил %s (стоимость %.2f)",
+                                    assigned["vehicle_id"], assigned["cost"],
+                                    extra={"event": "assigned", "vehicle_id": assigned["vehicle_id"],
+                                           "cost": assigned["cost"]})
+                await self.accept(round_, assigned["vehicle_jid"], round_.products)
+                self.agent.request_sent = False
+                self.agent.best_proposal_selected = True
+                self.finish_placement()
+                return
+
+            # Предложения с прибытием вне окна приема не принимаются:
+            # такой заказ все равно не удалось бы выполнить
+            proposals = [p for p in round_.proposals if self.agent.fits_time_window(p)]
+            if len(proposals) < len(round_.proposals):
+                self.agent.log.info("Отброшено предложений вне окна приема %s: %d",
+                                    self.agent.time_window, len(round_.proposals) - len(proposals))
+
+            # Самый дешевый набор предложений, покрывающий все запрошенные позиции
+            # (чаще всего - одно предложение на весь заказ)
+            cover = select_cover(proposals, round_.products) if proposals else None
+            if cover is None:
+                if proposals:
+                    self.agent.log.info("Предложения не покрывают заказ %s", round_.products)
+                await self.reject_proposals(round_)
+                self.agent.failed_rounds += 1
                 self.agent.request_sent = False
-                self.agent.add_behaviour(self.agent.SendRequestBehaviour())
+                delay = self.agent.schedule_retry("no_proposals")
+                if delay is not None:
+                    self.agent.log.info("Нет активных предложений. Повтор запроса через %.1f с", delay,
+                                        extra={"event": "retry", "delay": delay, "attempt": self.agent.retries})
+                    if self.agent.subscribe_capacity:
+                        await self.subscribe(round_)
                 return
 
-            # Вывод таблицы сравнения
-            print(f"\n[Shop {self.agent.shop_id}] --- АНАЛИЗ ПРЕДЛОЖЕНИЙ ---")
-            print(f"{'Автомобиль':<20} | {'Стоимость':<10} | {'Время (ч)':<10} | {'Дистанция':<10}")
-            print("-" * 60)
+            # Таблица сравнения выводится только при отладке
+            if self.agent.log.isEnabledFor(logging.DEBUG):
+                self.log_proposals(proposals)
 
-            for p in self.agent.proposals:
-                print(
-                    f"{p['vehicle_id']:<20} | {p['cost']:<10.2f} | {p['estimated_time']:<10.2f} | {p['distance']:<10.2f}")
-            print("-" * 60)
+            cost = sum(proposal["cost"] for proposal, _ in cover)
+            if len(cover) == 1:
+                winner = cover[0][0]
+                self.agent.log.info("РЕШЕНИЕ: Выбран %s. ПРИЧИНА: Минимальная стоимость (%.2f)",
+                                    winner["vehicle_id"], cost,
+                                    extra={"event": "selected", "vehicle_id": winner["vehicle_id"],
+                                           "cost": cost, "proposals": len(proposals)})
+            else:
+                self.agent.log.info("РЕШЕНИЕ: Заказ разделен между %s. ПРИЧИНА: Минимальная суммарная "
+                                    "стоимость (%.2f)", ", ".join(p["vehicle_id"] for p, _ in cover), cost,
+                                    extra={"event": "selected", "vehicle_id": [p["vehicle_id"] for p, _ in cover],
+                                           "cost": cost, "proposals": len(proposals)})
 
-            # Выбор победителя (минимум по стоимости)
-            best_proposal = min(self.agent.proposals, key=lambda p: p["cost"])
+            # Отправка согласия: каждому автомобилю - его часть заказа
+            for proposal, products in cover:
+                await self.accept(round_, proposal["vehicle_jid"], products)
 
-            print(f"[Shop {self.agent.shop_id}] РЕШЕНИЕ: Выбран {best_proposal['vehicle_id']}")
-            print(f"[Shop {self.agent.shop_id}] ПРИЧИНА: Минимальная стоимость ({best_proposal['cost']:.2f})\n")
+            # Остальным автомобилям - отказ, чтобы они сразу сняли резерв
+            await self.reject_proposals(round_, winners={p["vehicle_jid"] for p, _ in cover})
+            self.agent.failed_rounds = 0
 
-            # Отправка согласия
-            accept_msg = Message(to=best_proposal["vehicle_jid"])
+            self.agent.request_sent = False
+            self.agent.best_proposal_selected = True
+            self.finish_placement()
+
+        async def accept(self, round_, vehicle_jid, products):
+            """Часть заказа отдается автомобилю и подтверждается ему"""
+            self.agent.place((round_.conversation_id, vehicle_jid), products)
+            accept_msg = Message(to=vehicle_jid, thread=round_.conversation_id)
             accept_msg.set_metadata("performative", "accept-proposal")
-            accept_msg.body = json.dumps({
+            self.agent.codec.pack(accept_msg, {
                 "type": "accept_delivery",
                 "shop_id": self.agent.shop_id,
-                "shop_jid": str(self.agent.jid)
+                "shop_jid": str(self.agent.jid),
+                "location": self.agent.location,
+                "time_window": self.agent.time_window,
+                "products": products
             })
             await self.send(accept_msg)
 
-            self.agent.proposals = []
-            self.agent.request_sent = False
-            self.agent.best_proposal_selected = True
+        def finish_placement(self):
+            """После размещения: часть заказа могла быть отклонена, пока шел раунд;
+            тогда ее товары запрашиваются повторно"""
+            self.agent.check_assigned()
+            if self.agent.outstanding:
+                self.agent.best_proposal_selected = False
+                self.agent.schedule_retry("rejected")
+
+        def log_proposals(self, proposals):
+            lines = ["--- АНАЛИЗ ПРЕДЛОЖЕНИЙ ---",
+                     f"{'Автомобиль':<20} | {'Стоимость':<10} | {'Время (ч)':<10} | {'Прибытие':<10} | {'Дистанция':<10}",
+                     "-" * 73]
+            for p in proposals:
+                arrival = format_hour(p["arrival_time"]) if p.get("arrival_time") is not None else "-"
+                lines.append(f"{p['vehicle_id']:<20} | {p['cost']:<10.2f} | {p['estimated_time']:<10.2f} | "
+                             f"{arrival:<10} | {p['distance']:<10.2f}")
+            lines.append("-" * 73)
+            self.agent.log.debug("\n".join(lines))
+
+        async def subscribe(self, round_):
+            """Подписка на освобождение места у автомобилей, ответивших отказом"""
+            vehicles = {p["vehicle_jid"] for p in round_.refusals if "vehicle_jid" in p}
+            messages = [Message(to=jid, metadata={"performative": "subscribe"}) for jid in vehicles]
+            self.agent.codec.pack_many(messages, {
+                "type": "subscribe_capacity",
+                "shop_id": self.agent.shop_id,
+                # Отказавшему автомобилю можно отдать и часть заказа: ждем места под самую мелкую позицию
+                "quantity": min(self.agent.outstanding.values())
+            })
+            for msg in messages:
+                await self.send(msg)
+
+        async def reject_proposals(self, round_, winners=()):
+            """Отказ всем автомобилям раунда, кроме победителей"""
+            messages = [Message(to=jid, thread=round_.conversation_id, metadata={"performative": "reject-proposal"})
+                        for jid in {p["vehicle_jid"] for p in round_.proposals} - set(winners)]
+            self.agent.codec.pack_many(messages, {"type": "reject_delivery", "shop_id": self.agent.shop_id})
+            for msg in messages:
+                await self.send(msg)
+
+    class ReceiveProposalBehaviour(MailboxBehaviour):
+        """Прием предложений в текущий раунд и уведомлений о доставке"""
+
+        role = "shop"
+        handlers = {
+            "delivery_proposal": "handle_proposal",
+            "delivery_proposal_batch": "handle_proposal_batch",
+            "delivery_assigned": "handle_assignment",
+            "delivery_confirmed": "handle_confirmed",
+            "delivery_rejected": "handle_rejected",
+            "capacity_available": "handle_capacity_available",
+            "position_report": "handle_position_report",
+            "delivery_completed": "handle_completed",
+        }
+        idempotent = frozenset({"delivery_proposal", "delivery_proposal_batch", "delivery_assigned",
+                                "delivery_confirmed", "delivery_rejected", "delivery_completed"})
+
+        def open_round(self, msg, msg_type):
+            """Корзина раунда, к которому относится ответ (None - раунд закрыт или чужой)"""
+            round_ = self.agent.rounds.get(msg.thread)
+            if round_ is None or round_.is_closed:
+                self.agent.log.debug("Опоздавший ответ %s от %s проигнорирован", msg_type, msg.sender)
+                self.dropped(msg_type, "stale")
+                return None
+            return round_
+
+        def find_part(self, msg, msg_type):
+            """Часть заказа, к которой относится ответ автомобиля (None - прошлые переговоры)"""
+            key = (msg.thread, str(msg.sender.bare))
+            part = self.agent.parts.get(key)
+            if part is None:
+                self.agent.log.debug("Ответ %s от %s на прошлые переговоры проигнорирован", msg_type, msg.sender)
+                self.dropped(msg_type, "stale")
+            return key, part
+
+        def handle_confirmed(self, msg, data):
+            _, part = self.find_part(msg, "delivery_confirmed")
+            if part is None:
+                return
+            part["confirmed"] = True
+            if len(self.agent.parts) > 1 or self.agent.outstanding:
+                self.agent.log.info("%s подтвердил часть заказа %s", data.get("vehicle_id"), part["products"])
+            else:
+                self.agent.log.info("%s подтвердил заказ", data.get("vehicle_id"))
+            self.agent.check_assigned()
+
+        def handle_rejected(self, msg, data):
+            key, part = self.find_part(msg, "delivery_rejected")
+            if part is None:
+                return
+            self.agent.log.info("%s отклонил заказ: %s", data.get("vehicle_id"), data.get("reason"),
+                                extra={"event": "rejected", "reason": data.get("reason")})
+            # Непустой outstanding значит, что повтор уже запланирован или идет раунд
+            retry_pending = bool(self.agent.outstanding)
+            self.agent.unplace(key)
+            self.agent.best_proposal_selected = False
+            if not retry_pending:
+                self.agent.schedule_retry("rejected")
+
+        def handle_capacity_available(self, msg, data):
+            self.agent.wakeup.set()
+
+        def handle_position_report(self, msg, data):
+            if self.agent.spatial_index is not None:
+                self.agent.spatial_index.update(msg.sender.bare, data["position"], data["free_capacity"])
+
+        def handle_completed(self, msg, data):
+            key = (msg.thread, str(msg.sender.bare))
+            part = self.agent.parts.pop(key, None)
+            if part is None:
+                self.agent.log.debug("Доставка от %s не относится к заказу, проигнорирована", msg.sender)
+                self.dropped("delivery_completed", "stale")
+                return
+
+            closed = not self.agent.parts and not self.agent.outstanding
+            if closed:
+                self.agent.log.info("ТОВАР ПОЛУЧЕН от %s. Заказ закрыт.", data.get("vehicle_id"),
+                                    extra={"event": "delivered", "vehicle_id": data.get("vehicle_id")})
+                self.agent.best_proposal_selected = False
+            else:
+                self.agent.log.info("Получена часть заказа %s от %s", part["products"], data.get("vehicle_id"),
+                                    extra={"event": "part_delivered", "vehicle_id": data.get("vehicle_id")})
+            self.agent.part_delivered(key, closed)
+
+        def handle_proposal(self, msg, data):
+            vid = data.get('vehicle_id')
+            round_ = self.open_round(msg, "delivery_proposal")
+            if round_ is None:
+                return
+
+            # Сохраняем JID отправителя для ответа
+            vehicle_jid = str(msg.sender.bare)
+            data["vehicle_jid"] = vehicle_jid
+            if not round_.add_response(vehicle_jid, data):
+                return
+
+            if data.get("can_deliver"):
+                self.agent.log.debug("Принято предложение от %s: Стоимость %.2f", vid, data.get("cost"))
+            else:
+                self.agent.log.debug("Получен отказ от %s: %s", vid, data.get("reason"))
+
+        def handle_proposal_batch(self, msg, data):
+            """Предложения всех автомобилей по заказу, собранные диспетчером"""
+            round_ = self.open_round(msg, "delivery_proposal_batch")
+            if round_ is None:
+                return
+            proposals = data.get("proposals", [])
+
+            if not round_.add_responses(str(msg.sender.bare), proposals):
+                return
+
+            accepted = sum(1 for p in proposals if p.get("can_deliver"))
+            self.agent.log.debug("Получено от диспетчера: %d предложений, %d отказов",
+                                 accepted, len(proposals) - accepted)
+
+        def handle_assignment(self, msg, data):
+            """Назначение автомобиля диспетчером (режим глобального распределения)"""
+            round_ = self.open_round(msg, "delivery_assigned")
+            if round_ is None:
+                return
+
+            proposal = data.get("proposal")
+            if proposal and proposal.get("vehicle_jid"):
+                round_.assignment = proposal
+            round_.add_responses(str(msg.sender.bare), [])
+
+    def schedule_retry(self, cause):
+        """Повтор запроса по политике повторов.
+
+        Возвращает задержку до повтора или None, если попытки исчерпаны.
+        """
+        self.retries += 1
+        if self.metrics is not None:
+            self.metrics.retry(cause)
+        if self.retry_policy.exhausted(self.retries):
+            self.log.warning("Заказ не размещен после %d повторов. Запросы прекращены.", self.retries - 1,
+                             extra={"event": "abandoned", "attempts": self.retries - 1})
+            self.order_abandoned("max_attempts")
+            return None
+
+        delay = self.retry_policy.delay(self.retries, self.rng)
+        # Уведомления, пришедшие до этого момента, относятся к прошлой попытке
+        self.wakeup.clear()
+        self.add_behaviour(self.SendRequestBehaviour(delay))
+        return delay
+
+    def order_abandoned(self, cause):
+        if self.metrics is not None:
+            self.metrics.order_abandoned(cause)
+        if self.journal is not None:
+            self.journal.record("abandon", shop=str(self.jid.bare), shop_id=self.shop_id, cause=cause)
+        self.requested_at = None
+        self.retries = 0
+
+    def place(self, key, products):
+        """Часть заказа отдана автомобилю: key = (conversation_id, jid автомобиля)"""
+        if key in self.parts:
+            return
+        self.parts[key] = {"products": dict(products), "confirmed": False}
+        for product, quantity in products.items():
+            left = self.outstanding.get(product, 0) - quantity
+            if left > 0:
+                self.outstanding[product] = left
+            else:
+                self.outstanding.pop(product, None)
+
+    def unplace(self, key):
+        """Автомобиль отклонил часть заказа: ее товары снова ждут размещения"""
+        part = self.parts.pop(key)
+        for product, quantity in part["products"].items():
+            self.outstanding[product] = self.outstanding.get(product, 0) + quantity
+
+    def check_assigned(self):
+        """Весь заказ размещен и подтвержден всеми автомобилями"""
+        if not self.outstanding and self.parts and all(part["confirmed"] for part in self.parts.values()):
+            self.order_assigned()
+
+    def order_assigned(self):
+        if self.metrics is not None and self.requested_at is not None:
+            self.metrics.order_assigned(self.requested_at, self.clock.now(), self.retries)
+        if self.journal is not None:
+            self.journal.record("confirm", shop=str(self.jid.bare), shop_id=self.shop_id,
+                                parts=[{"conversation_id": conversation_id, "vehicle": vehicle,
+                                        "products": part["products"]}
+                                       for (conversation_id, vehicle), part in self.parts.items()])
+
+    def part_delivered(self, key, closed):
+        """Доставлена часть заказа; closed - заказ получен полностью"""
+        if self.journal is not None:
+            self.journal.record("receive", shop=str(self.jid.bare), shop_id=self.shop_id,
+                                conversation_id=key[0], vehicle=key[1], closed=closed)
+        if closed:
+            self.order_delivered()
+
+    def order_delivered(self):
+        """Заказ закрыт: следующий запрос начнет новый отсчет"""
+        if self.metrics is not None:
+            self.metrics.order_delivered(self.requested_at, self.clock.now())
+        self.requested_at = None
+        self.retries = 0
+
+    def fits_time_window(self, proposal):
+        """Попадает ли обещанное время прибытия в окно приема магазина"""
+        arrival = proposal.get("arrival_time")
+        if arrival is None or not self.time_window:
+            return True
+        return self.time_window[0] - 1e-6 <= arrival <= self.time_window[1] + 1e-6
 
     async def setup(self):
-        print(f"[INFO] Магазин {self.shop_id} запущен в точке {self.location}")
-        self.add_behaviour(self.SendRequestBehaviour())
-        self.add_behaviour(self.ReceiveProposalBehaviour())
\ No newline at end of file
+        self.log.info("Магазин запущен в точке %s", self.location)
+        state = self.journal.shop_state(self.jid.bare) if self.journal is not None else None
+        if state is not None:
+            self.restore(state)
+        # Повторно размещаются только товары, не отданные автомобилям до перезапуска
+        if self.outstanding and (state is None or state["status"] != SHOP_ABANDONED):
+            self.add_behaviour(self.SendRequestBehaviour())
+        self.add_behaviour(self.ReceiveProposalBehaviour())
+
+    def restore(self, state):
+        """Восстановление из журнала: части заказа, отданные автомобилям"""
+        self.retries = state["retries"]
+        if state["status"] == SHOP_DELIVERED:
+            self.outstanding = {}
+        for part in state["parts"].values():
+            self.place((part["conversation_id"], part["vehicle"]), part["products"])
+            if part["delivered"]:
+                del self.parts[(part["conversation_id"], part["vehicle"])]
+            else:
+                self.parts[(part["conversation_id"], part["vehicle"])]["confirmed"] = True
+        if state["status"] != SHOP_REQUESTED or self.parts:
+            self.best_proposal_selected = bool(self.parts)
+            self.log.info("Заказ восстановлен из журнала: %s, частей в пути %d, не размещено %s",
+                          state["status"], len(self.parts), self.outstanding or "ничего",
+                          extra={"event": "restored", "status": state["status"], "parts": len(self.parts)})
\ No newline at end of file
@@ -0,0 +1,129 @@
+INFEASIBLE = float("inf")
+
+# Конечная замена бесконечности внутри венгерского алгоритма
+_BIG_COST = 1e15
+
+
+def hungarian(cost):
+    """Венгерский алгоритм для прямоугольной матрицы стоимости.
+
+    Возвращает список пар (строка, столбец) минимальной суммарной стоимости.
+    Пары с недопустимой стоимостью (INFEASIBLE) в результат не попадают.
+    """
+    n = len(cost)
+    if n == 0 or len(cost[0]) == 0:
+        return []
+    m = len(cost[0])
+
+    # Алгоритм требует строк не больше, чем столбцов
+    transposed = n > m
+    matrix = [list(col) for col in zip(*cost)] if transposed else cost
+    if transposed:
+        n, m = m, n
+    matrix = [[c if c != INFEASIBLE else _BIG_COST for c in row] for row in matrix]
+
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [float("inf")] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = matrix[i0 - 1]
+            delta = float("inf")
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+
+    pairs = [(p[j] - 1, j - 1) for j in range(1, m + 1) if p[j] != 0]
+    if transposed:
+        pairs = [(col, row) for row, col in pairs]
+    return [(r, c) for r, c in pairs if cost[r][c] != INFEASIBLE]
+
+
+def solve_assignment(cost, demands, free_capacity, loads=None, free_load=None):
+    """Глобальное распределение заказов по автомобилям с учетом вместимости.
+
+    cost[i][j]      - стоимость доставки заказа i автомобилем j (INFEASIBLE - нет предложения);
+    demands[i]      - объем заказа i;
+    free_capacity[j] - свободное место автомобиля j;
+    loads[i][j]     - груз заказа i по отсекам автомобиля j (None - товару нет отсека);
+    free_load[j]    - свободное место автомобиля j по отсекам.
+
+    Без loads и free_load проверяется только общее место. С ними заказ
+    помещается, если хватает и общего места, и места в каждом отсеке, - так
+    же, как проверяет CapacityLedger автомобиля.
+
+    Каждая итерация решает задачу о назначениях венгерским алгоритмом для
+    оставшихся заказов, после чего вместимость назначенных автомобилей
+    уменьшается. Так один автомобиль может получить несколько заказов,
+    пока у него есть место. Возвращает (назначения {заказ: автомобиль},
+    суммарная стоимость, число итераций).
+    """
+    remaining = list(free_capacity)
+    remaining_load = [list(free) for free in free_load] if free_load is not None else None
+
+    def fits(i, j):
+        if demands[i] > remaining[j]:
+            return False
+        if remaining_load is None:
+            return True
+        load = loads[i][j]
+        return load is not None and all(q <= free for q, free in zip(load, remaining_load[j]))
+
+    unassigned = list(range(len(demands)))
+    assignment = {}
+    total_cost = 0.0
+    iterations = 0
+
+    while unassigned:
+        iterations += 1
+        matrix = [
+            [cost[i][j] if fits(i, j) else INFEASIBLE for j in range(len(remaining))]
+            for i in unassigned
+        ]
+        pairs = hungarian(matrix)
+        if not pairs:
+            break
+
+        for row, j in pairs:
+            i = unassigned[row]
+            # Повторная проверка: в одной итерации автомобиль получает не больше одного заказа
+            if fits(i, j):
+                assignment[i] = j
+                remaining[j] -= demands[i]
+                if remaining_load is not None:
+                    remaining_load[j] = [free - q for free, q in zip(remaining_load[j], loads[i][j])]
+                total_cost += cost[i][j]
+
+        unassigned = [i for i in unassigned if i not in assignment]
+
+    return assignment, total_cost, iterations
\ No newline at end of file
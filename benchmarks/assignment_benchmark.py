@@ -0,0 +1,168 @@
+"""Сравнение жадного протокола (каждый магазин выбирает сам) с глобальным
+распределением диспетчера: суммарная стоимость и число раундов до сходимости.
+
+Обе стратегии считаются на упрощенной модели, а не на агентах: матрица
+стоимости и вместимость без окон приема и отсеков, автомобили не
+освобождают место между раундами. Раунды обеих стратегий считаются
+одинаково - пока все заказы не назначены или очередной раунд не назначил
+ни одного (оставшиеся заказы не помещаются ни в один автомобиль).
+
+Запуск:
+    python benchmarks/assignment_benchmark.py --sizes 10x5,100x40 --seeds 5
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from assignment import INFEASIBLE, solve_assignment
+
+TARIFF_PER_KM = 10
+
+
+def generate_instance(n_shops, n_vehicles, rng):
+    """Случайный набор магазинов и автомобилей с матрицей стоимости"""
+    vehicles = [((rng.uniform(0, 50), rng.uniform(0, 50)), rng.randint(80, 150)) for _ in range(n_vehicles)]
+    shops = [((rng.uniform(0, 50), rng.uniform(0, 50)), rng.randint(20, 80)) for _ in range(n_shops)]
+
+    cost = []
+    for location, _ in shops:
+        row = []
+        for position, _ in vehicles:
+            distance = ((location[0] - position[0]) ** 2 + (location[1] - position[1]) ** 2) ** 0.5
+            row.append(distance * TARIFF_PER_KM)
+        cost.append(row)
+
+    demands = [demand for _, demand in shops]
+    capacity = [cap for _, cap in vehicles]
+    return cost, demands, capacity
+
+
+def simulate_greedy(cost, demands, capacity, rng, max_rounds=100):
+    """Модель текущего протокола: каждый магазин независимо берет самое дешевое предложение.
+
+    Автомобиль подтверждает заказы в порядке прихода, пока есть место;
+    проигравшие магазины повторяют запрос в следующем раунде.
+    """
+    remaining = list(capacity)
+    unassigned = set(range(len(demands)))
+    total_cost = 0.0
+    rounds = 0
+
+    while unassigned and rounds < max_rounds:
+        choices = {}
+        for i in unassigned:
+            feasible = [j for j in range(len(remaining))
+                        if cost[i][j] != INFEASIBLE and demands[i] <= remaining[j]]
+            if feasible:
+                choices[i] = min(feasible, key=lambda j: cost[i][j])
+        if not choices:
+            break
+        rounds += 1
+
+        # Подтверждения приходят к автомобилям в случайном порядке
+        arrival = list(choices)
+        rng.shuffle(arrival)
+        for i in arrival:
+            j = choices[i]
+            if demands[i] <= remaining[j]:
+                remaining[j] -= demands[i]
+                total_cost += cost[i][j]
+                unassigned.discard(i)
+
+    return len(demands) - len(unassigned), total_cost, rounds
+
+
+def simulate_global(cost, demands, capacity, max_rounds=100):
+    """Модель глобального распределения: каждый раунд диспетчера решает задачу
+    о назначениях для еще не назначенных заказов на оставшемся месте"""
+    remaining = list(capacity)
+    unassigned = list(range(len(demands)))
+    total_cost = 0.0
+    rounds = 0
+    iterations = 0
+
+    while unassigned and rounds < max_rounds:
+        assignment, round_cost, round_iterations = solve_assignment(
+            [cost[i] for i in unassigned], [demands[i] for i in unassigned], remaining)
+        iterations += round_iterations
+        if not assignment:
+            break
+        rounds += 1
+        for row, j in assignment.items():
+            remaining[j] -= demands[unassigned[row]]
+        total_cost += round_cost
+        unassigned = [i for row, i in enumerate(unassigned) if row not in assignment]
+
+    return len(demands) - len(unassigned), total_cost, rounds, iterations
+
+
+def run(sizes, seeds):
+    results = []
+    for n_shops, n_vehicles in sizes:
+        for seed in range(seeds):
+            rng = random.Random(seed)
+            cost, demands, capacity = generate_instance(n_shops, n_vehicles, rng)
+
+            started = time.perf_counter()
+            greedy_assigned, greedy_cost, greedy_rounds = simulate_greedy(cost, demands, capacity, rng)
+            greedy_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            global_assigned, global_cost, global_rounds, iterations = simulate_global(cost, demands, capacity)
+            global_time = time.perf_counter() - started
+
+            results.append({
+                "shops": n_shops,
+                "vehicles": n_vehicles,
+                "seed": seed,
+                "greedy": {"assigned": greedy_assigned, "total_cost": greedy_cost,
+                           "rounds": greedy_rounds, "seconds": greedy_time},
+                "global": {"assigned": global_assigned, "total_cost": global_cost,
+                           "rounds": global_rounds, "solver_iterations": iterations, "seconds": global_time},
+            })
+    return results
+
+
+def print_table(results):
+    # Число назначенных заказов у стратегий может различаться,
+    # поэтому рядом с суммой выводится стоимость на один заказ
+    print("Модель без агентов; раунды - до назначения всех заказов или до раунда без назначений")
+    print(f"{'Размер':<9} | {'Жадный: назн.':<13} | {'сумма':<9} | {'на заказ':<8} | {'раунды':<6} | "
+          f"{'Глоб.: назн.':<12} | {'сумма':<9} | {'на заказ':<8} | {'раунды':<6} | {'время, с':<8}")
+    print("-" * 112)
+    for r in results:
+        g, o = r["greedy"], r["global"]
+        size = f"{r['shops']}x{r['vehicles']}"
+        print(f"{size:<9} | {g['assigned']:>4}/{r['shops']:<8} | {g['total_cost']:<9.1f} | "
+              f"{g['total_cost'] / max(g['assigned'], 1):<8.1f} | {g['rounds']:<6} | "
+              f"{o['assigned']:>4}/{r['shops']:<7} | {o['total_cost']:<9.1f} | "
+              f"{o['total_cost'] / max(o['assigned'], 1):<8.1f} | {o['rounds']:<6} | {o['seconds']:<8.3f}")
+
+
+def parse_sizes(value):
+    return [tuple(int(x) for x in item.split("x")) for item in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Жадный протокол против глобального распределения")
+    parser.add_argument("--sizes", type=parse_sizes, default=parse_sizes("10x5,50x20,100x40,200x80"),
+                        help="Размеры задач в виде МАГАЗИНЫxАВТОМОБИЛИ через запятую")
+    parser.add_argument("--seeds", type=int, default=3, help="Число случайных наборов на размер")
+    parser.add_argument("--output", help="Файл для сохранения результатов в JSON")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.seeds)
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,121 @@
+"""Стоимость кодирования и разбора сообщений протокола для каждого кодека:
+микросекунды на сообщение и размер тела в байтах.
+
+Запуск:
+    python benchmarks/codec_benchmark.py --repeat 20000 --batch 50
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from codec import CODECS, available_codecs
+
+
+def sample_messages(batch_size):
+    """Типичные сообщения протокола (размер пакетов задается batch_size)"""
+    request = {
+        "type": "delivery_request",
+        "shop_id": "shop1",
+        "location": [10, 20],
+        "products": {"product1": 50, "product2": 30},
+        "time_window": [8, 18],
+        "timestamp": "2024-01-01T08:00:00.000000"
+    }
+    proposal = {
+        "type": "delivery_proposal",
+        "vehicle_id": "vehicle1",
+        "shop_id": "shop1",
+        "can_deliver": True,
+        "cost": 223.6068,
+        "estimated_time": 0.3727,
+        "arrival_time": 8.3727,
+        "waiting_time": 0.0,
+        "distance": 22.3607,
+        "capacity_available": 100
+    }
+    order = dict(request, shop_jid="shop1@localhost")
+    del order["type"]
+    return {
+        "delivery_request": request,
+        "delivery_proposal": proposal,
+        "accept_delivery": {
+            "type": "accept_delivery",
+            "shop_id": "shop1",
+            "shop_jid": "shop1@localhost",
+            "location": [10, 20],
+            "time_window": [8, 18],
+            "products": {"product1": 50, "product2": 30}
+        },
+        "delivery_completed": {"type": "delivery_completed", "vehicle_id": "vehicle1", "shop_id": "shop1"},
+        "batch_delivery_request": {"type": "batch_delivery_request", "batch_id": 1, "orders": [order] * batch_size},
+        "batch_delivery_proposal": {
+            "type": "batch_delivery_proposal",
+            "vehicle_id": "vehicle1",
+            "batch_id": 1,
+            "bids": [proposal] * batch_size
+        },
+    }
+
+
+def measure(codec, data, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = codec.encode(data)
+    encode_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        codec.decode(body)
+    decode_time = time.perf_counter() - started
+
+    return {
+        "encode_us": encode_time / repeat * 1e6,
+        "decode_us": decode_time / repeat * 1e6,
+        "bytes": len(body.encode("utf-8"))
+    }
+
+
+def run(codec_names, repeat, batch_size):
+    results = []
+    for message_type, data in sample_messages(batch_size).items():
+        # Пакеты в batch_size раз крупнее, их повторяем реже
+        n = max(repeat // batch_size, 1) if message_type.startswith("batch") else repeat
+        for name in codec_names:
+            codec = CODECS[name]()
+            result = measure(codec, data, n)
+            result.update({"message": message_type, "codec": name, "repeat": n})
+            results.append(result)
+    return results
+
+
+def print_table(results):
+    print(f"{'Сообщение':<24} | {'Кодек':<8} | {'кодир., мкс':<11} | {'разбор, мкс':<11} | {'байт':<7}")
+    print("-" * 72)
+    for r in results:
+        print(f"{r['message']:<24} | {r['codec']:<8} | {r['encode_us']:<11.2f} | "
+              f"{r['decode_us']:<11.2f} | {r['bytes']:<7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарк кодеков сообщений")
+    parser.add_argument("--codecs", default=",".join(available_codecs()),
+                        help="Кодеки через запятую (по умолчанию все доступные)")
+    parser.add_argument("--repeat", type=int, default=20000, help="Повторов на одиночное сообщение")
+    parser.add_argument("--batch", type=int, default=50, help="Заказов в пакетных сообщениях")
+    parser.add_argument("--output", help="Файл для сохранения результатов в JSON")
+    args = parser.parse_args()
+
+    results = run(args.codecs.split(","), args.repeat, args.batch)
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
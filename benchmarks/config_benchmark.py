@@ -0,0 +1,133 @@
+"""Загрузка конфигурации большого парка: время чтения и проверки файла
+в форматах JSON, JSON Lines и CSV, пиковая память при чтении и стоимость
+поиска записи по id (повторный вызов берет индекс из кэша).
+
+Запуск:
+    python benchmarks/config_benchmark.py --rows 100000
+"""
+import argparse
+import csv
+import json
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config.config_loader import ConfigLoader
+
+
+def generate_vehicles(n, rng):
+    return [{
+        "id": i,
+        "jid": f"vehicle{i}@localhost",
+        "password": f"vehicle{i}",
+        "capacity": rng.randint(80, 150),
+        "speed": rng.choice((40, 50, 60)),
+        "name": f"Грузовик-{i}",
+        "position": [round(rng.uniform(0, 1000), 3), round(rng.uniform(0, 1000), 3)],
+    } for i in range(n)]
+
+
+def write_files(directory, vehicles):
+    """Один и тот же парк в трех форматах, каждый в своей директории
+    (иначе поиск по id нашел бы vehicles.json в любой из них)"""
+    for suffix in ("json", "jsonl", "csv"):
+        (directory / suffix).mkdir()
+    with open(directory / "json" / "vehicles.json", "w", encoding="utf-8") as f:
+        json.dump({"xmpp_server": "localhost", "vehicles": vehicles}, f, ensure_ascii=False)
+    with open(directory / "jsonl" / "vehicles.jsonl", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"xmpp_server": "localhost"}) + "\n")
+        for v in vehicles:
+            f.write(json.dumps(v, ensure_ascii=False) + "\n")
+    with open(directory / "csv" / "vehicles.csv", "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "jid", "password", "capacity", "speed", "name", "position_x", "position_y"])
+        for v in vehicles:
+            writer.writerow([v["id"], v["jid"], v["password"], v["capacity"], v["speed"], v["name"],
+                             *v["position"]])
+
+
+def peak_memory(function):
+    """Пиковый объем памяти, выделенной при вызове function, МБ (отдельный прогон:
+    tracemalloc сильно замедляет выполнение)"""
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def measure(directory, filename, lookups, rng):
+    directory = Path(directory) / filename.rpartition(".")[2]
+    loader = ConfigLoader(directory)
+    started = time.perf_counter()
+    config = loader.load_vehicles_config(filename)
+    load_seconds = time.perf_counter() - started
+    load_peak = peak_memory(lambda: ConfigLoader(directory).load_vehicles_config(filename))
+
+    # Потоковое чтение: записи проверяются по одной и не накапливаются
+    stream_seconds = stream_peak = None
+    if not filename.endswith(".json"):
+        started = time.perf_counter()
+        for _ in loader.iter_vehicles(filename):
+            pass
+        stream_seconds = time.perf_counter() - started
+        stream_peak = peak_memory(lambda: sum(1 for _ in loader.iter_vehicles(filename)))
+
+    n = len(config["vehicles"])
+    ids = [rng.randrange(n) for _ in range(lookups)]
+    started = time.perf_counter()
+    for vehicle_id in ids:
+        loader.get_vehicle_by_id(vehicle_id)
+    lookup_us = (time.perf_counter() - started) / lookups * 1e6
+
+    return {
+        "file": filename,
+        "rows": n,
+        "size_mb": (directory / filename).stat().st_size / 2 ** 20,
+        "load_seconds": load_seconds,
+        "load_peak_mb": load_peak,
+        "stream_seconds": stream_seconds,
+        "stream_peak_mb": stream_peak,
+        "lookup_us": lookup_us,
+    }
+
+
+def _fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка конфигурации большого парка")
+    parser.add_argument("--rows", type=int, default=100000, help="Автомобилей в файле")
+    parser.add_argument("--lookups", type=int, default=10000, help="Поисков по id после загрузки")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Файл для сохранения результатов в JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        write_files(directory, generate_vehicles(args.rows, rng))
+        print(f"{'Файл':<15} | {'МБ':<6} | {'загрузка, с':<11} | {'пик, МБ':<8} | "
+              f"{'поток, с':<8} | {'пик потока, МБ':<14} | {'поиск, мкс':<10}")
+        print("-" * 94)
+        for filename in ("vehicles.json", "vehicles.jsonl", "vehicles.csv"):
+            r = measure(directory, filename, args.lookups, rng)
+            results.append(r)
+            print(f"{r['file']:<15} | {r['size_mb']:<6.1f} | {r['load_seconds']:<11.3f} | "
+                  f"{r['load_peak_mb']:<8.1f} | {_fmt(r['stream_seconds'], '<8.3f')} | "
+                  f"{_fmt(r['stream_peak_mb'], '<14.2f')} | {r['lookup_us']:<10.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
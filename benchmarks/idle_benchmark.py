@@ -0,0 +1,129 @@
+"""Стоимость простаивающих агентов: сколько раз в секунду просыпается цикл
+событий, сколько таймеров он заводит и сколько процессорного времени уходит,
+когда агенты запущены, но сообщений нет.
+
+Агенты запускаются на внутрипроцессной шине в реальном времени. Магазины
+стартуют после закрытия своего окна приема и сразу прекращают запросы,
+поэтому после разогрева весь трафик отсутствует: остаются только
+собственные ожидания поведений.
+
+Запуск:
+    python benchmarks/idle_benchmark.py --agents 100,1000 --duration 5
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from agent import ShopAgent, DeliveryVehicleAgent
+from log import setup_logging, stop_logging
+from sim_clock import create_clock
+from transport import InMemoryTransport
+
+
+class LoopCounter:
+    """Подсчет итераций цикла событий (вызовов _run_once) и заведенных таймеров (call_at)"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.iterations = 0
+        self.timers = 0
+        self._run_once = loop._run_once
+        self._call_at = loop.call_at
+
+    def __enter__(self):
+        def run_once():
+            self.iterations += 1
+            self._run_once()
+
+        def call_at(*args, **kwargs):
+            self.timers += 1
+            return self._call_at(*args, **kwargs)
+
+        self.loop._run_once = run_once
+        self.loop.call_at = call_at
+        return self
+
+    def __exit__(self, *exc):
+        del self.loop._run_once
+        del self.loop.call_at
+
+
+async def measure(n_agents, duration, warmup):
+    transport = InMemoryTransport()
+    # Окно приема 0-1 ч уже закрыто к 8:00: магазины не шлют запросов
+    clock = create_clock("realtime", start_hour=8.0)
+    agents = []
+    for i in range(n_agents):
+        vehicle = DeliveryVehicleAgent(f"vehicle{i}@localhost", "bench", 100, 50, clock=clock)
+        shop = ShopAgent(f"shop{i}@localhost", "bench", f"shop{i}", (0, 0), (0, 1), {"product1": 1}, clock=clock)
+        shop.set("vehicles", [])
+        agents += [vehicle, shop]
+    for agent in agents:
+        await transport.start_agent(agent)
+
+    await asyncio.sleep(warmup)
+    loop = asyncio.get_running_loop()
+    with LoopCounter(loop) as counter:
+        started, cpu_started = time.perf_counter(), time.process_time()
+        await asyncio.sleep(duration)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+    pending_timers = len(loop._scheduled)
+
+    for agent in agents:
+        await transport.stop_agent(agent)
+
+    return {
+        "agents": len(agents),
+        "seconds": elapsed,
+        "wakeups_per_second": counter.iterations / elapsed,
+        "timers_per_second": counter.timers / elapsed,
+        "cpu_percent": 100 * cpu / elapsed,
+        "pending_timers": pending_timers,
+    }
+
+
+def run_in_process(n_agents, duration, warmup):
+    """Точка входа дочернего процесса: SPADE не рассчитан на несколько asyncio.run в одном процессе"""
+    listener = setup_logging(quiet=True)
+    try:
+        return asyncio.run(measure(n_agents, duration, warmup))
+    finally:
+        stop_logging(listener)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузка простаивающих агентов на цикл событий")
+    parser.add_argument("--agents", default="100,1000",
+                        help="Числа пар автомобиль+магазин через запятую")
+    parser.add_argument("--duration", type=float, default=5.0, help="Длительность измерения, с")
+    parser.add_argument("--warmup", type=float, default=3.0,
+                        help="Разогрев перед измерением (магазины успевают завершить старт), с")
+    parser.add_argument("--output", help="Файл для сохранения результатов в JSON")
+    args = parser.parse_args()
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    print(f"{'Агентов':<8} | {'пробуждений/с':<14} | {'таймеров/с':<11} | {'CPU, %':<7} | {'ждут таймеры':<12}")
+    print("-" * 64)
+    for n in (int(x) for x in args.agents.split(",")):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            r = pool.submit(run_in_process, n, args.duration, args.warmup).result()
+        results.append(r)
+        print(f"{r['agents']:<8} | {r['wakeups_per_second']:<14.1f} | {r['timers_per_second']:<11.1f} | "
+              f"{r['cpu_percent']:<7.1f} | {r['pending_timers']:<12}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
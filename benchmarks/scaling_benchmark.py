@@ -0,0 +1,372 @@
+"""Масштабирование системы: синтетические парки автомобилей и наборы заказов
+с фиксированным зерном, прогон настоящих агентов на внутрипроцессной шине
+в виртуальном времени. Измеряются пропускная способность, p50/p99 реального
+времени назначения заказа, суммарная длина маршрутов и пиковая память.
+
+Каждый прогон запускается в отдельном процессе, чтобы пиковая память
+не смешивалась между прогонами. Метрики реального времени зашумлены:
+каждый размер повторяется --repeats раз, в результат идет медиана, а
+разброс повторов учитывается при сравнении. Результаты сохраняются в JSON
+и могут сравниваться с предыдущим запуском (--compare) для поиска регрессий.
+
+Запуск:
+    python benchmarks/scaling_benchmark.py --sizes 10,100,1000 --output scaling.json
+    python benchmarks/scaling_benchmark.py --sizes 10,100,1000 --compare scaling.json
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import math
+import multiprocessing
+import platform
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from agent import ShopAgent, DeliveryVehicleAgent
+from log import setup_logging, stop_logging
+from metrics import DeliveryMetrics
+from sim_clock import create_clock
+from spatial_index import SpatialIndex
+from transport import InMemoryTransport
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+START_HOUR = 8.0
+# Плотность: один магазин на 100 км², автомобиль на каждые vehicle_ratio магазинов
+KM2_PER_SHOP = 100.0
+
+# Метрики сравнения: имя -> True, если больше - лучше
+COMPARED = {
+    "throughput": True,
+    "wall_p50": False,
+    "wall_p99": False,
+    "route_km": False,
+    "peak_rss_mb": False,
+}
+# Метрики, зависящие от реального времени и загрузки машины: медиана по повторам.
+# Остальные в виртуальном времени при том же зерне от повтора не зависят
+TIMED = ("seconds", "throughput", "messages_per_second", "wall_p50", "wall_p99", "peak_rss_mb")
+
+
+def area_side(n_shops):
+    return math.sqrt(n_shops * KM2_PER_SHOP)
+
+
+def generate_fleet(n_vehicles, side, rng):
+    """Автомобили со случайной позицией, вместимостью и скоростью"""
+    return [{
+        "jid": f"vehicle{i}@localhost",
+        "capacity": rng.randint(80, 150),
+        "speed": rng.choice((40, 50, 60)),
+        "position": (rng.uniform(0, side), rng.uniform(0, side)),
+    } for i in range(n_vehicles)]
+
+
+def generate_shops(n_shops, side, rng):
+    """Магазины со случайной точкой, окном приема и заказом из двух товаров"""
+    shops = []
+    for i in range(n_shops):
+        open_hour = rng.choice((8, 9, 10, 12, 14))
+        shops.append({
+            "jid": f"shop{i}@localhost",
+            "shop_id": f"shop{i}",
+            "location": (rng.uniform(0, side), rng.uniform(0, side)),
+            "time_window": (open_hour, open_hour + rng.choice((4, 6, 8))),
+            "needs": {"product1": rng.randint(5, 40), "product2": rng.randint(5, 30)},
+        })
+    return shops
+
+
+def percentile(values, q):
+    """Точный процентиль (линейная интерполяция между соседними значениями)"""
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+class RecordingMetrics(DeliveryMetrics):
+    """Метрики с сохранением каждого значения времени назначения (для точных квантилей)"""
+
+    def __init__(self):
+        super().__init__()
+        self.started = time.perf_counter()
+        self.wall_latencies = []
+
+
+class ShopMetrics:
+    """Метрики одного магазина: реальное время от его первого запроса до подтверждения.
+
+    В виртуальном времени ответы приходят мгновенно, и модельное время
+    назначения равно нулю без повторов; реальное время показывает, сколько
+    заказ ждал обработки в агентах.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.requested_wall = None
+
+    def __getattr__(self, name):
+        return getattr(self.metrics, name)
+
+    def order_requested(self):
+        self.requested_wall = time.perf_counter()
+        self.metrics.order_requested()
+
+    def order_assigned(self, requested_at, now, retries):
+        self.metrics.order_assigned(requested_at, now, retries)
+        if self.requested_wall is not None:
+            self.metrics.wall_latencies.append(time.perf_counter() - self.requested_wall)
+
+
+async def run_scenario(n_shops, n_vehicles, seed, nearest, codec, timeout):
+    rng = random.Random(seed)
+    side = area_side(n_shops)
+    fleet = generate_fleet(n_vehicles, side, rng)
+    shop_configs = generate_shops(n_shops, side, rng)
+
+    transport = InMemoryTransport()
+    clock = create_clock("virtual", start_hour=START_HOUR)
+    metrics = RecordingMetrics()
+    spatial_index = SpatialIndex(cell_size=max(side / 20, 5.0)) if nearest else None
+
+    vehicles = []
+    for v in fleet:
+        vehicle = DeliveryVehicleAgent(v["jid"], "bench", v["capacity"], v["speed"], clock=clock,
+                                       spatial_index=spatial_index, codec=codec, metrics=metrics,
+                                       position=v["position"])
+        await transport.start_agent(vehicle)
+        vehicles.append(vehicle)
+    vehicle_jids = [v["jid"] for v in fleet]
+
+    shops = []
+    for s in shop_configs:
+        shop = ShopAgent(s["jid"], "bench", s["shop_id"], s["location"], s["time_window"], s["needs"],
+                         clock=clock, spatial_index=spatial_index, candidate_count=nearest, codec=codec,
+                         metrics=ShopMetrics(metrics), rng=random.Random(f"{seed}:{s['shop_id']}"))
+        shop.set("vehicles", vehicle_jids)
+        shops.append(shop)
+
+    # Отсчет идет с момента запуска первого магазина: создание агентов не измеряется
+    metrics.started = time.perf_counter()
+    for shop in shops:
+        await transport.start_agent(shop)
+
+    # Прогон до назначения всех заказов, закрытия последнего окна приема или таймаута
+    horizon = max(s["time_window"][1] for s in shop_configs)
+    while (len(metrics.wall_latencies) < n_shops and clock.day_hours() < horizon
+           and time.perf_counter() - metrics.started < timeout):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - metrics.started
+
+    for agent in shops + vehicles:
+        await transport.stop_agent(agent)
+
+    route_km = sum(v.planned_distance() for v in vehicles)
+    messages = metrics.messages.total()
+    assigned = len(metrics.wall_latencies)
+    return {
+        "shops": n_shops,
+        "vehicles": n_vehicles,
+        "seed": seed,
+        "nearest": nearest,
+        "codec": codec,
+        "complete": assigned == n_shops,
+        "assigned": assigned,
+        "seconds": elapsed,
+        "model_hours": clock.day_hours() - START_HOUR,
+        "throughput": assigned / elapsed if elapsed > 0 else 0.0,
+        "messages": messages,
+        "messages_per_second": messages / elapsed if elapsed > 0 else 0.0,
+        "rounds": metrics.rounds.total(),
+        "retries": metrics.retries.total(),
+        # Время назначения: от первого запроса до подтверждения, секунды реального времени
+        # (модельное в виртуальном времени без повторов равно нулю)
+        "wall_p50": percentile(metrics.wall_latencies, 0.5),
+        "wall_p99": percentile(metrics.wall_latencies, 0.99),
+        "route_km": route_km,
+        "route_cost": sum(v.planned_distance() * v.tariff_per_km for v in vehicles),
+    }
+
+
+def run_in_process(n_shops, n_vehicles, seed, nearest, codec, timeout):
+    """Точка входа дочернего процесса: один сценарий и пиковая память процесса"""
+    listener = setup_logging(quiet=True)
+    try:
+        result = asyncio.run(run_scenario(n_shops, n_vehicles, seed, nearest, codec, timeout))
+    finally:
+        stop_logging(listener)
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result["peak_rss_mb"] = rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    else:
+        result["peak_rss_mb"] = None
+    return result
+
+
+def combine(repeats):
+    """Итог повторов одного сценария: медиана метрик реального времени.
+
+    spread - относительный разброс повторов (размах / медиана): изменения
+    меньше него при сравнении считаются шумом.
+    """
+    result = dict(repeats[0])
+    result["repeats"] = len(repeats)
+    result["spread"] = {}
+    for name in TIMED:
+        values = [r[name] for r in repeats if r.get(name) is not None]
+        if not values:
+            continue
+        median = statistics.median(values)
+        result[name] = median
+        result["spread"][name] = (max(values) - min(values)) / median if median else 0.0
+    return result
+
+
+def run(sizes, seeds, nearest, codec, timeout, repeats=3):
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for n_shops, n_vehicles in sizes:
+        for seed in range(seeds):
+            runs = []
+            for _ in range(repeats):
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    runs.append(pool.submit(run_in_process, n_shops, n_vehicles, seed, nearest, codec,
+                                            timeout).result())
+            result = combine(runs)
+            results.append(result)
+            print_row(result)
+    return results
+
+
+def print_header():
+    print(f"{'Размер':<12} | {'зерно':<5} | {'назн.':<11} | {'время, с':<8} | {'заказ/с':<8} | "
+          f"{'сообщ/с':<8} | {'p50, мс':<7} | {'p99, мс':<7} | {'маршр., км':<10} | {'память, МБ':<10}")
+    print("-" * 112)
+
+
+def _fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def print_row(r):
+    size = f"{r['shops']}x{r['vehicles']}"
+    assigned = f"{r['assigned']}/{r['shops']}" + ("" if r["complete"] else "*")
+    print(f"{size:<12} | {r['seed']:<5} | {assigned:<11} | {r['seconds']:<8.2f} | {r['throughput']:<8.1f} | "
+          f"{r['messages_per_second']:<8.0f} | {_fmt(_ms(r['wall_p50']), '<7.1f')} | "
+          f"{_fmt(_ms(r['wall_p99']), '<7.1f')} | {r['route_km']:<10.1f} | {_fmt(r['peak_rss_mb'], '<10.1f')}")
+
+
+def compare(baseline, results, tolerance):
+    """Сравнение с прошлым запуском. Возвращает число регрессий больше tolerance.
+
+    Изменение считается в долях от базового значения; если базовое значение
+    равно нулю, - разностью в единицах метрики, и tolerance тогда задает
+    допустимую разность. Для метрик реального времени допуск не меньше
+    разброса повторов в любом из двух запусков: шум регрессией не считается.
+    """
+    previous = {(r["shops"], r["vehicles"], r["seed"]): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\nСравнение с базовым запуском (допуск {tolerance:.0%}):")
+    for r in results:
+        base = previous.get((r["shops"], r["vehicles"], r["seed"]))
+        if base is None:
+            continue
+        changes = []
+        for name, higher_is_better in COMPARED.items():
+            old, new = base.get(name), r.get(name)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else new - old
+            worse = -change if higher_is_better else change
+            allowed = tolerance
+            if old:
+                allowed = max(tolerance, base.get("spread", {}).get(name, 0.0), r.get("spread", {}).get(name, 0.0))
+            mark = ""
+            if worse > allowed:
+                regressions += 1
+                mark = " РЕГРЕССИЯ"
+            shown = f"{change:+.1%}" if old else f"{change:+.3g} (база 0)"
+            changes.append(f"{name} {shown}{mark}")
+        print(f"  {r['shops']}x{r['vehicles']} (зерно {r['seed']}): " + ", ".join(changes))
+    return regressions
+
+
+def parse_sizes(value, vehicle_ratio=0.5):
+    """'10,100,1000x400' -> [(10, 5), (100, 50), (1000, 400)]"""
+    sizes = []
+    for item in value.split(","):
+        if "x" in item:
+            shops, vehicles = (int(x) for x in item.split("x"))
+        else:
+            shops = int(item)
+            vehicles = max(1, round(shops * vehicle_ratio))
+        sizes.append((shops, vehicles))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Масштабирование системы доставки на синтетических данных")
+    parser.add_argument("--sizes", default="10,100,1000",
+                        help="Размеры через запятую: число магазинов или МАГАЗИНЫxАВТОМОБИЛИ "
+                             "(например, 10,100,1000,10000)")
+    parser.add_argument("--vehicle-ratio", type=float, default=0.5,
+                        help="Автомобилей на один магазин, если размер задан одним числом")
+    parser.add_argument("--seeds", type=int, default=1, help="Число наборов данных (зерна 0..N-1) на размер")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Повторов каждого сценария: метрики реального времени - медиана по повторам")
+    parser.add_argument("--nearest", type=int, default=8,
+                        help="Рассылка запроса K ближайшим автомобилям (0 - всем; для больших размеров "
+                             "число сообщений растет как магазины x автомобили)")
+    parser.add_argument("--codec", default="json", help="Формат тела сообщений")
+    parser.add_argument("--timeout", type=float, default=600.0,
+                        help="Ограничение реального времени на один прогон, с")
+    parser.add_argument("--output", help="Файл для сохранения результатов в JSON")
+    parser.add_argument("--compare", help="Файл прошлого запуска для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Допустимое ухудшение метрики при сравнении (доля)")
+    args = parser.parse_args()
+
+    sizes = parse_sizes(args.sizes, args.vehicle_ratio)
+    print_header()
+    results = run(sizes, args.seeds, args.nearest, args.codec, args.timeout, max(1, args.repeats))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,193 @@
+import heapq
+import itertools
+
+# Отсек автомобиля без раздельных зон: принимает любые товары
+DEFAULT_COMPARTMENT = "general"
+
+
+class Compartments:
+    """Отсеки автомобиля: товарные или температурные зоны со своей вместимостью.
+
+    Описание в vehicles.json (необязательное поле автомобиля):
+
+        "compartments": {
+            "chilled": {"capacity": 40, "products": ["product3"]},
+            "ambient": {"capacity": 80}
+        }
+
+    Отсек без списка products принимает все товары, не закрепленные за
+    другими отсеками. Без compartments у автомобиля один общий отсек
+    размером capacity. Груз описывается вектором объемов по отсекам.
+    """
+
+    def __init__(self, capacity, config=None):
+        config = config or {DEFAULT_COMPARTMENT: {"capacity": capacity}}
+        self.names = tuple(config)
+        self.limits = tuple(compartment["capacity"] for compartment in config.values())
+        self._index = {}
+        self._default = None
+        for i, (name, compartment) in enumerate(config.items()):
+            products = compartment.get("products")
+            if products is None:
+                if self._default is not None:
+                    raise ValueError(f"Отсеки {self.names[self._default]} и {name} оба без списка товаров")
+                self._default = i
+                continue
+            for product in products:
+                if product in self._index:
+                    raise ValueError(f"Товар {product} закреплен за несколькими отсеками")
+                self._index[product] = i
+
+    def __len__(self):
+        return len(self.limits)
+
+    def index(self, product):
+        """Номер отсека для товара (None - товар этому автомобилю некуда положить)"""
+        return self._index.get(product, self._default)
+
+    def load(self, products):
+        """Вектор объемов по отсекам для {товар: количество} или None"""
+        load = [0] * len(self.limits)
+        for product, quantity in products.items():
+            i = self.index(product)
+            if i is None:
+                return None
+            load[i] += quantity
+        return load
+
+
+class Reservation:
+    """Временный резерв места под отправленное предложение"""
+
+    __slots__ = ("key", "load", "quantity", "expires_at", "details", "token")
+
+    def __init__(self, key, load, expires_at, details, token):
+        self.key = key
+        self.load = tuple(load)
+        self.quantity = sum(self.load)
+        self.expires_at = expires_at
+        self.details = details
+        self.token = token
+
+
+class CapacityLedger:
+    """Учет загрузки автомобиля: подтвержденный груз и резервы под предложения.
+
+    Место резервируется в момент отправки предложения и держится reservation_ttl
+    секунд модельного времени. Подтверждение (accept) переводит резерв в груз,
+    отказ или истечение срока освобождает место. Все методы синхронные, поэтому
+    проверка и изменение выполняются атомарно относительно цикла событий:
+    два предложения не могут занять одно и то же место.
+
+    Груз и резервы учитываются векторами по отсекам (committed_load,
+    reserved_load); груз помещается, если он не превышает свободного места
+    ни в одном отсеке и в сумме - общей вместимости capacity.
+    """
+
+    def __init__(self, capacity, reservation_ttl=10.0, compartments=None):
+        self.capacity = capacity
+        self.reservation_ttl = reservation_ttl
+        self.compartments = compartments or Compartments(capacity)
+        self.committed = 0
+        self.reserved = 0
+        self.committed_load = [0] * len(self.compartments)
+        self.reserved_load = [0] * len(self.compartments)
+        self._reservations = {}
+        self._expiry = []
+        self._tokens = itertools.count()
+
+    def free(self, now):
+        """Свободное место с учетом груза и действующих резервов"""
+        self._purge(now)
+        return self.capacity - self.committed - self.reserved
+
+    def free_load(self, now):
+        """Свободное место по отсекам"""
+        self._purge(now)
+        return [limit - committed - reserved for limit, committed, reserved
+                in zip(self.compartments.limits, self.committed_load, self.reserved_load)]
+
+    def fits(self, load, now):
+        """Помещается ли груз load (вектор по отсекам)"""
+        return sum(load) <= self.free(now) and all(q <= free for q, free in zip(load, self.free_load(now)))
+
+    def reserve(self, key, load, now, **details):
+        """Резерв места под предложение. Возвращает None, если места нет.
+
+        Повторный резерв с тем же ключом заменяет предыдущий.
+        """
+        self.release(key)
+        if not self.fits(load, now):
+            return None
+
+        reservation = Reservation(key, load, now + self.reservation_ttl, details, next(self._tokens))
+        self._reservations[key] = reservation
+        heapq.heappush(self._expiry, (reservation.expires_at, reservation.token, key))
+        self._add(reservation, self.reserved_load, 1)
+        self.reserved += reservation.quantity
+        return reservation
+
+    def release(self, key, conversation=None):
+        """Освобождение резерва (отказ магазина).
+
+        С conversation резерв снимается, только если сделан в этих же
+        переговорах: опоздавший отказ из прошлого раунда не снимает резерв
+        под новое предложение тому же магазину.
+        """
+        reservation = self._reservations.get(key)
+        if reservation is None:
+            return False
+        if conversation is not None and reservation.details.get("conversation") not in (None, conversation):
+            return False
+        del self._reservations[key]
+        self._unreserve(reservation)
+        return True
+
+    def commit(self, key, now, load=None, **details):
+        """Подтверждение заказа: резерв превращается в груз.
+
+        load - принятая магазином часть (по умолчанию весь резерв); остаток
+        резерва освобождается. Если резерв уже истек или не создавался,
+        заказ принимается только при наличии свободного места прямо сейчас.
+        Возвращает резерв с деталями заказа или None при нехватке места.
+        """
+        self._purge(now)
+        reservation = self._reservations.pop(key, None)
+        if reservation is not None:
+            self._unreserve(reservation)
+            if load is not None and tuple(load) != reservation.load:
+                if not self.fits(load, now):
+                    return None
+                reservation = Reservation(key, load, now, reservation.details, next(self._tokens))
+        else:
+            if load is None or not self.fits(load, now):
+                return None
+            reservation = Reservation(key, load, now, details, next(self._tokens))
+
+        self._add(reservation, self.committed_load, 1)
+        self.committed += reservation.quantity
+        return reservation
+
+    def complete(self, load):
+        """Груз выгружен у магазина"""
+        for i, q in enumerate(load):
+            self.committed_load[i] = max(0, self.committed_load[i] - q)
+        self.committed = max(0, self.committed - sum(load))
+
+    def _unreserve(self, reservation):
+        self._add(reservation, self.reserved_load, -1)
+        self.reserved -= reservation.quantity
+
+    @staticmethod
+    def _add(reservation, vector, sign):
+        for i, q in enumerate(reservation.load):
+            vector[i] += sign * q
+
+    def _purge(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, token, key = heapq.heappop(self._expiry)
+            reservation = self._reservations.get(key)
+            # В куче могут остаться записи уже замененных или снятых резервов
+            if reservation is not None and reservation.token == token:
+                del self._reservations[key]
+                self._unreserve(reservation)
\ No newline at end of file
@@ -0,0 +1,238 @@
+import base64
+import json
+
+try:
+    import msgpack
+except ImportError:  # msgpack необязателен: без него доступны только текстовые кодеки
+    msgpack = None
+
+
+class CodecError(ValueError):
+    """Тело сообщения не удалось закодировать или разобрать"""
+
+
+# Схемы сообщений протокола: порядок полей для позиционного кодирования.
+# Номер схемы - индекс типа в SCHEMA_TYPES, поэтому новые типы добавляются в конец.
+SCHEMAS = {
+    "delivery_request": ("shop_id", "location", "products", "time_window", "timestamp"),
+    "delivery_proposal": ("vehicle_id", "shop_id", "can_deliver", "cost", "estimated_time", "arrival_time",
+                          "waiting_time", "distance", "capacity_available", "reason", "products"),
+    "batch_delivery_request": ("batch_id", "orders", "reserve"),
+    "batch_delivery_proposal": ("vehicle_id", "batch_id", "bids"),
+    "delivery_proposal_batch": ("shop_id", "proposals"),
+    "delivery_assigned": ("shop_id", "proposal"),
+    "accept_delivery": ("shop_id", "shop_jid", "location", "time_window", "products"),
+    "reject_delivery": ("shop_id",),
+    "delivery_confirmed": ("vehicle_id", "shop_id"),
+    "delivery_rejected": ("vehicle_id", "shop_id", "reason"),
+    "delivery_completed": ("vehicle_id", "shop_id"),
+    "position_report": ("vehicle_id", "position", "free_capacity"),
+    "query_availability": (),
+    "availability_response": ("available",),
+    "subscribe_capacity": ("shop_id", "quantity"),
+    "capacity_available": ("vehicle_id", "free_capacity"),
+}
+SCHEMA_TYPES = list(SCHEMAS)
+_SCHEMA_IDS = {name: i for i, name in enumerate(SCHEMA_TYPES)}
+
+# Вложенные записи, которые тоже кодируются по схеме:
+# поле -> (схема записи, есть ли у записи свое поле type, список ли это записей)
+NESTED_SCHEMAS = {
+    "orders": ("delivery_request", False, True),
+    "bids": ("delivery_proposal", True, True),
+    "proposals": ("delivery_proposal", True, True),
+    "proposal": ("delivery_proposal", True, False),
+}
+
+
+class JsonCodec:
+    """JSON: читаемый формат, понятный любому агенту"""
+
+    name = "json"
+
+    def encode(self, data):
+        return json.dumps(data, separators=(",", ":"))
+
+    def decode(self, body):
+        try:
+            return json.loads(body)
+        except (TypeError, ValueError) as e:
+            raise CodecError(f"Неверный формат JSON: {e}") from e
+
+
+class MsgpackCodec:
+    """MessagePack в base64: тело сообщения SPADE должно быть строкой"""
+
+    name = "msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise CodecError("Кодек msgpack требует пакет msgpack (pip install msgpack)")
+
+    def encode(self, data):
+        return base64.b64encode(msgpack.packb(data, use_bin_type=True)).decode("ascii")
+
+    def decode(self, body):
+        try:
+            return msgpack.unpackb(base64.b64decode(body), raw=False, strict_map_key=False)
+        except Exception as e:
+            raise CodecError(f"Неверный формат msgpack: {e}") from e
+
+
+class SchemaCodec:
+    """Позиционное кодирование по схеме типа сообщения.
+
+    Вместо словаря передается [номер схемы, [значения полей], {прочие поля}]:
+    имена полей из SCHEMAS не попадают в тело. Заказы и ставки внутри
+    пакетов (NESTED_SCHEMAS) кодируются так же. Отсутствующее поле и поле
+    со значением None не различаются. Внешний формат - msgpack, если он
+    установлен, иначе компактный JSON.
+    """
+
+    name = "schema"
+
+    def __init__(self):
+        self._inner = MsgpackCodec() if msgpack is not None else JsonCodec()
+
+    def encode(self, data):
+        schema_id = _SCHEMA_IDS.get(data.get("type"))
+        if schema_id is None:
+            return self._inner.encode([-1, [], data])
+        return self._inner.encode([schema_id] + self._pack_record(data["type"], data, True))
+
+    def decode(self, body):
+        packed = self._inner.decode(body)
+        try:
+            schema_id = packed[0]
+            if schema_id < 0:
+                return dict(packed[2])
+            message_type = SCHEMA_TYPES[schema_id]
+            return self._unpack_record(message_type, packed[1:], True)
+        except (TypeError, IndexError, KeyError, AttributeError) as e:
+            raise CodecError(f"Неверный формат сообщения по схеме: {e}") from e
+
+    def _pack_record(self, schema, data, typed):
+        fields = SCHEMAS[schema]
+        values = [self._pack_field(field, data.get(field)) for field in fields]
+        while values and values[-1] is None:
+            values.pop()
+        extra = {k: v for k, v in data.items()
+                 if k not in fields and not (typed and k == "type" and v == schema)}
+        return [values, extra] if extra else [values]
+
+    def _unpack_record(self, schema, packed, typed):
+        data = {"type": schema} if typed else {}
+        for field, value in zip(SCHEMAS[schema], packed[0]):
+            if value is not None:
+                data[field] = self._unpack_field(field, value)
+        if len(packed) > 1:
+            data.update(packed[1])
+        return data
+
+    def _pack_field(self, field, value):
+        nested = NESTED_SCHEMAS.get(field)
+        if nested is None or value is None:
+            return value
+        schema, typed, many = nested
+        if not many:
+            return self._pack_record(schema, value, typed)
+        return [self._pack_record(schema, item, typed) for item in value]
+
+    def _unpack_field(self, field, value):
+        nested = NESTED_SCHEMAS.get(field)
+        if nested is None:
+            return value
+        schema, typed, many = nested
+        if not many:
+            return self._unpack_record(schema, value, typed)
+        return [self._unpack_record(schema, item, typed) for item in value]
+
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    MsgpackCodec.name: MsgpackCodec,
+    SchemaCodec.name: SchemaCodec,
+}
+
+
+def available_codecs():
+    """Кодеки, доступные в текущем окружении"""
+    return [name for name in CODECS if name != MsgpackCodec.name or msgpack is not None]
+
+
+class MessageCodec:
+    """Кодирование сообщений агента с согласованием формата.
+
+    Каждое сообщение несет метаданные encoding (формат тела) и
+    accept-encoding (форматы, которые отправитель умеет читать).
+    Получатель разбирает тело по encoding, запоминает accept-encoding
+    собеседника и отвечает ему первым общим форматом из своих
+    предпочтений. Собеседнику, о котором еще ничего не известно,
+    пишут в формате по умолчанию (первый в preferred). Сообщения без
+    метаданных encoding считаются JSON.
+    """
+
+    def __init__(self, preferred=("json",)):
+        if isinstance(preferred, str):
+            preferred = (preferred,)
+        self._codecs = {}
+        for name in preferred:
+            if name not in CODECS:
+                raise ValueError(f"Неизвестный кодек '{name}'. Доступны: {', '.join(CODECS)}")
+            self._codecs[name] = CODECS[name]()
+        # JSON понимают все агенты: это формат на случай несогласия
+        self._codecs.setdefault(JsonCodec.name, JsonCodec())
+        self.preferred = list(self._codecs)
+        self.accept_encoding = ",".join(self.preferred)
+        self._peers = {}
+
+    def choose(self, to):
+        """Формат для получателя с учетом его accept-encoding"""
+        accepted = self._peers.get(str(to))
+        if accepted is None:
+            return self.preferred[0]
+        for name in self.preferred:
+            if name in accepted:
+                return name
+        return JsonCodec.name
+
+    def encode(self, data, encoding=None):
+        return self._codecs[encoding or self.preferred[0]].encode(data)
+
+    def pack(self, msg, data):
+        """Заполнение тела и метаданных кодирования сообщения"""
+        encoding = self.choose(msg.to.bare)
+        msg.body = self._codecs[encoding].encode(data)
+        msg.set_metadata("encoding", encoding)
+        msg.set_metadata("accept-encoding", self.accept_encoding)
+        return msg
+
+    def pack_many(self, messages, data):
+        """Рассылка одних данных: тело кодируется один раз на каждый формат"""
+        bodies = {}
+        for msg in messages:
+            encoding = self.choose(msg.to.bare)
+            if encoding not in bodies:
+                bodies[encoding] = self._codecs[encoding].encode(data)
+            msg.body = bodies[encoding]
+            msg.set_metadata("encoding", encoding)
+            msg.set_metadata("accept-encoding", self.accept_encoding)
+        return messages
+
+    def unpack(self, msg):
+        """Разбор тела сообщения (CodecError при неизвестном или битом формате)"""
+        accepted = msg.get_metadata("accept-encoding")
+        if accepted:
+            self._peers[str(msg.sender.bare)] = accepted.split(",")
+
+        encoding = msg.get_metadata("encoding") or JsonCodec.name
+        codec = self._codecs.get(encoding)
+        if codec is None:
+            if encoding not in CODECS:
+                raise CodecError(f"Неизвестный формат сообщения '{encoding}'")
+            # Формат не из предпочтений, но прочитать его можно
+            codec = self._codecs[encoding] = CODECS[encoding]()
+        data = codec.decode(msg.body)
+        if not isinstance(data, dict):
+            raise CodecError("Тело сообщения должно быть объектом")
+        return data
\ No newline at end of file
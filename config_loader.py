@@ -1,45 +1,177 @@
+import csv
 import json
 import os
 from pathlib import Path
 
+VEHICLE_FIELDS = ("id", "jid", "password", "capacity", "speed")
+SHOP_FIELDS = ("id", "jid", "password", "shop_id", "location", "time_window", "needs")
+_VEHICLE_FIELD_SET = frozenset(VEHICLE_FIELDS)
+_SHOP_FIELD_SET = frozenset(SHOP_FIELDS)
+
+# Форматы файлов: .json - один документ, .jsonl - запись на строку, .csv - таблица
+CONFIG_SUFFIXES = (".json", ".jsonl", ".csv")
+
+# Числовые столбцы CSV; остальные остаются строками
+_CSV_NUMBERS = {
+    "id": int, "capacity": float, "speed": float, "tariff_per_km": float, "waiting_cost_per_hour": float,
+}
+# Пары столбцов CSV, которые собираются в список из двух чисел
+_CSV_PAIRS = {
+    "position": ("position_x", "position_y"),
+    "location": ("location_x", "location_y"),
+    "time_window": ("window_start", "window_end"),
+}
+# Столбцы need_<товар> собираются в словарь needs
+_CSV_NEED_PREFIX = "need_"
+
+
+def _number(value):
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+def _csv_row(row):
+    """Запись CSV -> словарь в формате записи JSON"""
+    record = {}
+    needs = {}
+    for key, value in row.items():
+        if value is None or value == "":
+            continue
+        if key.startswith(_CSV_NEED_PREFIX):
+            needs[key[len(_CSV_NEED_PREFIX):]] = _number(value)
+        elif key in _CSV_NUMBERS:
+            record[key] = _number(value)
+        else:
+            record[key] = value
+    for field, (first, second) in _CSV_PAIRS.items():
+        if first in record and second in record:
+            record[field] = [_number(record.pop(first)), _number(record.pop(second))]
+    if needs:
+        record["needs"] = needs
+    return record
+
+
+class ConfigIndex:
+    """Загруженная конфигурация с индексами по id и jid.
+
+    Хранится в кэше загрузчика до изменения файла. Записи общие для
+    всех, кто получил конфигурацию из кэша, - их не нужно изменять.
+    """
+
+    def __init__(self, config, section):
+        self.config = config
+        self.records = config[section]
+        self.by_id = {}
+        self.by_jid = {}
+        for i, record in enumerate(self.records):
+            if self.by_id.setdefault(record["id"], record) is not record:
+                raise ValueError(f"Повторяющийся id {record['id']!r} у записи #{i + 1}")
+            if self.by_jid.setdefault(record["jid"], record) is not record:
+                raise ValueError(f"Повторяющийся jid '{record['jid']}' у записи #{i + 1}")
+
 
 class ConfigLoader:
-    """Класс для загрузки конфигураций из JSON файлов"""
+    """Класс для загрузки конфигураций из JSON файлов.
+
+    Кроме JSON поддерживаются построчные форматы для больших парков:
+    JSON Lines (.jsonl, одна запись на строку) и CSV. Такие файлы
+    читаются потоково (iter_vehicles, iter_shops) и проверяются по
+    мере чтения.
+
+    Загруженные конфигурации кэшируются вместе с индексами по id и jid.
+    Кэш сбрасывается, когда у файла меняется время изменения или размер.
+    """
 
     def __init__(self, config_dir="config"):
         self.config_dir = Path(config_dir)
         if not self.config_dir.exists():
             raise FileNotFoundError(f"Директория конфигурации '{config_dir}' не найдена")
+        # путь -> (mtime_ns, размер, ConfigIndex)
+        self._cache = {}
 
-    def load_vehicles_config(self, filename="vehicles.json"):
-        """Загрузка конфигурации автомобилей"""
+    def _resolve(self, filename):
+        """Путь к файлу; если его нет, ищется файл с тем же именем в другом формате"""
         config_path = self.config_dir / filename
+        if config_path.exists():
+            return config_path
+        for suffix in CONFIG_SUFFIXES:
+            candidate = config_path.with_suffix(suffix)
+            if candidate.exists():
+                return candidate
+        raise FileNotFoundError(f"Файл конфигурации '{config_path}' не найден")
+
+    def _load(self, filename, section, validate):
+        config_path = self._resolve(filename)
+        stat = os.stat(config_path)
+        cached = self._cache.get(config_path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+
+        if config_path.suffix == ".json":
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            # Валидация конфигурации
+            validate(config)
+        else:
+            xmpp_server, records = self._read_rows(config_path, section)
+            config = {"xmpp_server": xmpp_server, section: records}
 
-        if not config_path.exists():
-            raise FileNotFoundError(f"Файл конфигурации '{config_path}' не найден")
-
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-
-        # Валидация конфигурации
-        self._validate_vehicles_config(config)
+        index = ConfigIndex(config, section)
+        self._cache[config_path] = (stat.st_mtime_ns, stat.st_size, index)
+        return index
 
-        return config
+    def load_vehicles_config(self, filename="vehicles.json"):
+        """Загрузка конфигурации автомобилей"""
+        return self._load(filename, "vehicles", self._validate_vehicles_config).config
 
     def load_shops_config(self, filename="shops.json"):
         """Загрузка конфигурации магазинов"""
-        config_path = self.config_dir / filename
-
-        if not config_path.exists():
-            raise FileNotFoundError(f"Файл конфигурации '{config_path}' не найден")
-
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-
-        # Валидация конфигурации
-        self._validate_shops_config(config)
-
-        return config
+        return self._load(filename, "shops", self._validate_shops_config).config
+
+    def iter_vehicles(self, filename="vehicles.jsonl"):
+        """Потоковое чтение автомобилей из .jsonl или .csv без загрузки всего файла"""
+        return self._iter_rows(self._resolve(filename), "vehicles")
+
+    def iter_shops(self, filename="shops.jsonl"):
+        """Потоковое чтение магазинов из .jsonl или .csv без загрузки всего файла"""
+        return self._iter_rows(self._resolve(filename), "shops")
+
+    def _read_rows(self, config_path, section):
+        records = []
+        xmpp_server = None
+        for record in self._iter_rows(config_path, section, with_server=True):
+            if "xmpp_server" in record and "jid" not in record:
+                xmpp_server = record["xmpp_server"]
+            else:
+                records.append(record)
+        if xmpp_server is None:
+            # Без строки с сервером он берется из домена первого JID
+            xmpp_server = records[0]["jid"].partition("@")[2] if records else "localhost"
+        return xmpp_server, records
+
+    def _iter_rows(self, config_path, section, with_server=False):
+        """Записи построчного файла с проверкой каждой записи.
+
+        В .jsonl строка вида {"xmpp_server": "..."} задает сервер (ее
+        возвращает только чтение всей конфигурации); пустые строки
+        пропускаются. В .csv первая строка - заголовок.
+        """
+        check = self._check_vehicle if section == "vehicles" else self._check_shop
+        with open(config_path, 'r', encoding='utf-8', newline='') as f:
+            if config_path.suffix == ".csv":
+                rows = enumerate(map(_csv_row, csv.DictReader(f)), start=2)
+            elif config_path.suffix == ".jsonl":
+                rows = ((n, json.loads(line)) for n, line in enumerate(f, start=1) if line.strip())
+            else:
+                raise ValueError(f"Формат '{config_path.suffix}' не читается построчно: нужен .jsonl или .csv")
+
+            for line, record in rows:
+                if "jid" not in record and "xmpp_server" in record:
+                    if with_server:
+                        yield record
+                    continue
+                check(record, f"в строке {line} файла {config_path.name}")
+                yield record
 
     def get_xmpp_server(self, config_type="vehicles"):
         """Получение адреса XMPP сервера из конфигурации"""
@@ -52,24 +184,55 @@ class ConfigLoader:
 
     def get_all_vehicle_jids(self):
         """Получение списка всех JID автомобилей"""
-        config = self.load_vehicles_config()
-        return [v["jid"] for v in config["vehicles"]]
+        return list(self._load("vehicles.json", "vehicles", self._validate_vehicles_config).by_jid)
 
     def get_vehicle_by_id(self, vehicle_id):
         """Получение конфигурации конкретного автомобиля по ID"""
-        config = self.load_vehicles_config()
-        for vehicle in config["vehicles"]:
-            if vehicle["id"] == vehicle_id:
-                return vehicle
-        return None
+        return self._load("vehicles.json", "vehicles", self._validate_vehicles_config).by_id.get(vehicle_id)
+
+    def get_vehicle_by_jid(self, jid):
+        """Получение конфигурации автомобиля по JID"""
+        return self._load("vehicles.json", "vehicles", self._validate_vehicles_config).by_jid.get(str(jid))
 
     def get_shop_by_id(self, shop_id):
         """Получение конфигурации конкретного магазина по ID"""
-        config = self.load_shops_config()
-        for shop in config["shops"]:
-            if shop["id"] == shop_id:
-                return shop
-        return None
+        return self._load("shops.json", "shops", self._validate_shops_config).by_id.get(shop_id)
+
+    def get_shop_by_jid(self, jid):
+        """Получение конфигурации магазина по JID"""
+        return self._load("shops.json", "shops", self._validate_shops_config).by_jid.get(str(jid))
+
+    @staticmethod
+    def _check_vehicle(vehicle, where):
+        # Разность множеств вместо перебора полей: одна операция на запись
+        missing = _VEHICLE_FIELD_SET - vehicle.keys()
+        if missing:
+            field = next(f for f in VEHICLE_FIELDS if f in missing)
+            raise ValueError(f"Отсутствует поле '{field}' у автомобиля {where}")
+
+        # Необязательные отсеки: {имя: {"capacity": N, "products": [...]}}
+        compartments = vehicle.get("compartments")
+        if compartments is not None:
+            if not isinstance(compartments, dict) or not compartments:
+                raise ValueError(f"Поле 'compartments' должно быть непустым словарем у автомобиля {where}")
+            for name, compartment in compartments.items():
+                if not isinstance(compartment, dict) or "capacity" not in compartment:
+                    raise ValueError(f"У отсека '{name}' нет поля 'capacity' у автомобиля {where}")
+
+    @staticmethod
+    def _check_shop(shop, where):
+        missing = _SHOP_FIELD_SET - shop.keys()
+        if missing:
+            field = next(f for f in SHOP_FIELDS if f in missing)
+            raise ValueError(f"Отсутствует поле '{field}' у магазина {where}")
+
+        # Проверка формата location
+        if not isinstance(shop["location"], list) or len(shop["location"]) != 2:
+            raise ValueError(f"Поле 'location' должно быть списком из 2 элементов у магазина {where}")
+
+        # Проверка формата time_window
+        if not isinstance(shop["time_window"], list) or len(shop["time_window"]) != 2:
+            raise ValueError(f"Поле 'time_window' должно быть списком из 2 элементов у магазина {where}")
 
     def _validate_vehicles_config(self, config):
         """Валидация конфигурации автомобилей"""
@@ -79,11 +242,8 @@ class ConfigLoader:
         if "vehicles" not in config:
             raise ValueError("Отсутствует поле 'vehicles' в конфигурации")
 
-        required_fields = ["id", "jid", "password", "capacity", "speed"]
         for i, vehicle in enumerate(config["vehicles"]):
-            for field in required_fields:
-                if field not in vehicle:
-                    raise ValueError(f"Отсутствует поле '{field}' у автомобиля #{i + 1}")
+            self._check_vehicle(vehicle, f"#{i + 1}")
 
     def _validate_shops_config(self, config):
         """Валидация конфигурации магазинов"""
@@ -93,19 +253,8 @@ class ConfigLoader:
         if "shops" not in config:
             raise ValueError("Отсутствует поле 'shops' в конфигурации")
 
-        required_fields = ["id", "jid", "password", "shop_id", "location", "time_window", "needs"]
         for i, shop in enumerate(config["shops"]):
-            for field in required_fields:
-                if field not in shop:
-                    raise ValueError(f"Отсутствует поле '{field}' у магазина #{i + 1}")
-
-            # Проверка формата location
-            if not isinstance(shop["location"], list) or len(shop["location"]) != 2:
-                raise ValueError(f"Поле 'location' должно быть списком из 2 элементов у магазина #{i + 1}")
-
-            # Проверка формата time_window
-            if not isinstance(shop["time_window"], list) or len(shop["time_window"]) != 2:
-                raise ValueError(f"Поле 'time_window' должно быть списком из 2 элементов у магазина #{i + 1}")
+            self._check_shop(shop, f"#{i + 1}")
 
     @staticmethod
     def create_default_configs(config_dir="config"):
@@ -0,0 +1,81 @@
+import numpy as np
+
+
+class CostEngine:
+    """Векторный расчет дистанций, времени и стоимости доставки для всего парка.
+
+    Позиции автомобилей и координаты магазинов хранятся массивами, матрицы
+    размером (автомобили × магазины) считаются одним векторным вызовом.
+    При перемещении автомобиля пересчитывается только его строка.
+    Агенты-автомобили берут готовые значения через quote() вместо
+    расчета дистанции в каждом сообщении.
+
+    road - расстояния по дорогам (road_graph.RoadDistance); без него - по прямой.
+    """
+
+    def __init__(self, vehicles, shops, default_tariff=10, dtype=np.float64, road=None):
+        self.road = road
+        self.vehicle_index = {v["jid"]: i for i, v in enumerate(vehicles)}
+        self.shop_index = {s["shop_id"]: j for j, s in enumerate(shops)}
+
+        self.vehicle_positions = np.array(
+            [v.get("position", (0, 0)) for v in vehicles], dtype=dtype).reshape(-1, 2)
+        self.speeds = np.array([v["speed"] for v in vehicles], dtype=dtype)
+        self.tariffs = np.array(
+            [v.get("tariff_per_km", default_tariff) for v in vehicles], dtype=dtype)
+        self.shop_locations = np.array([s["location"] for s in shops], dtype=dtype).reshape(-1, 2)
+
+        self.distance = None
+        self.time = None
+        self.cost = None
+        self.recompute()
+
+    @classmethod
+    def from_config(cls, vehicles_config, shops_config, **kwargs):
+        """Создание движка из конфигураций vehicles.json и shops.json"""
+        return cls(vehicles_config["vehicles"], shops_config["shops"], **kwargs)
+
+    def recompute(self):
+        """Полный пересчет матриц дистанции, времени и стоимости"""
+        if self.road is not None:
+            self.distance = self.road.between(self.vehicle_positions, self.shop_locations).astype(
+                self.vehicle_positions.dtype)
+        else:
+            delta = self.vehicle_positions[:, np.newaxis, :] - self.shop_locations[np.newaxis, :, :]
+            self.distance = np.hypot(delta[..., 0], delta[..., 1])
+        self.time = self._travel_time(self.distance, self.speeds[:, np.newaxis])
+        self.cost = self.distance * self.tariffs[:, np.newaxis]
+
+    def move_vehicle(self, jid, position):
+        """Обновление позиции автомобиля с пересчетом только его строки"""
+        i = self.vehicle_index.get(str(jid))
+        if i is None:
+            return False
+
+        self.vehicle_positions[i] = position
+        if self.road is not None:
+            row = self.road.between(self.vehicle_positions[i:i + 1], self.shop_locations)[0]
+        else:
+            delta = self.shop_locations - self.vehicle_positions[i]
+            row = np.hypot(delta[:, 0], delta[:, 1])
+        self.distance[i] = row
+        self.time[i] = self._travel_time(row, self.speeds[i])
+        self.cost[i] = row * self.tariffs[i]
+        return True
+
+    def quote(self, jid, shop_id):
+        """Дистанция, время в пути и стоимость доставки (или None, если пары нет в движке)"""
+        i = self.vehicle_index.get(str(jid))
+        j = self.shop_index.get(shop_id)
+        if i is None or j is None:
+            return None
+        return float(self.distance[i, j]), float(self.time[i, j]), float(self.cost[i, j])
+
+    def tariff(self, jid):
+        i = self.vehicle_index.get(str(jid))
+        return None if i is None else float(self.tariffs[i])
+
+    @staticmethod
+    def _travel_time(distance, speed):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(speed > 0, distance / speed, np.inf)
\ No newline at end of file
@@ -0,0 +1,227 @@
+import asyncio
+import itertools
+from spade.agent import Agent
+from spade.behaviour import CyclicBehaviour
+from spade.message import Message
+
+from assignment import INFEASIBLE, solve_assignment
+from codec import MessageCodec
+from inbox import MailboxBehaviour, NoMailbox
+from log import AgentLogger
+from negotiation import ProposalRound, offered_products
+from sim_clock import RealTimeClock
+
+# Доля дедлайна магазина, оставляемая на решение и доставку ответов:
+# раунд автомобилей закрывается раньше, чем магазин перестанет ждать
+REPLY_SHARE = 0.25
+
+
+class DispatcherAgent(Agent):
+    """Агент-диспетчер: пакетная рассылка заказов магазинов автомобилям.
+
+    Вместо того чтобы каждый магазин опрашивал каждый автомобиль,
+    диспетчер копит заказы в течение batch_window и отправляет каждому
+    автомобилю одно сообщение со всеми заказами. Автомобиль отвечает
+    одним вектором предложений.
+
+    Режимы распределения:
+    greedy - предложения раздаются магазинам, каждый выбирает сам (минимум по стоимости);
+    global - диспетчер сам решает задачу о назначениях для всего пакета
+             с учетом вместимости и сообщает магазинам назначенный автомобиль;
+             подтверждение автомобилю отправляет магазин, если его раунд еще открыт.
+
+    order_timeout - сколько магазин ждет ответа на запрос. Раунд пакета
+    длится до дедлайна самого давнего заказа в нем, с запасом на ответы.
+    """
+
+    MODES = ("greedy", "global")
+
+    def __init__(self, jid, password, clock=None, batch_window=0.5, order_timeout=4.0, mode="greedy",
+                 codec="json", metrics=None):
+        super().__init__(jid, password)
+        if mode not in self.MODES:
+            raise ValueError(f"Неизвестный режим диспетчера '{mode}'. Доступны: {', '.join(self.MODES)}")
+        self.clock = clock or RealTimeClock()
+        self.codec = MessageCodec(codec)
+        self.log = AgentLogger("Dispatcher", self.name)
+        self.metrics = metrics
+        self.mode = mode
+        self.batch_window = batch_window
+        self.order_timeout = order_timeout
+        self.pending_orders = []
+        self.orders_available = asyncio.Event()
+        self.current_round = None
+        self.current_batch_id = None
+        self._batch_ids = itertools.count(1)
+
+    class ReceiveBehaviour(MailboxBehaviour):
+        """Прием заказов от магазинов и пакетных ответов автомобилей"""
+
+        role = "dispatcher"
+        handlers = {
+            "delivery_request": "handle_request",
+            "batch_delivery_proposal": "handle_batch_proposal",
+        }
+        idempotent = frozenset({"delivery_request", "batch_delivery_proposal"})
+
+        def handle_request(self, msg, data):
+            data["shop_jid"] = str(msg.sender.bare)
+            # Ответы магазину идут в его переговоры (thread запроса)
+            data["conversation_id"] = msg.thread
+            # Дедлайн считается от приема заказа: он мог ждать, пока собирался прошлый пакет
+            self.agent.pending_orders.append((self.agent.clock.now(), data))
+            self.agent.orders_available.set()
+
+        def handle_batch_proposal(self, msg, data):
+            round_ = self.agent.current_round
+            # Ставки сопоставляются с заказами по индексу, поэтому ответ
+            # на чужой (более ранний) пакет принимать нельзя
+            if round_ is None or round_.is_closed or msg.thread != round_.conversation_id:
+                self.agent.log.debug("Опоздавший пакет от %s проигнорирован", data.get("vehicle_id"))
+                self.dropped("batch_delivery_proposal", "stale")
+                return
+
+            vehicle_jid = str(msg.sender.bare)
+            bids = data.get("bids", [])
+            for bid in bids:
+                bid["vehicle_jid"] = vehicle_jid
+            round_.add_responses(vehicle_jid, bids)
+
+    class DispatchBatchBehaviour(NoMailbox, CyclicBehaviour):
+        """Формирование пакета заказов и раздача предложений магазинам"""
+
+        async def run(self):
+            await self.agent.orders_available.wait()
+            # Окно накопления: заказы, пришедшие за это время, уйдут одним пакетом
+            await self.agent.clock.sleep(self.agent.batch_window)
+
+            queued, self.agent.pending_orders = self.agent.pending_orders, []
+            self.agent.orders_available.clear()
+
+            vehicles = self.agent.get("vehicles") or []
+            if not vehicles:
+                self.agent.log.error("Нет известных автомобилей.")
+                return
+
+            # Заказы, магазин которых уже не дождется ответа, не рассылаются:
+            # магазин закрыл раунд и повторит запрос в новых переговорах
+            now = self.agent.clock.now()
+            reply_reserve = self.agent.order_timeout * REPLY_SHARE
+            batch = [(received_at + self.agent.order_timeout - reply_reserve, order) for received_at, order in queued]
+            batch = [(deadline, order) for deadline, order in batch if deadline > now]
+            expired = len(queued) - len(batch)
+            if expired:
+                self.agent.log.info("Просрочено в очереди заказов: %d", expired, extra={"event": "expired", "orders": expired})
+                if self.agent.metrics is not None:
+                    for _ in range(expired):
+                        self.agent.metrics.message_dropped("dispatcher", "delivery_request", "expired")
+            if not batch:
+                return
+
+            orders = [order for _, order in batch]
+            round_ = ProposalRound(vehicles, now, min(deadline for deadline, _ in batch) - now)
+            self.agent.current_round = round_
+            self.agent.current_batch_id = next(self.agent._batch_ids)
+
+            # Тело пакета кодируется один раз для всех автомобилей
+            messages = [Message(to=jid, thread=round_.conversation_id, metadata={"performative": "cfp"})
+                        for jid in vehicles]
+            self.agent.codec.pack_many(messages, {
+                "type": "batch_delivery_request",
+                "batch_id": self.agent.current_batch_id,
+                "orders": orders,
+                # Жадный режим: ставки выбирают магазины, и автомобиль резервирует место
+                # под каждую, как при прямом запросе. В global вместимость учитывает решатель
+                "reserve": self.agent.mode == "greedy"
+            })
+            self.agent.log.info("Рассылка пакета из %d заказов %d автомобилям...", len(orders), len(vehicles),
+                                extra={"event": "batch_sent", "batch_id": self.agent.current_batch_id,
+                                       "orders": len(orders), "vehicles": len(vehicles)})
+            for msg in messages:
+                await self.send(msg)
+
+            await round_.wait(self.agent.clock)
+            round_.close(self.agent.clock.now())
+            self.agent.current_round = None
+            self.agent.log.info("Пакет собран за %.3f с: ответили %d/%d", round_.latency,
+                                len(round_.responded), len(round_.expected),
+                                extra={"event": "round_closed", "latency": round_.latency,
+                                       "responded": len(round_.responded), "expected": len(round_.expected)})
+            if self.agent.metrics is not None:
+                self.agent.metrics.round_closed("dispatcher", round_)
+
+            if self.agent.mode == "global":
+                await self.assign_globally(orders, round_)
+            else:
+                await self.relay_bids(orders, round_)
+
+        async def relay_bids(self, orders, round_):
+            """Отправка каждому магазину всех предложений по его заказу одним сообщением"""
+            for index, order in enumerate(orders):
+                proposals = [bids[index] for bids in round_.responses.values() if index < len(bids)]
+
+                msg = Message(to=order["shop_jid"], thread=order.get("conversation_id"))
+                msg.set_metadata("performative", "propose")
+                self.agent.codec.pack(msg, {
+                    "type": "delivery_proposal_batch",
+                    "shop_id": order.get("shop_id"),
+                    "proposals": proposals
+                })
+                await self.send(msg)
+
+        async def assign_globally(self, orders, round_):
+            """Глобальное распределение заказов пакета и отправка подтверждений"""
+            vehicles = list(round_.responses)
+            cost = [[INFEASIBLE] * len(vehicles) for _ in orders]
+            demands = [sum(order.get("products", {}).values()) for order in orders]
+            free_capacity = [0] * len(vehicles)
+            # Груз заказов и свободное место по отсекам каждого автомобиля: отсеки у
+            # автомобилей разные, и заказ, влезающий по общему месту, может не влезть в отсек
+            loads = [[None] * len(vehicles) for _ in orders]
+            free_load = [[0] for _ in vehicles]
+            for j, vehicle_jid in enumerate(vehicles):
+                for i, bid in enumerate(round_.responses[vehicle_jid][:len(orders)]):
+                    # Назначение отдает заказ одному автомобилю: частичные ставки не подходят
+                    products = orders[i].get("products", {})
+                    if bid.get("can_deliver") and offered_products(bid, products) == products:
+                        cost[i][j] = bid["cost"]
+                        free_capacity[j] = max(free_capacity[j], bid.get("capacity_available", 0))
+                        loads[i][j] = bid.get("load", [demands[i]])
+                        free_load[j] = bid.get("free_load", [free_capacity[j]])
+
+            assignment, total_cost, iterations = solve_assignment(cost, demands, free_capacity, loads, free_load)
+            self.agent.log.info("Назначено %d/%d заказов, суммарная стоимость %.2f (итераций: %d)",
+                                len(assignment), len(orders), total_cost, iterations,
+                                extra={"event": "assigned", "assigned": len(assignment), "orders": len(orders),
+                                       "total_cost": total_cost})
+
+            for i, order in enumerate(orders):
+                j = assignment.get(i)
+                if j is None:
+                    # Заказ без назначения: магазин получит пустой пакет и повторит запрос
+                    msg = Message(to=order["shop_jid"], thread=order.get("conversation_id"))
+                    msg.set_metadata("performative", "propose")
+                    self.agent.codec.pack(msg, {
+                        "type": "delivery_proposal_batch",
+                        "shop_id": order.get("shop_id"),
+                        "proposals": []
+                    })
+                    await self.send(msg)
+                    continue
+
+                # Автомобилю заказ подтверждает сам магазин: если его раунд уже
+                # закрыт, назначение отбрасывается и автомобиль не получит лишний заказ
+                bid = round_.responses[vehicles[j]][i]
+                inform_msg = Message(to=order["shop_jid"], thread=order.get("conversation_id"))
+                inform_msg.set_metadata("performative", "inform")
+                self.agent.codec.pack(inform_msg, {
+                    "type": "delivery_assigned",
+                    "shop_id": order.get("shop_id"),
+                    "proposal": bid
+                })
+                await self.send(inform_msg)
+
+    async def setup(self):
+        self.log.info("Диспетчер запущен (режим: %s, окно пакета: %s с)", self.mode, self.batch_window)
+        self.add_behaviour(self.ReceiveBehaviour())
+        self.add_behaviour(self.DispatchBatchBehaviour())
\ No newline at end of file
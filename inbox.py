@@ -0,0 +1,133 @@
+import asyncio
+import inspect
+
+from spade.behaviour import CyclicBehaviour
+
+from codec import CodecError
+from negotiation import SeenIds
+
+# Пустое сообщение в очереди поведения: будит его, чтобы завершиться после kill()
+_WAKE = object()
+
+
+class NoMailbox:
+    """Примесь для поведений, которые не принимают сообщений.
+
+    Без шаблона SPADE кладет каждое входящее сообщение во все поведения
+    агента, в том числе в одноразовые (доставка, улучшение маршрута),
+    где его никто не прочитает. Такие поведения отказываются от всех сообщений.
+    """
+
+    def match(self, message):
+        return False
+
+
+class MailboxBehaviour(CyclicBehaviour):
+    """Прием сообщений по событию с маршрутизацией по типу.
+
+    Поведение ждет очередь без таймаута: простаивающий агент не заводит
+    таймеров и не просыпается, пока не придет сообщение. Тип тела
+    сообщения выбирает обработчик из таблицы handlers (тип -> имя метода);
+    обработчик получает (msg, data) и может быть корутиной.
+
+    При max_concurrency > 1 обработчики типов из concurrent запускаются
+    отдельными задачами, не более max_concurrency одновременно: поведение
+    продолжает читать почту, пока идут расчеты. Когда все слоты заняты,
+    чтение приостанавливается. Остальные типы по-прежнему обрабатываются
+    строго по очереди.
+
+    Событие ready устанавливается, когда поведение начинает читать
+    почту: это сигнал готовности агента при запуске (см. startup.py).
+
+    Сообщения типов из idempotent обрабатываются один раз: ключ
+    (thread, отправитель, тип) запоминается в ограниченном LRU seen,
+    и повтор того же сообщения отбрасывается до обработчика.
+    """
+
+    handlers = {}
+    concurrent = frozenset()
+    idempotent = frozenset()
+    role = None
+    seen_limit = 4096
+
+    def __init__(self, max_concurrency=1):
+        super().__init__()
+        self.max_concurrency = max_concurrency
+        self._slots = None
+        self._tasks = set()
+        self.seen = SeenIds(self.seen_limit)
+        self.ready = asyncio.Event()
+
+    async def on_start(self):
+        self.ready.set()
+
+    async def run(self):
+        msg = await self.queue.get()
+        if msg is _WAKE:
+            return
+
+        try:
+            data = self.agent.codec.unpack(msg)
+        except CodecError as e:
+            self.agent.log.warning("Ошибка разбора сообщения от %s: %s", msg.sender, e)
+            return
+
+        msg_type = data.get("type")
+        if self.agent.metrics is not None:
+            self.agent.metrics.message_received(self.role, msg_type)
+
+        handler = self.handlers.get(msg_type)
+        if handler is None:
+            self.agent.log.debug("Сообщение типа %s от %s не обрабатывается", msg_type, msg.sender)
+            return
+
+        if msg_type in self.idempotent and msg.thread is not None:
+            if not self.seen.add((msg.thread, str(msg.sender.bare), msg_type)):
+                self.agent.log.debug("Повтор %s от %s отброшен", msg_type, msg.sender)
+                self.dropped(msg_type, "duplicate")
+                return
+
+        if self.max_concurrency > 1 and msg_type in self.concurrent:
+            await self._spawn(getattr(self, handler), msg, data)
+            return
+        result = getattr(self, handler)(msg, data)
+        if inspect.isawaitable(result):
+            await result
+
+    def dropped(self, msg_type, reason):
+        """Учет отброшенного сообщения: duplicate - повтор, stale - чужой или закрытый раунд"""
+        if self.agent.metrics is not None:
+            self.agent.metrics.message_dropped(self.role, msg_type, reason)
+
+    async def _spawn(self, handler, msg, data):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        await self._slots.acquire()
+        task = asyncio.ensure_future(self._call(handler, msg, data))
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+
+    @staticmethod
+    async def _call(handler, msg, data):
+        result = handler(msg, data)
+        if inspect.isawaitable(result):
+            await result
+
+    def _finished(self, task):
+        self._tasks.discard(task)
+        self._slots.release()
+        if not task.cancelled() and task.exception() is not None:
+            self.agent.log.error("Ошибка обработки сообщения: %r", task.exception(), exc_info=task.exception())
+
+    @property
+    def in_flight(self):
+        """Число обработчиков, выполняемых параллельно прямо сейчас"""
+        return len(self._tasks)
+
+    def kill(self, exit_code=None):
+        super().kill(exit_code)
+        for task in list(self._tasks):
+            task.cancel()
+        # Поведение ждет очередь без таймаута: будим его, чтобы цикл увидел kill
+        if self.queue is not None:
+            self.queue.put_nowait(_WAKE)
\ No newline at end of file
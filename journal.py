@@ -0,0 +1,251 @@
+"""Журнал заказов: запросы, ставки, подтверждения и доставки.
+
+Записи дописываются в файл JSON Lines отдельным потоком. Поток копит
+записи не дольше fsync_interval секунд и сбрасывает их на диск одним
+fsync (групповая фиксация), поэтому запись в журнал не блокирует цикл
+событий. При аварии теряются записи не более чем за fsync_interval.
+
+Каждые snapshot_every записей (и при остановке) состояние, собранное
+из журнала, сохраняется в снимок <журнал>.snapshot, а журнал начинается
+заново. При перезапуске читается снимок и хвост журнала после него.
+Агенты берут из восстановленного состояния подтвержденные заказы и не
+проводят переговоры заново.
+"""
+import copy
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+from log import get_logger
+
+log = get_logger("journal")
+
+# Поля остановки автомобиля, которые хранятся в журнале
+STOP_FIELDS = ("shop_id", "shop", "location", "quantity", "time_window", "conversation_id", "products")
+
+# Состояния заказа магазина. Из requested магазин продолжает переговоры,
+# остальные после перезапуска не требуют новых запросов
+SHOP_REQUESTED = "requested"
+SHOP_ASSIGNED = "assigned"
+SHOP_DELIVERED = "delivered"
+SHOP_ABANDONED = "abandoned"
+
+
+def empty_state():
+    return {"vehicles": {}, "shops": {}}
+
+
+def _vehicle(state, jid):
+    return state["vehicles"].setdefault(jid, {"stops": {}, "position": None, "odometer": 0.0})
+
+
+def stop_key(conversation_id, shop_id):
+    """Ключ остановки автомобиля: у одного магазина может быть несколько
+    остановок (части разделенного заказа, повторный запрос)"""
+    return f"{conversation_id}|{shop_id}"
+
+
+def _shop(state, jid):
+    return state["shops"].setdefault(jid, {"status": SHOP_REQUESTED, "parts": {}, "retries": 0})
+
+
+def _part(shop, conversation_id, vehicle, products=None):
+    """Часть заказа магазина, отданная автомобилю (заказ может быть разделен)"""
+    key = f"{conversation_id}|{vehicle}"
+    part = shop["parts"].get(key)
+    if part is None and products is not None:
+        part = shop["parts"][key] = {"conversation_id": conversation_id, "vehicle": vehicle,
+                                     "products": products, "delivered": False}
+    return part
+
+
+def _delivered(shop, conversation_id, vehicle):
+    part = _part(shop, conversation_id, vehicle)
+    if part is not None:
+        part["delivered"] = True
+
+
+def apply(state, record):
+    """Применение записи журнала к состоянию (общее для записи и восстановления)"""
+    event = record["event"]
+    if event == "request":
+        shop = _shop(state, record["shop"])
+        if shop["status"] == SHOP_REQUESTED:
+            shop["retries"] = record.get("retries", 0)
+    elif event == "accept":
+        vehicle = _vehicle(state, record["vehicle"])
+        key = stop_key(record.get("conversation_id"), record["shop_id"])
+        vehicle["stops"][key] = {field: record.get(field) for field in STOP_FIELDS}
+        _part(_shop(state, record["shop"]), record["conversation_id"], record["vehicle"], record["products"])
+    elif event == "confirm":
+        shop = _shop(state, record["shop"])
+        shop["status"] = SHOP_ASSIGNED
+        for part in record["parts"]:
+            _part(shop, part["conversation_id"], part["vehicle"], part["products"])
+    elif event == "deliver":
+        vehicle = _vehicle(state, record["vehicle"])
+        vehicle["stops"].pop(stop_key(record.get("conversation_id"), record["shop_id"]), None)
+        vehicle["position"] = record["position"]
+        vehicle["odometer"] = record["odometer"]
+        shop = _shop(state, record["shop"])
+        _delivered(shop, record["conversation_id"], record["vehicle"])
+        # Магазин в другом процессе (--shards): заказ закрыт, если он был размещен целиком
+        if shop["status"] == SHOP_ASSIGNED and all(part["delivered"] for part in shop["parts"].values()):
+            shop["status"] = SHOP_DELIVERED
+    elif event == "receive":
+        shop = _shop(state, record["shop"])
+        _delivered(shop, record["conversation_id"], record["vehicle"])
+        if record["closed"]:
+            shop["status"] = SHOP_DELIVERED
+    elif event == "abandon":
+        _shop(state, record["shop"])["status"] = SHOP_ABANDONED
+    # bid - только для разбора переговоров, состояние не меняет
+    return state
+
+
+class Journal:
+    """Журнал с групповой фиксацией на диск и снимками состояния"""
+
+    def __init__(self, path, fsync_interval=0.05, snapshot_every=10000):
+        self.path = Path(path)
+        self.snapshot_path = self.path.with_name(self.path.name + ".snapshot")
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        self.written = 0
+        self.fsyncs = 0
+
+        started = time.perf_counter()
+        self._state, self._seq, replayed = self._replay()
+        # Копия для агентов: рабочее состояние дальше меняет только поток записи
+        self.restored = copy.deepcopy(self._state)
+        self.replay_seconds = time.perf_counter() - started
+        if self._seq:
+            log.info("Журнал %s: состояние восстановлено до записи %d (после снимка применено %d) за %.3f с",
+                     self.path, self._seq, replayed, self.replay_seconds)
+
+        self._since_snapshot = replayed
+        self._queue = queue.SimpleQueue()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="journal", daemon=True)
+        self._thread.start()
+
+    # --- Для агентов ---
+
+    def record(self, event, **fields):
+        """Добавление записи. Сериализация и запись на диск идут в потоке журнала"""
+        fields["event"] = event
+        self._queue.put(fields)
+
+    def vehicle_state(self, jid):
+        """Восстановленное состояние автомобиля (None, если в журнале его нет)"""
+        return self.restored["vehicles"].get(str(jid))
+
+    def shop_state(self, jid):
+        return self.restored["shops"].get(str(jid))
+
+    def close(self):
+        """Запись оставшихся записей, снимок и остановка потока"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    # --- Восстановление ---
+
+    def _replay(self):
+        state, seq = empty_state(), 0
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            state, seq = snapshot["state"], snapshot["seq"]
+
+        replayed = 0
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Недописанная при аварии последняя строка
+                        log.warning("Журнал %s: пропущена поврежденная запись", self.path)
+                        continue
+                    # Записи до снимка уже учтены (авария между снимком и очисткой журнала)
+                    if record["seq"] <= seq:
+                        continue
+                    apply(state, record)
+                    seq = record["seq"]
+                    replayed += 1
+        return state, seq, replayed
+
+    # --- Поток записи ---
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch = []
+            deadline = time.monotonic() + self.fsync_interval
+            # Групповая фиксация: все записи за интервал - один fsync
+            while True:
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+            if stopping or self._since_snapshot >= self.snapshot_every:
+                self._snapshot()
+        self._file.close()
+
+    def _write(self, batch):
+        lines = []
+        for record in batch:
+            self._seq += 1
+            record["seq"] = self._seq
+            apply(self._state, record)
+            lines.append(json.dumps(record, ensure_ascii=False))
+        self._file.write("\n".join(lines) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.written += len(batch)
+        self.fsyncs += 1
+        self._since_snapshot += len(batch)
+
+    def _snapshot(self):
+        """Снимок состояния и очистка журнала"""
+        tmp_path = self.snapshot_path.with_name(self.snapshot_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"seq": self._seq, "state": self._state}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # Журнал очищается только после того, как снимок на диске
+        self._file.close()
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._since_snapshot = 0
+
+
+def add_journal_arguments(parser):
+    """Параметры журнала заказов для скриптов запуска"""
+    parser.add_argument("--journal", default=None, metavar="PATH",
+                        help="Вести журнал заказов и восстанавливать состояние из него при перезапуске")
+    parser.add_argument("--journal-fsync-interval", type=float, default=0.05,
+                        help="Период сброса журнала на диск (fsync), секунды реального времени")
+    parser.add_argument("--journal-snapshot-every", type=int, default=10000,
+                        help="Снимок состояния и очистка журнала через каждые N записей")
+
+
+def journal_from_args(args, suffix=""):
+    if not args.journal:
+        return None
+    return Journal(args.journal + suffix, args.journal_fsync_interval, args.journal_snapshot_every)
\ No newline at end of file
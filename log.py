@@ -0,0 +1,112 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Все логгеры системы - потомки "delivery": так их уровень и обработчики
+# настраиваются в одном месте, не затрагивая логи SPADE и slixmpp
+ROOT_LOGGER = "delivery"
+LOG_FORMATS = ("text", "json")
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+# Атрибуты LogRecord, которые не относятся к структурированным полям записи
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def get_logger(name):
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+class AgentLogger(logging.LoggerAdapter):
+    """Логгер агента: роль и имя агента добавляются в каждую запись"""
+
+    def __init__(self, role, name):
+        super().__init__(get_logger(role.lower()), {"role": role, "agent": str(name)})
+
+    def process(self, msg, kwargs):
+        extra = kwargs.get("extra")
+        kwargs["extra"] = {**self.extra, **extra} if extra else self.extra
+        return msg, kwargs
+
+
+class TextFormatter(logging.Formatter):
+    """Человекочитаемый вывод в прежнем виде: [Vehicle vehicle1] сообщение"""
+
+    def format(self, record):
+        message = record.getMessage()
+        agent = getattr(record, "agent", None)
+        if agent is not None:
+            message = f"[{record.role} {agent}] {message}"
+        if record.levelno >= logging.WARNING:
+            message = f"[{record.levelname}] {message}"
+        if record.exc_info:
+            message = f"{message}\n{self.formatException(record.exc_info)}"
+        return message
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON со всеми структурированными полями"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level="INFO", fmt="text", quiet=False, log_file=None):
+    """Настройка логов системы.
+
+    Агенты пишут записи в очередь (QueueHandler), а вывод в поток или
+    файл выполняет отдельный поток QueueListener, поэтому запись лога
+    не блокирует цикл событий. В режиме quiet выводятся только
+    предупреждения и ошибки. Возвращает запущенный QueueListener,
+    его нужно остановить через stop_logging() перед выходом.
+    """
+    if fmt not in LOG_FORMATS:
+        raise ValueError(f"Неизвестный формат логов '{fmt}'. Доступны: {', '.join(LOG_FORMATS)}")
+
+    if log_file:
+        handler = logging.FileHandler(log_file, encoding="utf-8")
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonLinesFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+
+    root = logging.getLogger(ROOT_LOGGER)
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.WARNING if quiet else level)
+    root.propagate = False
+
+    listener.start()
+    return listener
+
+
+def stop_logging(listener):
+    """Вывод оставшихся в очереди записей и остановка потока логов"""
+    if listener is not None:
+        listener.stop()
+
+
+def add_logging_arguments(parser):
+    """Общие параметры логирования для скриптов запуска"""
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="INFO",
+                        help="Уровень логов (DEBUG включает расчет каждой ставки и таблицы предложений)")
+    parser.add_argument("--log-format", choices=LOG_FORMATS, default="text",
+                        help="text - как раньше, json - одна запись JSON на строку")
+    parser.add_argument("--log-file", help="Писать логи в файл вместо stdout")
+    parser.add_argument("--quiet", action="store_true",
+                        help="Только предупреждения и ошибки (для нагрузочных тестов)")
\ No newline at end of file
@@ -0,0 +1,433 @@
+import asyncio
+import bisect
+import json
+import os
+import time
+
+# Границы корзин гистограмм по умолчанию
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800, 3600)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500, 1000)
+RETRY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонно растущий счетчик (по набору значений меток)"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def total(self):
+        return sum(self.values.values())
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, _format_labels(self.labels, key), value
+
+    def snapshot(self):
+        return {",".join(map(str, key)) or "": value for key, value in self.values.items()}
+
+    def state(self):
+        """Сырые значения для передачи между процессами"""
+        return dict(self.values)
+
+    def merge(self, state):
+        """Добавление значений, снятых state() в другом процессе"""
+        for key, value in state.items():
+            self.inc(*key, amount=value)
+
+
+class Gauge(Counter):
+    """Текущее значение (может уменьшаться)"""
+
+    kind = "gauge"
+
+    def set(self, *label_values, value):
+        self.values[label_values] = value
+
+    def merge(self, state):
+        # Метки датчиков у процессов не пересекаются (например, свой набор автомобилей)
+        self.values.update(state)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин.
+
+    Наблюдение - это бинарный поиск корзины и два сложения, поэтому
+    гистограммы можно оставлять включенными постоянно. Квантили
+    оцениваются линейной интерполяцией внутри корзины, как histogram_quantile
+    в Prometheus.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labels = tuple(labels)
+        # метки -> [счетчики корзин (+ корзина +Inf), сумма, количество]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *label_values):
+        series = self.values.get(label_values)
+        return series[2] if series else 0
+
+    def quantile(self, q, *label_values):
+        """Оценка квантиля q (0..1) по корзинам; None, если наблюдений нет"""
+        series = self.values.get(label_values)
+        if not series or not series[2]:
+            return None
+        rank = q * series[2]
+        cumulative = 0
+        for i, hits in enumerate(series[0]):
+            if cumulative + hits >= rank and hits:
+                if i == len(self.buckets):
+                    return self.buckets[-1] if self.buckets else None
+                lower = self.buckets[i - 1] if i > 0 else min(0.0, self.buckets[0])
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / hits
+            cumulative += hits
+        return self.buckets[-1]
+
+    def samples(self):
+        for key, (hits, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_hits in zip(self.buckets + (float("inf"),), hits):
+                cumulative += bucket_hits
+                yield (f"{self.name}_bucket", _format_labels(self.labels, key, ("le", _format_value(float(bound)))),
+                       cumulative)
+            yield f"{self.name}_sum", _format_labels(self.labels, key), total
+            yield f"{self.name}_count", _format_labels(self.labels, key), count
+
+    def snapshot(self):
+        result = {}
+        for key, (_, total, count) in self.values.items():
+            result[",".join(map(str, key))] = {
+                "count": count,
+                "sum": total,
+                "p50": self.quantile(0.5, *key),
+                "p99": self.quantile(0.99, *key),
+            }
+        return result
+
+    def state(self):
+        return {key: [list(hits), total, count] for key, (hits, total, count) in self.values.items()}
+
+    def merge(self, state):
+        for key, (hits, total, count) in state.items():
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0] = [a + b for a, b in zip(series[0], hits)]
+            series[1] += total
+            series[2] += count
+
+
+class MetricsRegistry:
+    """Набор метрик с выводом в текстовом формате Prometheus и в JSON"""
+
+    def __init__(self, prefix="delivery_"):
+        self.prefix = prefix
+        self.metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Метрика '{metric.name}' уже зарегистрирована")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(self.prefix + name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(self.prefix + name, help_text, labels))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, labels=()):
+        return self._register(Histogram(self.prefix + name, help_text, buckets, labels))
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus (version 0.0.4)"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Текущие значения всех метрик в виде словаря (для JSON)"""
+        return {name[len(self.prefix):]: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def state(self):
+        """Сырые значения всех метрик (для сбора метрик из нескольких процессов)"""
+        return {name: metric.state() for name, metric in self.metrics.items()}
+
+    def merge(self, state):
+        """Добавление состояния другого реестра с тем же набором метрик"""
+        for name, values in state.items():
+            metric = self.metrics.get(name)
+            if metric is not None:
+                metric.merge(values)
+
+    def clear(self):
+        for metric in self.metrics.values():
+            metric.values.clear()
+
+
+class DeliveryMetrics:
+    """Метрики протокола Contract Net: точки наблюдения для агентов.
+
+    Агенты вызывают методы-хуки (начало и конец раунда, отказ, повтор,
+    прием сообщения, доставка); все значения времени - в секундах
+    модельного времени. Один объект разделяется всеми агентами процесса.
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        self.round_latency = r.histogram(
+            "round_latency_seconds", "Длительность раунда сбора предложений", labels=("role",))
+        self.order_latency = r.histogram(
+            "order_latency_seconds", "Время от первого запроса магазина до получения товара")
+        self.assignment_latency = r.histogram(
+            "assignment_latency_seconds", "Время от первого запроса магазина до подтверждения заказа")
+        self.proposals_per_round = r.histogram(
+            "proposals_per_round", "Предложений, полученных магазином за раунд", COUNT_BUCKETS)
+        self.retries_per_order = r.histogram(
+            "retries_per_order", "Повторных раундов до подтверждения заказа", RETRY_BUCKETS)
+        self.rounds = r.counter("rounds_total", "Завершенные раунды сбора предложений", ("role", "outcome"))
+        self.retries = r.counter("retries_total", "Повторные запросы магазинов", ("cause",))
+        self.rejections = r.counter("rejections_total", "Отказы и отклонения заказов по причинам", ("reason",))
+        self.messages = r.counter("messages_received_total", "Принятые агентами сообщения", ("role", "type"))
+        self.dropped = r.counter("messages_dropped_total", "Отброшенные повторы и ответы на закрытые раунды",
+                                 ("role", "type", "reason"))
+        self.requested = r.counter("orders_requested_total", "Заказы, по которым магазин начал сбор предложений")
+        self.deliveries = r.counter("deliveries_total", "Выполненные доставки")
+        self.abandoned = r.counter("orders_abandoned_total", "Заказы, по которым магазин прекратил попытки",
+                                   ("cause",))
+        self.load_ratio = r.gauge("vehicle_load_ratio", "Доля занятой вместимости автомобиля", ("vehicle",))
+        self.busy_seconds = r.counter("vehicle_busy_seconds_total", "Время автомобиля в рейсе", ("vehicle",))
+        self.startup_latency = r.histogram(
+            "agent_startup_seconds", "Время от начала запуска агента до готовности (реальное)", labels=("role",))
+        self.startup_failures = r.counter("agent_startup_failures_total", "Агенты, которые не удалось запустить",
+                                          ("role",))
+
+    # --- Хуки ---
+
+    def message_received(self, role, msg_type):
+        self.messages.inc(role, msg_type or "unknown")
+
+    def message_dropped(self, role, msg_type, reason):
+        self.dropped.inc(role, msg_type or "unknown", reason)
+
+    def round_closed(self, role, round_):
+        self.round_latency.observe(round_.latency, role)
+        self.rounds.inc(role, "complete" if round_.all_responded else "timeout")
+
+    def proposals_received(self, count):
+        self.proposals_per_round.observe(count)
+
+    def rejection(self, reason):
+        self.rejections.inc(reason or "unknown")
+
+    def retry(self, cause):
+        self.retries.inc(cause)
+
+    def order_requested(self):
+        self.requested.inc()
+
+    def order_assigned(self, requested_at, now, retries):
+        self.assignment_latency.observe(now - requested_at)
+        self.retries_per_order.observe(retries)
+
+    def order_abandoned(self, cause):
+        self.abandoned.inc(cause)
+
+    def order_delivered(self, requested_at, now):
+        self.deliveries.inc()
+        if requested_at is not None:
+            self.order_latency.observe(now - requested_at)
+
+    def vehicle_load(self, vehicle, load, capacity):
+        self.load_ratio.set(vehicle, value=load / capacity if capacity else 0.0)
+
+    def vehicle_busy(self, vehicle, seconds):
+        self.busy_seconds.inc(vehicle, amount=seconds)
+
+    def agent_started(self, role, seconds):
+        self.startup_latency.observe(seconds, role)
+
+    def agent_start_failed(self, role):
+        self.startup_failures.inc(role)
+
+    # --- Экспорт ---
+
+    def render(self):
+        return self.registry.render()
+
+    def snapshot(self):
+        return self.registry.snapshot()
+
+
+class MetricsServer:
+    """Локальная HTTP точка /metrics в текстовом формате Prometheus.
+
+    Минимальный сервер на asyncio: отвечает на любой GET текущим
+    состоянием реестра и закрывает соединение.
+    """
+
+    def __init__(self, metrics, host="127.0.0.1", port=9108):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Заголовки запроса не нужны, но их надо дочитать
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+                status, body = "200 OK", self.metrics.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def start_metrics_export(metrics, port=None, path=None, interval=10.0, host="127.0.0.1"):
+    """Запуск выбранных способов экспорта. Возвращает список экспортеров с методом stop()"""
+    exporters = []
+    if port is not None:
+        exporters.append(await MetricsServer(metrics, host, port).start())
+    if path:
+        exporters.append(MetricsDumper(metrics, path, interval).start())
+    return exporters
+
+
+async def stop_metrics_export(exporters):
+    for exporter in exporters:
+        await exporter.stop()
+
+
+def add_metrics_arguments(parser):
+    """Общие параметры экспорта метрик для скриптов запуска"""
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Отдавать метрики в формате Prometheus на http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Периодически записывать метрики в файл (.json - снимок с квантилями, "
+                             "иначе текст Prometheus)")
+    parser.add_argument("--metrics-interval", type=float, default=10.0,
+                        help="Период записи файла метрик, секунды реального времени")
+
+
+class MetricsDumper:
+    """Периодическая запись метрик в файл.
+
+    Формат выбирается по расширению: .json - снимок с квантилями и
+    скоростью сообщений за интервал, иначе - текст Prometheus (подходит
+    для textfile collector из node_exporter). Файл заменяется атомарно.
+    Интервал задается в секундах реального времени.
+    """
+
+    def __init__(self, metrics, path, interval=10.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._task = None
+        self._last_messages = 0
+        self._last_time = time.monotonic()
+
+    def dump(self):
+        if self.path.endswith(".json"):
+            now = time.monotonic()
+            messages = self.metrics.messages.total()
+            elapsed = now - self._last_time
+            data = {
+                "timestamp": time.time(),
+                "messages_per_second": (messages - self._last_messages) / elapsed if elapsed > 0 else 0.0,
+                "metrics": self.metrics.snapshot(),
+            }
+            self._last_messages, self._last_time = messages, now
+            content = json.dumps(data, ensure_ascii=False, indent=2)
+        else:
+            content = self.metrics.render()
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def stop(self):
+        """Остановка с финальной записью"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.dump()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.dump()
\ No newline at end of file
@@ -0,0 +1,190 @@
+import asyncio
+import math
+import uuid
+from collections import OrderedDict
+
+
+def new_conversation_id():
+    """Идентификатор переговоров (поле thread сообщений).
+
+    Случайный, а не порядковый: после перезапуска агента номера пошли бы
+    заново и совпали бы с теми, что собеседники уже видели.
+    """
+    return uuid.uuid4().hex
+
+
+class SeenIds:
+    """Ограниченное множество недавно обработанных ключей (LRU).
+
+    add() за O(1) отвечает, встречался ли ключ; самые старые ключи
+    вытесняются после limit записей, поэтому память не растет.
+    """
+
+    def __init__(self, limit=4096):
+        self.limit = limit
+        self._keys = OrderedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def add(self, key):
+        """Запоминает ключ. Возвращает False, если он уже встречался"""
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return False
+        self._keys[key] = None
+        if len(self._keys) > self.limit:
+            self._keys.popitem(last=False)
+        return True
+
+
+class ProposalRound:
+    """Сессия сбора предложений (call for proposals) одного раунда.
+
+    Знает, от каких автомобилей ждать ответа, и завершается досрочно,
+    как только ответили все, либо по истечении дедлайна. Ответы
+    относятся к раунду по conversation_id (поле thread сообщения).
+    """
+
+    def __init__(self, expected, started_at, timeout, conversation_id=None, products=None):
+        self.conversation_id = conversation_id or new_conversation_id()
+        # Товары, запрошенные в раунде: по ним выбираются предложения
+        self.products = products
+        self.expected = set(expected)
+        self.started_at = started_at
+        self.deadline = started_at + timeout
+        self.responded = set()
+        self.responses = {}
+        self.proposals = []
+        self.refusals = []
+        # Назначение, выбранное диспетчером в режиме глобального распределения
+        self.assignment = None
+        self.closed_at = None
+        self._all_responded = asyncio.Event()
+        if not self.expected:
+            self._all_responded.set()
+
+    @property
+    def is_closed(self):
+        return self.closed_at is not None
+
+    @property
+    def all_responded(self):
+        return self._all_responded.is_set()
+
+    @property
+    def missing(self):
+        """Автомобили, не ответившие в этом раунде"""
+        return self.expected - self.responded
+
+    @property
+    def latency(self):
+        """Длительность раунда (в секундах модельного времени)"""
+        if self.closed_at is None:
+            return None
+        return self.closed_at - self.started_at
+
+    def add_response(self, responder, data):
+        """Учет ответа автомобиля. Возвращает False для повторного или лишнего ответа"""
+        return self.add_responses(responder, [data])
+
+    def add_responses(self, responder, bids):
+        """Учет ответа, содержащего сразу несколько предложений (пакет)"""
+        if self.is_closed or responder in self.responded:
+            return False
+
+        self.responded.add(responder)
+        self.responses[responder] = bids
+        for data in bids:
+            if data.get("can_deliver"):
+                self.proposals.append(data)
+            else:
+                self.refusals.append(data)
+
+        if self.expected <= self.responded:
+            self._all_responded.set()
+        return True
+
+    async def wait(self, clock):
+        """Ожидание ответов всех автомобилей или дедлайна раунда"""
+        await clock.wait_for(self._all_responded.wait(), self.deadline - clock.now())
+
+    def close(self, now):
+        if self.closed_at is None:
+            self.closed_at = now
+
+
+def offered_products(proposal, products):
+    """Товары, которые автомобиль предлагает довезти (без поля - весь заказ)"""
+    return proposal.get("products") or products
+
+
+def select_cover(proposals, products, max_nodes=20000):
+    """Самый дешевый набор предложений, вместе покрывающий заказ.
+
+    Предложение везет до products[товар] единиц каждой позиции, а его
+    стоимость (прирост маршрута) не зависит от того, сколько из
+    предложенного ему оставят. Это задача о покрытии с количествами; она
+    решается методом ветвей и границ по предложениям в порядке роста
+    стоимости. Ветвь отсекается, если она не дешевле найденного решения
+    или если оставшихся предложений не хватит на непокрытый остаток.
+    Первая ветвь (самые дешевые предложения подряд) сразу дает решение,
+    поэтому при исчерпании max_nodes узлов возвращается лучшее найденное.
+    При равной стоимости остается решение, найденное раньше.
+
+    Возвращает [(предложение, {товар: количество})] или None.
+    """
+    names = list(products)
+    ordered, offers = [], []
+    for proposal in sorted(proposals, key=lambda p: p["cost"]):
+        offered = offered_products(proposal, products)
+        offer = tuple(min(offered.get(name, 0), products[name]) for name in names)
+        if any(offer):
+            ordered.append(proposal)
+            offers.append(offer)
+
+    # Сколько каждой позиции могут довезти предложения начиная с i-го
+    n = len(ordered)
+    reach = [(0,) * len(names)] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        reach[i] = tuple(a + b for a, b in zip(offers[i], reach[i + 1]))
+
+    best_cost, best = math.inf, None
+    # Обход в глубину без рекурсии: предложений может быть столько же, сколько автомобилей
+    stack = [(0, tuple(products[name] for name in names), 0.0, ())]
+    nodes = 0
+    while stack and nodes < max_nodes:
+        i, need, cost, chosen = stack.pop()
+        nodes += 1
+        if not any(need):
+            if cost < best_cost:
+                best_cost, best = cost, chosen
+            continue
+        # Нужно еще хотя бы одно предложение, и самое дешевое из оставшихся - i-е
+        if i == n or cost + ordered[i]["cost"] >= best_cost:
+            continue
+        if any(q > left for q, left in zip(need, reach[i])):
+            continue
+        stack.append((i + 1, need, cost, chosen))
+        offer = offers[i]
+        if any(q and o for q, o in zip(need, offer)):
+            stack.append((i + 1, tuple(max(0, q - o) for q, o in zip(need, offer)),
+                          cost + ordered[i]["cost"], chosen + (i,)))
+
+    if best is None:
+        return None
+    parts = []
+    need = [products[name] for name in names]
+    for i in best:
+        part = {}
+        for k, name in enumerate(names):
+            quantity = min(need[k], offers[i][k])
+            if quantity:
+                part[name] = quantity
+                need[k] -= quantity
+        if part:
+            parts.append((ordered[i], part))
+    return parts
\ No newline at end of file
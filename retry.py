@@ -0,0 +1,68 @@
+import random
+
+
+class RetryPolicy:
+    """Политика повторных запросов магазина: экспоненциальная задержка с джиттером.
+
+    Задержка перед попыткой n (n = 1, 2, ...) равна base_delay * multiplier ** (n - 1),
+    но не больше max_delay. Джиттер разносит повторы магазинов во времени,
+    чтобы после общего отказа они не пришли к автомобилям одновременно:
+    none  - без джиттера;
+    full  - случайная задержка от 0 до расчетной;
+    equal - половина расчетной плюс случайная добавка до второй половины.
+    После max_attempts повторов магазин прекращает попытки (None - без ограничения).
+    Все задержки - в секундах модельного времени.
+    """
+
+    JITTER_MODES = ("none", "full", "equal")
+
+    def __init__(self, base_delay=1.0, multiplier=2.0, max_delay=60.0, max_attempts=None, jitter="equal"):
+        if base_delay <= 0 or multiplier < 1 or max_delay < base_delay:
+            raise ValueError("Нужны base_delay > 0, multiplier >= 1 и max_delay >= base_delay")
+        if jitter not in self.JITTER_MODES:
+            raise ValueError(f"Неизвестный режим джиттера '{jitter}'. Доступны: {', '.join(self.JITTER_MODES)}")
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.jitter = jitter
+
+    def exhausted(self, attempt):
+        """Исчерпан ли лимит: attempt - номер очередного повтора"""
+        return self.max_attempts is not None and attempt > self.max_attempts
+
+    def backoff(self, attempt):
+        """Расчетная задержка перед повтором attempt (без джиттера)"""
+        # Степень ограничивается, чтобы не получить переполнение при больших attempt
+        exponent = min(max(attempt - 1, 0), 64)
+        return min(self.max_delay, self.base_delay * self.multiplier ** exponent)
+
+    def delay(self, attempt, rng=random):
+        """Задержка перед повтором attempt с учетом джиттера"""
+        delay = self.backoff(attempt)
+        if self.jitter == "full":
+            return rng.uniform(0, delay)
+        if self.jitter == "equal":
+            return delay / 2 + rng.uniform(0, delay / 2)
+        return delay
+
+
+def add_retry_arguments(parser):
+    """Параметры повторных запросов магазинов для скриптов запуска"""
+    parser.add_argument("--retry-base", type=float, default=1.0,
+                        help="Задержка перед первым повтором запроса, секунды модельного времени")
+    parser.add_argument("--retry-max-delay", type=float, default=60.0,
+                        help="Верхняя граница задержки между повторами, секунды модельного времени")
+    parser.add_argument("--retry-max-attempts", type=int, default=None,
+                        help="Число повторов, после которого магазин прекращает попытки (по умолчанию - "
+                             "до закрытия окна приема)")
+    parser.add_argument("--retry-jitter", choices=RetryPolicy.JITTER_MODES, default="equal",
+                        help="Джиттер задержки: none, full (0..задержка) или equal (половина + случайная часть)")
+    parser.add_argument("--subscribe", action="store_true",
+                        help="Подписываться на освобождение места у отказавших автомобилей: "
+                             "повтор запроса начинается сразу по уведомлению, не дожидаясь задержки")
+
+
+def retry_policy_from_args(args):
+    return RetryPolicy(base_delay=args.retry_base, max_delay=args.retry_max_delay,
+                       max_attempts=args.retry_max_attempts, jitter=args.retry_jitter)
\ No newline at end of file
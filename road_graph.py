@@ -0,0 +1,217 @@
+"""Дорожные расстояния: кратчайшие пути по графу дорог вместо прямой.
+
+Граф читается из файла JSON:
+
+    {
+        "nodes": {"a": [0, 0], "b": [10, 0], "c": [10, 10]},
+        "edges": [["a", "b"], ["b", "c", 12.5], ["c", "a", 16.0, true]]
+    }
+
+Ребро - пара узлов, необязательная длина в км (по умолчанию - по прямой
+между узлами) и признак одностороннего движения. Склады (начальные позиции
+автомобилей) и магазины привязываются к ближайшим узлам графа, матрица
+кратчайших путей между ними считается один раз и сохраняется рядом с
+графом в файле .npy. Следующие запуски (и все процессы при --shards)
+открывают ее через memory map: расстояние берется из матрицы за O(1).
+
+Точки, которых нет в матрице, считаются по прямой, как без графа.
+"""
+import heapq
+import json
+import math
+import os
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для расстояний по дорогам
+    np = None
+
+from log import get_logger
+from route import euclidean_distance
+
+log = get_logger("road")
+
+# До этого размера графа кратчайшие пути считаются для всех пар узлов сразу
+# (Флойд - Уоршелл на массивах NumPy), для больших - Дейкстрой от каждого склада и магазина
+ALL_PAIRS_MAX_NODES = 400
+
+
+class RoadGraph:
+    """Граф дорог: координаты узлов и списки смежности"""
+
+    def __init__(self, nodes, edges):
+        self.ids = list(nodes)
+        index = {node: i for i, node in enumerate(self.ids)}
+        self.coords = np.array([nodes[node] for node in self.ids], dtype=np.float64).reshape(-1, 2)
+        self.adjacency = [[] for _ in self.ids]
+        for edge in edges:
+            try:
+                u, v = index[edge[0]], index[edge[1]]
+            except KeyError as e:
+                raise ValueError(f"Ребро {edge} ссылается на неизвестный узел {e}") from None
+            length = edge[2] if len(edge) > 2 and edge[2] is not None else euclidean_distance(
+                self.coords[u], self.coords[v])
+            self.adjacency[u].append((v, length))
+            if not (len(edge) > 3 and edge[3]):
+                self.adjacency[v].append((u, length))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["nodes"], data["edges"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nearest_nodes(self, points, chunk=1024):
+        """Ближайший узел и длина подъезда к нему по прямой для каждой точки"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        nodes = np.empty(len(points), dtype=np.int64)
+        offsets = np.empty(len(points), dtype=np.float64)
+        # Частями, чтобы матрица точки x узлы не занимала всю память на больших графах
+        for start in range(0, len(points), chunk):
+            delta = points[start:start + chunk, np.newaxis, :] - self.coords[np.newaxis, :, :]
+            d = np.hypot(delta[..., 0], delta[..., 1])
+            nearest = d.argmin(axis=1)
+            nodes[start:start + chunk] = nearest
+            offsets[start:start + chunk] = d[np.arange(len(nearest)), nearest]
+        return nodes, offsets
+
+    def shortest_paths(self, nodes):
+        """Матрица кратчайших путей между узлами nodes (inf - пути нет)"""
+        if len(self) <= ALL_PAIRS_MAX_NODES:
+            return self._all_pairs()[np.ix_(nodes, nodes)]
+        return np.array([self._dijkstra(source, nodes) for source in nodes], dtype=np.float64)
+
+    def _all_pairs(self):
+        n = len(self)
+        d = np.full((n, n), np.inf)
+        np.fill_diagonal(d, 0.0)
+        for u, edges in enumerate(self.adjacency):
+            for v, length in edges:
+                d[u, v] = min(d[u, v], length)
+        for k in range(n):
+            np.minimum(d, d[:, k, np.newaxis] + d[np.newaxis, k, :], out=d)
+        return d
+
+    def _dijkstra(self, source, targets):
+        """Пути от source до targets; поиск останавливается, когда все цели найдены"""
+        dist = {source: 0.0}
+        remaining = set(targets)
+        heap = [(0.0, source)]
+        settled = set()
+        while heap and remaining:
+            d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            remaining.discard(u)
+            for v, length in self.adjacency[u]:
+                nd = d + length
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return [dist.get(target, math.inf) for target in targets]
+
+
+class RoadDistance:
+    """Расстояния по дорогам между складами и магазинами.
+
+    Вызывается как функция расстояния (a, b) -> км и подставляется вместо
+    расстояния по прямой в маршруты, агентов и движок стоимости. Матрица
+    открыта через memory map: процессы с одним файлом делят страницы в
+    памяти, а в пул расчета ставок передается только путь к файлу.
+    """
+
+    def __init__(self, points, matrix_path):
+        self.points = [tuple(point) for point in points]
+        self.index = {point: i for i, point in enumerate(self.points)}
+        self.matrix_path = str(matrix_path)
+        self.matrix = np.load(self.matrix_path, mmap_mode="r")
+
+    @classmethod
+    def build(cls, graph_path, points, matrix_path=None):
+        """Матрица из файла, если он построен для того же графа и тех же точек; иначе расчет"""
+        if np is None:
+            raise RuntimeError("Расстояния по дорогам требуют пакет numpy (pip install numpy)")
+        graph_path = Path(graph_path)
+        matrix_path = Path(matrix_path or graph_path.with_name(graph_path.name + ".matrix.npy"))
+        meta_path = matrix_path.with_name(matrix_path.name + ".json")
+        points = list(dict.fromkeys((float(p[0]), float(p[1])) for p in points))
+
+        stat = graph_path.stat()
+        key = {"graph": str(graph_path.resolve()), "size": stat.st_size, "mtime": stat.st_mtime_ns,
+               "points": [list(point) for point in points]}
+        if matrix_path.exists() and meta_path.exists():
+            with open(meta_path, encoding="utf-8") as f:
+                if json.load(f) == key:
+                    log.info("Матрица расстояний по дорогам: %s (%d точек)", matrix_path, len(points))
+                    return cls(points, matrix_path)
+
+        graph = RoadGraph.load(graph_path)
+        nodes, offsets = graph.nearest_nodes(points)
+        unique = sorted(set(nodes.tolist()))
+        paths = graph.shortest_paths(unique)
+        position = np.searchsorted(unique, nodes)
+        # Путь между точками: подъезд к узлу, путь по графу и съезд от узла
+        matrix = paths[np.ix_(position, position)] + offsets[:, np.newaxis] + offsets[np.newaxis, :]
+        np.fill_diagonal(matrix, 0.0)
+        unreachable = int(np.isinf(matrix).sum())
+        if unreachable:
+            log.warning("Граф %s: нет пути для %d пар точек", graph_path, unreachable)
+
+        # Запись через временные файлы: процессы, открывшие матрицу раньше, не видят полузаписанный файл
+        tmp_path = matrix_path.with_name(matrix_path.name + ".tmp.npy")
+        np.save(tmp_path, matrix)
+        os.replace(tmp_path, matrix_path)
+        tmp_meta = meta_path.with_name(meta_path.name + ".tmp")
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(key, f)
+        os.replace(tmp_meta, meta_path)
+        log.info("Матрица расстояний по дорогам: граф %d узлов, %d точек -> %s",
+                 len(graph), len(points), matrix_path)
+        return cls(points, matrix_path)
+
+    def __call__(self, a, b):
+        i = self.index.get(tuple(a))
+        j = self.index.get(tuple(b))
+        if i is None or j is None:
+            return euclidean_distance(a, b)
+        return float(self.matrix[i, j])
+
+    def between(self, sources, targets):
+        """Матрица расстояний sources x targets (для движка стоимости)"""
+        rows = [self.index.get(tuple(point)) for point in sources]
+        cols = [self.index.get(tuple(point)) for point in targets]
+        if None not in rows and None not in cols:
+            return np.asarray(self.matrix[np.ix_(rows, cols)], dtype=np.float64)
+        return np.array([[self(a, b) for b in targets] for a in sources], dtype=np.float64).reshape(
+            len(sources), len(targets))
+
+    def __getstate__(self):
+        return {"points": self.points, "matrix_path": self.matrix_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["points"], state["matrix_path"])
+
+
+def network_points(vehicles_config, shops_config):
+    """Склады (начальные позиции автомобилей) и магазины - точки матрицы расстояний"""
+    return ([v.get("position", (0, 0)) for v in vehicles_config["vehicles"]]
+            + [s["location"] for s in shops_config["shops"]])
+
+
+def add_road_arguments(parser):
+    """Параметры расстояний по дорогам для скриптов запуска"""
+    parser.add_argument("--road-graph", default=None, metavar="PATH",
+                        help="Считать расстояния по графу дорог из файла JSON (без него - по прямой)")
+    parser.add_argument("--road-matrix", default=None, metavar="PATH",
+                        help="Файл матрицы кратчайших путей (по умолчанию <граф>.matrix.npy)")
+
+
+def road_distance_from_args(args, vehicles_config, shops_config):
+    if not args.road_graph:
+        return None
+    return RoadDistance.build(args.road_graph, network_points(vehicles_config, shops_config), args.road_matrix)
\ No newline at end of file
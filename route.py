@@ -0,0 +1,273 @@
+import bisect
+import math
+
+# Допуск при сравнении времени (часы)
+_EPS = 1e-9
+
+
+def euclidean_distance(a, b):
+    """Расстояние по прямой (по умолчанию; см. road_graph.RoadDistance)"""
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def service_start(arrival, time_window):
+    """Начало обслуживания с учетом окна приема (ожидание при раннем приезде).
+
+    Возвращает None, если автомобиль приезжает после закрытия окна.
+    """
+    if time_window is None:
+        return arrival
+    begin = max(arrival, time_window[0])
+    return begin if begin <= time_window[1] + _EPS else None
+
+
+class Stop:
+    """Остановка маршрута: доставка одного заказа"""
+
+    __slots__ = ("shop_id", "shop_jid", "location", "quantity", "time_window", "conversation_id", "products")
+
+    def __init__(self, shop_id, shop_jid, location, quantity, time_window=None, conversation_id=None,
+                 products=None):
+        self.shop_id = shop_id
+        self.shop_jid = shop_jid
+        self.location = tuple(location)
+        self.quantity = quantity
+        self.time_window = tuple(time_window) if time_window else None
+        # Переговоры, в которых заказ подтвержден (thread уведомления о доставке)
+        self.conversation_id = conversation_id
+        # Товары этой остановки: {товар: количество}
+        self.products = products or {}
+
+    def __repr__(self):
+        return f"Stop({self.shop_id}, {self.location})"
+
+
+class Route:
+    """Маршрут автомобиля из нескольких остановок.
+
+    Маршрут начинается в точке start в момент start_time (часы от полуночи)
+    и не возвращается на склад. Для каждой остановки хранится время начала
+    обслуживания и допустимый сдвиг (max shift) - на сколько его можно
+    отложить, не нарушив окон приема последующих магазинов. Это позволяет
+    оценить вставку новой остановки в любую позицию за O(1), а поиск
+    самой дешевой вставки - за O(длины маршрута).
+
+    Времена начала обслуживания вдоль маршрута не убывают, поэтому
+    позиции после остановок, обслуживаемых позже закрытия окна нового
+    магазина, отсекаются бинарным поиском.
+
+    distance - функция расстояния между точками, км (по прямой или по дорогам).
+    """
+
+    def __init__(self, start, speed, start_time=0.0, service_time=0.0, distance=euclidean_distance):
+        self.start = tuple(start)
+        self.speed = speed
+        self.start_time = start_time
+        self.service_time = service_time
+        self.distance = distance
+        self.stops = []
+        self._begin = []
+        self._max_shift = []
+
+    def __len__(self):
+        return len(self.stops)
+
+    def __iter__(self):
+        return iter(self.stops)
+
+    def copy(self):
+        """Снимок маршрута: расчеты по нему не видят последующих изменений оригинала"""
+        route = Route(self.start, self.speed, self.start_time, self.service_time, self.distance)
+        route.stops = list(self.stops)
+        route._begin = list(self._begin)
+        route._max_shift = list(self._max_shift)
+        return route
+
+    def travel_time(self, a, b):
+        return self.distance(a, b) / self.speed if self.speed > 0 else math.inf
+
+    def set_start(self, position, start_time):
+        """Перенос начала маршрута (текущая позиция и время автомобиля)"""
+        self.start = tuple(position)
+        self.start_time = start_time
+        self._recompute()
+
+    def length(self):
+        """Длина маршрута в км"""
+        total = 0.0
+        prev = self.start
+        for stop in self.stops:
+            total += self.distance(prev, stop.location)
+            prev = stop.location
+        return total
+
+    def arrival_times(self):
+        """Время начала обслуживания на каждой остановке"""
+        return list(self._begin)
+
+    def insertion_cost(self, location, time_window=None):
+        """Самая дешевая допустимая вставка новой остановки.
+
+        Возвращает (прирост длины маршрута, позиция, начало обслуживания,
+        ожидание открытия окна) или None, если вставка невозможна ни в одну
+        позицию из-за окон приема.
+        """
+        location = tuple(location)
+        best = None
+        prev = self.start
+        depart = self.start_time
+
+        last = len(self.stops)
+        if time_window is not None:
+            last = bisect.bisect_right(self._begin, time_window[1])
+
+        for k in range(last + 1):
+            nxt = self.stops[k] if k < len(self.stops) else None
+            d_in = self.distance(prev, location)
+            if nxt is not None:
+                d_out = self.distance(location, nxt.location)
+                delta = d_in + d_out - self.distance(prev, nxt.location)
+            else:
+                delta = d_in
+
+            if best is None or delta < best[0]:
+                arrival = depart + self._leg_time(d_in)
+                begin = service_start(arrival, time_window)
+                if begin is not None and self._fits_before(k, begin, d_out if nxt is not None else 0.0):
+                    best = (delta, k, begin, begin - arrival)
+
+            if nxt is not None:
+                prev = nxt.location
+                depart = self._begin[k] + self.service_time
+
+        return best
+
+    def insert(self, stop, position=None):
+        """Вставка остановки (по умолчанию - в самую дешевую позицию).
+
+        Возвращает позицию вставки или None, если вставка невозможна.
+        """
+        if position is None:
+            best = self.insertion_cost(stop.location, stop.time_window)
+            if best is None:
+                return None
+            position = best[1]
+        self.stops.insert(position, stop)
+        self._recompute()
+        return position
+
+    def pop_next(self):
+        """Снятие первой остановки: автомобиль отправляется к ней"""
+        stop = self.stops.pop(0)
+        begin = self._begin[0]
+        self.start = stop.location
+        self.start_time = begin + self.service_time
+        self._recompute()
+        return stop, begin
+
+    def is_feasible(self, stops=None):
+        """Проверка окон приема для заданного порядка остановок"""
+        return self._schedule(self.stops if stops is None else stops) is not None
+
+    def improve(self, max_moves=100):
+        """Локальное улучшение маршрута: 2-opt и перенос остановок (or-opt).
+
+        Принимаются только изменения, сокращающие длину и сохраняющие
+        допустимость окон приема. Возвращает величину сокращения длины.
+        """
+        initial = self.length()
+        for _ in range(max_moves):
+            if not (self._two_opt_move() or self._or_opt_move()):
+                break
+        self._recompute()
+        return initial - self.length()
+
+    def _leg_time(self, d):
+        return d / self.speed if self.speed > 0 else math.inf
+
+    def _fits_before(self, k, begin, d_out):
+        """Можно ли начать обслуживание новой остановки в begin перед остановкой k"""
+        if k >= len(self.stops):
+            return True
+        nxt = self.stops[k]
+        arrival = begin + self.service_time + self._leg_time(d_out)
+        new_begin = max(arrival, nxt.time_window[0]) if nxt.time_window else arrival
+        push = new_begin - self._begin[k]
+        return push <= self._max_shift[k] + _EPS
+
+    def _schedule(self, stops):
+        """Расчет начала обслуживания для порядка остановок (None - окно нарушено)"""
+        begins = []
+        prev = self.start
+        depart = self.start_time
+        for stop in stops:
+            begin = service_start(depart + self.travel_time(prev, stop.location), stop.time_window)
+            if begin is None:
+                return None
+            begins.append(begin)
+            prev = stop.location
+            depart = begin + self.service_time
+        return begins
+
+    def _recompute(self):
+        n = len(self.stops)
+        begins = []
+        arrivals = []
+        prev = self.start
+        depart = self.start_time
+        for stop in self.stops:
+            arrival = depart + self.travel_time(prev, stop.location)
+            begin = max(arrival, stop.time_window[0]) if stop.time_window else arrival
+            arrivals.append(arrival)
+            begins.append(begin)
+            prev = stop.location
+            depart = begin + self.service_time
+
+        # Допустимый сдвиг считается с конца: ожидание у следующей остановки
+        # поглощает часть задержки
+        max_shift = [0.0] * n
+        for k in range(n - 1, -1, -1):
+            window = self.stops[k].time_window
+            slack = (window[1] - begins[k]) if window else math.inf
+            if k < n - 1:
+                slack = min(slack, (begins[k + 1] - arrivals[k + 1]) + max_shift[k + 1])
+            max_shift[k] = max(slack, 0.0)
+
+        self._begin = begins
+        self._max_shift = max_shift
+
+    def _two_opt_move(self):
+        n = len(self.stops)
+        current = self.length()
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                candidate = self.stops[:i] + self.stops[i:j + 1][::-1] + self.stops[j + 1:]
+                if self._accept(candidate, current):
+                    return True
+        return False
+
+    def _or_opt_move(self):
+        n = len(self.stops)
+        current = self.length()
+        for size in (1, 2, 3):
+            for i in range(n - size + 1):
+                segment = self.stops[i:i + size]
+                rest = self.stops[:i] + self.stops[i + size:]
+                for k in range(len(rest) + 1):
+                    if k == i:
+                        continue
+                    candidate = rest[:k] + segment + rest[k:]
+                    if self._accept(candidate, current):
+                        return True
+        return False
+
+    def _accept(self, candidate, current_length):
+        length = 0.0
+        prev = self.start
+        for stop in candidate:
+            length += self.distance(prev, stop.location)
+            prev = stop.location
+        if length < current_length - 1e-9 and self.is_feasible(candidate):
+            self.stops = candidate
+            return True
+        return False
\ No newline at end of file
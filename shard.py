@@ -0,0 +1,536 @@
+"""Запуск агентов в нескольких процессах (шардах).
+
+Координатор делит автомобили и магазины из конфигурации между N
+процессами-шардами. У каждого шарда свой цикл событий и свои агенты,
+поэтому система использует несколько ядер. Координатор запускает шарды,
+опрашивает их состояние, собирает общие метрики и останавливает шарды.
+
+Агенты разных шардов обмениваются сообщениями так:
+- xmpp: каждый процесс подключается к XMPP серверу, сообщения
+  доставляет сервер;
+- memory: у каждого шарда есть входящая очередь multiprocessing.
+  Сообщение другому шарду отправляется в его очередь, а отправки за
+  одну итерацию цикла событий объединяются в один пакет.
+"""
+import asyncio
+import multiprocessing
+import multiprocessing.connection
+import signal
+import threading
+import time
+import traceback
+
+from spade.message import Message
+
+from journal import journal_from_args
+from road_graph import road_distance_from_args
+from log import get_logger, setup_logging, stop_logging
+from metrics import DeliveryMetrics, start_metrics_export, stop_metrics_export
+from sim_clock import RealTimeClock, create_clock
+from spatial_index import SpatialIndex
+from startup import orchestrator_from_args
+from transport import InMemoryTransport, XMPPTransport
+
+log = get_logger("shard")
+
+DISPATCHER_SHARD = 0
+
+
+def _stripes(configs, n_shards, position_key):
+    """Номера шардов для записей: полосы равного размера по оси x.
+
+    Соседние магазины и автомобили попадают в один шард, поэтому при
+    рассылке ближайшим автомобилям (--nearest) большая часть сообщений
+    не покидает процесс.
+    """
+    order = sorted(range(len(configs)), key=lambda i: tuple(configs[i].get(position_key) or (0, 0))[0])
+    shards = [0] * len(configs)
+    for rank, i in enumerate(order):
+        shards[i] = rank * n_shards // len(configs)
+    return shards
+
+
+def partition(vehicles, shops, n_shards):
+    """Распределение агентов по шардам.
+
+    Возвращает список планов шардов (индексы автомобилей и магазинов
+    в конфигурации) и таблицу маршрутизации JID -> номер шарда.
+    """
+    plans = [{"vehicles": [], "shops": []} for _ in range(n_shards)]
+    routes = {}
+    for kind, configs, key in (("vehicles", vehicles, "position"), ("shops", shops, "location")):
+        if not configs:
+            continue
+        for i, shard in enumerate(_stripes(configs, n_shards, key)):
+            plans[shard][kind].append(i)
+            routes[configs[i]["jid"]] = shard
+    return plans, routes
+
+
+def position_listeners(shops, routes, shard_id):
+    """Получатели отчетов о позиции автомобилей шарда: по одному магазину каждого другого шарда.
+
+    Пространственный индекс общий для всех агентов шарда, поэтому отчет
+    достаточно доставить одному магазину: он обновит индекс своего шарда.
+    """
+    listeners = {}
+    for s_config in shops:
+        shard = routes.get(s_config["jid"], shard_id)
+        if shard != shard_id:
+            listeners.setdefault(shard, s_config["jid"])
+    return list(listeners.values())
+
+
+def _pack(msg):
+    # У Message в SPADE нет публичного доступа ко всем метаданным сразу
+    return str(msg.to), str(msg.sender), msg.body, msg.thread, dict(msg._metadata)
+
+
+def _unpack(payload):
+    to, sender, body, thread, metadata = payload
+    return Message(to=to, sender=sender, body=body, thread=thread, metadata=metadata)
+
+
+class ShardTransport(InMemoryTransport):
+    """Внутрипроцессная шина шарда с доставкой агентам других шардов.
+
+    Сообщения локальным агентам доставляются как в InMemoryTransport.
+    Сообщения остальным копятся до конца текущей итерации цикла событий
+    и уходят во входящую очередь шарда получателя одним пакетом.
+    """
+
+    def __init__(self, shard_id, routes, inboxes):
+        super().__init__()
+        self.shard_id = shard_id
+        self.routes = routes
+        self.inboxes = inboxes
+        self.sent_remote = 0
+        self.received_remote = 0
+        self._outgoing = {}
+
+    async def send(self, msg, behaviour):
+        shard = self.routes.get(str(msg.to.bare), self.shard_id)
+        if shard == self.shard_id:
+            self.deliver(msg)
+            return
+        if not self._outgoing:
+            asyncio.get_running_loop().call_soon(self.flush)
+        self._outgoing.setdefault(shard, []).append(_pack(msg))
+
+    def flush(self):
+        """Отправка накопленных пакетов в очереди других шардов"""
+        for shard, batch in self._outgoing.items():
+            self.inboxes[shard].put(("messages", batch))
+            self.sent_remote += len(batch)
+        self._outgoing = {}
+
+    def deliver_remote(self, batch):
+        """Доставка пакета, пришедшего из другого шарда"""
+        self.received_remote += len(batch)
+        for payload in batch:
+            self.deliver(_unpack(payload))
+
+
+class QueueReader(threading.Thread):
+    """Поток, переносящий записи из очереди multiprocessing в цикл событий.
+
+    Поток блокируется на get(), поэтому цикл событий не опрашивает
+    очередь и просыпается только при появлении записей. None в очереди
+    завершает поток.
+    """
+
+    def __init__(self, queue, loop, callback, name="queue-reader"):
+        super().__init__(name=name, daemon=True)
+        self.queue = queue
+        self.loop = loop
+        self.callback = callback
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.loop.call_soon_threadsafe(self.callback, item)
+
+    def stop(self):
+        self.queue.put(None)
+
+
+class ShardWorker:
+    """Агенты одного шарда. Выполняет команды координатора из входящей очереди"""
+
+    def __init__(self, shard_id, plan, routes, args, vehicles_config, shops_config, clock_start, inboxes, events):
+        self.shard_id = shard_id
+        self.plan = plan
+        self.routes = routes
+        self.args = args
+        self.vehicles_config = vehicles_config
+        self.shops_config = shops_config
+        self.clock_start = clock_start
+        self.inboxes = inboxes
+        self.events = events
+        self.agents = []
+        self.commands = None
+        self.transport = None
+        self.metrics = None
+
+    def on_item(self, item):
+        if item[0] == "messages":
+            self.transport.deliver_remote(item[1])
+        else:
+            self.commands.put_nowait(item)
+
+    def report(self, kind, payload=None):
+        self.events.put((kind, self.shard_id, payload))
+
+    def health(self, sent_at=None):
+        """Состояние шарда для координатора"""
+        transport = self.transport
+        return {
+            "agents": sum(1 for agent in self.agents if agent.is_alive()),
+            "vehicles": len(self.plan["vehicles"]),
+            "shops": len(self.plan["shops"]),
+            "sent_remote": getattr(transport, "sent_remote", 0),
+            "received_remote": getattr(transport, "received_remote", 0),
+            "dropped": getattr(transport, "dropped", 0),
+            # Задержка команды: очередь + занятость цикла событий шарда
+            "latency": time.monotonic() - sent_at if sent_at is not None else None,
+            "metrics": self.metrics.registry.state() if self.metrics is not None else None,
+        }
+
+    async def next_command(self, *expected):
+        """Ожидание одной из команд expected или stop; на ping отвечает сразу"""
+        while True:
+            command = await self.commands.get()
+            if command[0] == "ping":
+                self.report("health", self.health(command[1]))
+            elif command[0] == "stop" or command[0] in expected:
+                return command[0]
+
+    async def run(self):
+        # Отложенный импорт: start.py сам запускает координатор шардов
+        from start import create_dispatcher, create_pricing_executor, create_shop, create_vehicle
+
+        args = self.args
+        loop = asyncio.get_running_loop()
+        self.commands = asyncio.Queue()
+        if args.transport == "memory":
+            self.transport = ShardTransport(self.shard_id, self.routes, self.inboxes)
+        else:
+            self.transport = XMPPTransport()
+        reader = QueueReader(self.inboxes[self.shard_id], loop, self.on_item, f"shard{self.shard_id}-inbox")
+        reader.start()
+        _watch_parent(self.inboxes[self.shard_id])
+
+        start_datetime, started = self.clock_start
+        clock = RealTimeClock(args.time_scale if args.clock == "accelerated" else 1.0, start_datetime, started)
+        self.metrics = DeliveryMetrics() if args.metrics_port is not None or args.metrics_file else None
+        vehicles = self.vehicles_config["vehicles"]
+        shops = self.shops_config["shops"]
+        vehicle_jids = [v["jid"] for v in vehicles]
+
+        # Матрицу расстояний координатор уже посчитал: шард открывает тот же файл
+        road = road_distance_from_args(args, self.vehicles_config, self.shops_config)
+        cost_engine = None
+        if args.cost_engine:
+            from cost_engine import CostEngine
+            from agent import DEFAULT_TARIFF_PER_KM
+            cost_engine = CostEngine.from_config(self.vehicles_config, self.shops_config,
+                                                 default_tariff=DEFAULT_TARIFF_PER_KM, road=road)
+        spatial_index = None
+        if args.nearest > 0:
+            spatial_index = SpatialIndex(cell_size=args.grid_cell)
+            # Автомобили других шардов известны по начальной позиции; дальше
+            # их положение обновляют отчеты position_report, которые они
+            # присылают одному магазину этого шарда (см. position_listeners)
+            for v_config in vehicles:
+                spatial_index.update(v_config["jid"], v_config.get("position", (0, 0)), v_config["capacity"])
+        pricing_executor = create_pricing_executor(args.pricing_pool, args.pricing_workers)
+        # У каждого шарда свой файл журнала: разбиение по шардам детерминировано,
+        # и при перезапуске с тем же --shards агенты найдут свое состояние
+        journal = journal_from_args(args, f".shard{self.shard_id}")
+        orchestrator = orchestrator_from_args(self.transport, args, self.metrics)
+        dispatcher_jid = None
+        if args.dispatcher or args.assignment == "global":
+            dispatcher_jid = f"dispatcher@{self.vehicles_config['xmpp_server']}"
+
+        try:
+            if await self.next_command("start_vehicles") == "stop":
+                return
+            agents = [create_vehicle(vehicles[i], clock, args.codec, cost_engine, spatial_index, self.metrics,
+                                     args.vehicle_concurrency, pricing_executor, journal, road)
+                      for i in self.plan["vehicles"]]
+            if spatial_index is not None:
+                listeners = position_listeners(shops, self.routes, self.shard_id)
+                for agent in agents:
+                    agent.set("position_listeners", listeners)
+            self.agents += (await orchestrator.start_all(agents, "vehicle")).started
+            if dispatcher_jid and self.shard_id == DISPATCHER_SHARD:
+                dispatcher = create_dispatcher(self.vehicles_config["xmpp_server"], clock, vehicle_jids,
+                                               args.proposal_timeout, args.assignment, args.codec, self.metrics)
+                self.agents += (await orchestrator.start_all([dispatcher], "dispatcher")).started
+            self.report("vehicles_ready", len(self.agents))
+
+            if await self.next_command("start_shops") == "stop":
+                return
+            retry_policy = _retry_policy(args)
+            agents = [create_shop(shops[i], clock, vehicle_jids, dispatcher_jid, args.proposal_timeout,
+                                  spatial_index, args.nearest, args.search_radius, args.codec, self.metrics,
+                                  args.seed, retry_policy, args.subscribe, journal)
+                      for i in self.plan["shops"]]
+            started = (await orchestrator.start_all(agents, "shop")).started
+            self.agents += started
+            self.check_position_listener(shops, started, spatial_index)
+            self.report("ready", len(self.agents))
+
+            await self.next_command()
+        finally:
+            for agent in self.agents:
+                await self.transport.stop_agent(agent)
+            if isinstance(self.transport, ShardTransport):
+                self.transport.flush()
+            if pricing_executor is not None:
+                pricing_executor.shutdown(wait=False, cancel_futures=True)
+            if journal is not None:
+                journal.close()
+            self.report("stopped", self.health())
+            reader.stop()
+
+
+    def check_position_listener(self, shops, started, spatial_index):
+        """Магазин, которому другие шарды шлют отчеты о позиции, должен быть запущен"""
+        if spatial_index is None or len(self.inboxes) < 2:
+            return
+        listener = next((s["jid"] for s in shops if self.routes.get(s["jid"]) == self.shard_id), None)
+        if listener is not None and listener not in {str(shop.jid.bare) for shop in started}:
+            log.warning(f"Шард {self.shard_id}: магазин {listener} не запущен, позиции автомобилей "
+                        f"других шардов в индексе не обновляются")
+
+
+def _retry_policy(args):
+    from retry import retry_policy_from_args
+    return retry_policy_from_args(args)
+
+
+def _watch_parent(inbox):
+    """Остановка шарда, если процесс координатора завершился без команды stop"""
+    parent = multiprocessing.parent_process()
+    if parent is None:
+        return
+
+    def watch():
+        multiprocessing.connection.wait([parent.sentinel])
+        inbox.put(("stop",))
+
+    threading.Thread(target=watch, name="parent-watch", daemon=True).start()
+
+
+def run_worker(shard_id, plan, routes, args, vehicles_config, shops_config, clock_start, inboxes, events):
+    """Точка входа процесса-шарда"""
+    # Ctrl+C получает вся группа процессов: шард останавливает координатор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    listener = setup_logging(args.log_level, args.log_format, args.quiet, args.log_file)
+    try:
+        asyncio.run(ShardWorker(shard_id, plan, routes, args, vehicles_config, shops_config, clock_start,
+                                inboxes, events).run())
+    except Exception:
+        events.put(("failed", shard_id, traceback.format_exc()))
+    finally:
+        stop_logging(listener)
+
+
+class ShardCoordinator:
+    """Запуск шардов, проверка их состояния, сбор метрик и остановка.
+
+    Запуск идет в две фазы: сначала все шарды поднимают автомобили (и
+    диспетчера), и только после этого - магазины, чтобы первые запросы
+    магазинов не уходили агентам, которые еще не запущены в другом шарде.
+    """
+
+    def __init__(self, args, vehicles_config, shops_config, n_shards, health_interval=5.0,
+                 start_timeout=120.0, stop_timeout=15.0):
+        self.args = args
+        self.vehicles_config = vehicles_config
+        self.shops_config = shops_config
+        self.n_shards = n_shards
+        self.health_interval = health_interval
+        self.start_timeout = start_timeout
+        self.stop_timeout = stop_timeout
+        self.processes = []
+        self.inboxes = []
+        self.events = None
+        self.health = {}
+        self.failures = {}
+        self.arrived = {}
+        self.metrics = None
+        self._changed = None
+        self._pinged = {}
+
+    def on_event(self, event):
+        kind, shard, payload = event
+        if kind == "failed":
+            self.failures[shard] = payload
+            log.error("Шард %s завершился с ошибкой:\n%s", shard, payload)
+        elif kind in ("health", "stopped") and payload is not None:
+            self.health[shard] = payload
+            self._pinged.pop(shard, None)
+            self.aggregate()
+        self.arrived.setdefault(kind, set()).add(shard)
+        self._changed.set()
+
+    def aggregate(self):
+        """Общие метрики: сумма последних состояний всех шардов"""
+        if self.metrics is None:
+            return
+        self.metrics.registry.clear()
+        for status in self.health.values():
+            if status.get("metrics"):
+                self.metrics.registry.merge(status["metrics"])
+
+    def broadcast(self, *command):
+        for inbox in self.inboxes:
+            inbox.put(command)
+
+    async def wait_for(self, kind, timeout):
+        """Ожидание события kind от всех шардов"""
+        deadline = time.monotonic() + timeout
+        while len(self.arrived.get(kind, ())) < self.n_shards:
+            if self.failures:
+                raise RuntimeError(f"Шарды {sorted(self.failures)} не запустились")
+            dead = [i for i, p in enumerate(self.processes) if p.exitcode is not None]
+            if dead:
+                raise RuntimeError(f"Процессы шардов {dead} завершились при запуске")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                waiting = sorted(set(range(self.n_shards)) - self.arrived.get(kind, set()))
+                raise TimeoutError(f"Шарды {waiting} не ответили за {timeout:g} с")
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), min(remaining, 1.0))
+            except asyncio.TimeoutError:
+                pass
+
+    def check_health(self):
+        """Проверка процессов и ответов на прошлый опрос; затем новый опрос"""
+        now = time.monotonic()
+        for shard, process in enumerate(self.processes):
+            if process.exitcode is not None:
+                if shard not in self.failures:
+                    self.failures[shard] = f"код завершения {process.exitcode}"
+                    log.error("Шард %s (pid %s) завершился: код %s", shard, process.pid, process.exitcode)
+                continue
+            pinged = self._pinged.get(shard)
+            if pinged is not None and now - pinged > 2 * self.health_interval:
+                log.warning("Шард %s не отвечает %.0f с", shard, now - pinged)
+            self._pinged.setdefault(shard, now)
+            self.inboxes[shard].put(("ping", now))
+
+        if self.health:
+            latency = max((s["latency"] or 0.0) for s in self.health.values())
+            remote = sum(s["sent_remote"] for s in self.health.values())
+            log.debug("Шарды: агентов %s, межшардовых сообщений %s, задержка опроса до %.3f с",
+                      sum(s["agents"] for s in self.health.values()), remote, latency)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        context = multiprocessing.get_context("spawn")
+        vehicles = self.vehicles_config["vehicles"]
+        shops = self.shops_config["shops"]
+        plans, routes = partition(vehicles, shops, self.n_shards)
+        if self.args.dispatcher or self.args.assignment == "global":
+            routes[f"dispatcher@{self.vehicles_config['xmpp_server']}"] = DISPATCHER_SHARD
+
+        # Общее модельное время: шарды получают момент запуска координатора
+        clock = create_clock(self.args.clock, self.args.time_scale, self.args.start_hour)
+        clock_start = (clock.start_datetime, clock.started)
+
+        self.events = context.Queue()
+        self.inboxes = [context.Queue() for _ in range(self.n_shards)]
+        reader = QueueReader(self.events, loop, self.on_event, "shard-events")
+        reader.start()
+        if self.args.metrics_port is not None or self.args.metrics_file:
+            self.metrics = DeliveryMetrics()
+
+        for shard, plan in enumerate(plans):
+            process = context.Process(
+                target=run_worker, name=f"shard{shard}",
+                args=(shard, plan, routes, self.args, self.vehicles_config, self.shops_config, clock_start,
+                      self.inboxes, self.events))
+            process.start()
+            self.processes.append(process)
+            log.info(f"✓ Шард {shard} (pid {process.pid}): автомобилей {len(plan['vehicles'])}, "
+                     f"магазинов {len(plan['shops'])}")
+
+        exporters = []
+        try:
+            started = time.monotonic()
+            self.broadcast("start_vehicles")
+            await self.wait_for("vehicles_ready", self.start_timeout)
+            self.broadcast("start_shops")
+            await self.wait_for("ready", self.start_timeout)
+            log.info("=" * 60)
+            log.info(f"ВСЕ ШАРДЫ ЗАПУЩЕНЫ ({self.n_shards} процессов, {time.monotonic() - started:.1f} с)")
+            log.info("=" * 60)
+
+            if self.metrics is not None:
+                exporters = await start_metrics_export(self.metrics, self.args.metrics_port,
+                                                       self.args.metrics_file, self.args.metrics_interval)
+                if self.args.metrics_port is not None:
+                    log.info(f"   Метрики всех шардов: http://127.0.0.1:{exporters[0].port}/metrics")
+
+            while True:
+                self.check_health()
+                if len(self.failures) == self.n_shards:
+                    log.error("Все шарды завершились")
+                    break
+                await asyncio.sleep(self.health_interval)
+
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            log.info("--- ОСТАНОВКА ШАРДОВ ---")
+            raise
+
+        finally:
+            await self.shutdown()
+            await stop_metrics_export(exporters)
+            reader.stop()
+
+    async def shutdown(self):
+        """Команда stop всем шардам, ожидание финальных отчетов, затем завершение процессов"""
+        self.arrived.pop("stopped", None)
+        self.broadcast("stop")
+        alive = sum(1 for p in self.processes if p.exitcode is None)
+        deadline = time.monotonic() + self.stop_timeout
+        while len(self.arrived.get("stopped", ())) < alive and time.monotonic() < deadline:
+            if all(p.exitcode is not None for p in self.processes):
+                break
+            await asyncio.sleep(0.1)
+
+        for process in self.processes:
+            await asyncio.get_running_loop().run_in_executor(None, process.join, max(deadline - time.monotonic(), 1))
+            if process.exitcode is None:
+                log.warning("Шард %s не остановился за %g с, процесс завершается принудительно",
+                            process.name, self.stop_timeout)
+                process.terminate()
+                process.join()
+
+        if self.health:
+            log.info("Шарды остановлены: межшардовых сообщений %s, потеряно %s",
+                     sum(s["sent_remote"] for s in self.health.values()),
+                     sum(s["dropped"] for s in self.health.values()))
+
+
+def add_shard_arguments(parser):
+    """Параметры многопроцессного запуска"""
+    parser.add_argument("--shards", type=int, default=1, metavar="N",
+                        help="Число процессов с агентами (0 - по числу ядер, 1 - все агенты в одном процессе)")
+    parser.add_argument("--health-interval", type=float, default=5.0,
+                        help="Период опроса состояния шардов, секунды реального времени")
+
+
+async def run_sharded(args, vehicles_config, shops_config):
+    """Запуск системы в args.shards процессах"""
+    n_shards = args.shards or multiprocessing.cpu_count()
+    # Кратчайшие пути считаются один раз до запуска шардов
+    road_distance_from_args(args, vehicles_config, shops_config)
+    await ShardCoordinator(args, vehicles_config, shops_config, n_shards, args.health_interval).run()
\ No newline at end of file
@@ -0,0 +1,161 @@
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta
+
+# Длительности доставки считаются в часах, часы симуляции - в секундах
+SECONDS_PER_HOUR = 3600
+
+
+def _hours_since_midnight(start_datetime, moment):
+    midnight = start_datetime.replace(hour=0, minute=0, second=0, microsecond=0)
+    return (moment - midnight).total_seconds() / SECONDS_PER_HOUR
+
+
+class RealTimeClock:
+    """Часы реального времени.
+
+    При time_scale > 1 работают в ускоренном режиме: одна секунда
+    модельного времени длится 1 / time_scale реальных секунд.
+    """
+
+    def __init__(self, time_scale=1.0, start_datetime=None, started=None):
+        if time_scale <= 0:
+            raise ValueError("time_scale должен быть положительным")
+        self.time_scale = time_scale
+        self.start_datetime = start_datetime or datetime.now()
+        # started - момент запуска по time.monotonic(); передается процессам
+        # одного запуска, чтобы их часы показывали одно модельное время
+        self.started = time.monotonic() if started is None else started
+
+    def now(self):
+        """Модельное время в секундах с момента запуска"""
+        return (time.monotonic() - self.started) * self.time_scale
+
+    def datetime(self):
+        """Модельное время в виде datetime"""
+        return self.start_datetime + timedelta(seconds=self.now())
+
+    def day_hours(self):
+        """Модельное время в часах от полуночи дня запуска (шкала окон приема магазинов)"""
+        return _hours_since_midnight(self.start_datetime, self.datetime())
+
+    async def sleep(self, delay):
+        """Ожидание delay секунд модельного времени"""
+        await asyncio.sleep(max(delay, 0) / self.time_scale)
+
+    async def wait_for(self, awaitable, timeout):
+        """Ожидание awaitable не дольше timeout секунд модельного времени.
+
+        Возвращает True, если awaitable завершился до таймаута.
+        """
+        try:
+            await asyncio.wait_for(awaitable, max(timeout, 0) / self.time_scale)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class VirtualClock:
+    """Часы дискретно-событийной симуляции.
+
+    sleep() не ждет реального времени: спящие корутины складываются
+    в кучу по времени пробуждения. Когда цикл событий успокоится
+    (все готовые к работе задачи отработали), модельное время
+    перескакивает к ближайшему событию и будятся все, кто ждет его.
+    """
+
+    def __init__(self, start_datetime=None, settle_steps=20):
+        self.start_datetime = start_datetime or datetime.now()
+        self.settle_steps = settle_steps
+        self._now = 0.0
+        self._sleepers = []
+        self._counter = itertools.count()
+        self._driver = None
+
+    def now(self):
+        return self._now
+
+    def datetime(self):
+        return self.start_datetime + timedelta(seconds=self._now)
+
+    def day_hours(self):
+        return _hours_since_midnight(self.start_datetime, self.datetime())
+
+    async def sleep(self, delay):
+        if delay <= 0:
+            await asyncio.sleep(0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers, (self._now + delay, next(self._counter), future))
+        self._ensure_driver()
+        await future
+
+    async def wait_for(self, awaitable, timeout):
+        task = asyncio.ensure_future(awaitable)
+        timer = asyncio.ensure_future(self.sleep(timeout))
+        done, _ = await asyncio.wait({task, timer}, return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            timer.cancel()
+            return True
+        task.cancel()
+        return False
+
+    def pending(self):
+        """Количество ожидающих пробуждения корутин"""
+        return sum(1 for _, _, future in self._sleepers if not future.done())
+
+    def _ensure_driver(self):
+        if self._driver is None or self._driver.done():
+            self._driver = asyncio.ensure_future(self._drive())
+
+    async def _settle(self):
+        # Даем отработать всем задачам, готовым к выполнению в текущий момент
+        # модельного времени (доставка сообщений, обработчики, ответы)
+        for _ in range(self.settle_steps):
+            await asyncio.sleep(0)
+
+    async def _drive(self):
+        while self._sleepers:
+            await self._settle()
+            # Отмененные ожидания (например, таймеры wait_for) не двигают время
+            while self._sleepers and self._sleepers[0][2].done():
+                heapq.heappop(self._sleepers)
+            if not self._sleepers:
+                break
+
+            wake_time = self._sleepers[0][0]
+            self._now = max(self._now, wake_time)
+            while self._sleepers and self._sleepers[0][0] <= wake_time:
+                _, _, future = heapq.heappop(self._sleepers)
+                if not future.done():
+                    future.set_result(None)
+
+
+CLOCK_MODES = ("realtime", "accelerated", "virtual")
+
+
+def create_clock(mode="realtime", time_scale=60.0, start_hour=None):
+    """Создание часов по режиму запуска.
+
+    realtime    - реальное время;
+    accelerated - реальное время, ускоренное в time_scale раз;
+    virtual     - дискретно-событийная симуляция без ожиданий.
+
+    start_hour задает модельное время суток в момент запуска (например, 8.0 -
+    начало рабочего дня). По умолчанию часы стартуют с текущего времени.
+    """
+    start_datetime = None
+    if start_hour is not None:
+        midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        start_datetime = midnight + timedelta(hours=start_hour)
+
+    if mode == "realtime":
+        return RealTimeClock(start_datetime=start_datetime)
+    if mode == "accelerated":
+        return RealTimeClock(time_scale=time_scale, start_datetime=start_datetime)
+    if mode == "virtual":
+        return VirtualClock(start_datetime=start_datetime)
+    raise ValueError(f"Неизвестный режим часов '{mode}'. Доступны: {', '.join(CLOCK_MODES)}")
\ No newline at end of file
@@ -0,0 +1,128 @@
+import math
+
+
+class SpatialIndex:
+    """Равномерная сетка по позициям автомобилей.
+
+    Каждый автомобиль лежит в ячейке размером cell_size × cell_size.
+    Поиск ближайших обходит кольца ячеек вокруг точки запроса и
+    останавливается, как только найдены k кандидатов ближе, чем
+    любая непросмотренная ячейка. Обновление позиции - O(1).
+    """
+
+    def __init__(self, cell_size=10.0):
+        if cell_size <= 0:
+            raise ValueError("cell_size должен быть положительным")
+        self.cell_size = cell_size
+        self._cells = {}
+        self._positions = {}
+        self._free = {}
+        self._bounds = None
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, jid):
+        return str(jid) in self._positions
+
+    def update(self, jid, position, free_capacity):
+        """Отчет автомобиля о позиции и свободном месте"""
+        jid = str(jid)
+        position = (float(position[0]), float(position[1]))
+        cell = self._cell(position)
+
+        old = self._positions.get(jid)
+        if old is not None:
+            old_cell = self._cell(old)
+            if old_cell != cell:
+                self._discard(jid, old_cell)
+                self._cells.setdefault(cell, set()).add(jid)
+        else:
+            self._cells.setdefault(cell, set()).add(jid)
+
+        self._positions[jid] = position
+        self._free[jid] = free_capacity
+        self._extend_bounds(cell)
+
+    def remove(self, jid):
+        jid = str(jid)
+        position = self._positions.pop(jid, None)
+        if position is not None:
+            self._discard(jid, self._cell(position))
+            self._free.pop(jid, None)
+
+    def position(self, jid):
+        return self._positions.get(str(jid))
+
+    def free_capacity(self, jid):
+        return self._free.get(str(jid))
+
+    def nearest(self, point, k, min_capacity=0, max_radius=None):
+        """До k ближайших автомобилей со свободным местом не меньше min_capacity.
+
+        Возвращает список JID по возрастанию расстояния. max_radius
+        ограничивает поиск (None - без ограничения).
+        """
+        if k <= 0 or not self._positions:
+            return []
+
+        px, py = float(point[0]), float(point[1])
+        cx, cy = self._cell((px, py))
+        min_x, min_y, max_x, max_y = self._bounds
+        max_ring = max(abs(cx - min_x), abs(cx - max_x), abs(cy - min_y), abs(cy - max_y))
+
+        found = []
+        for ring in range(max_ring + 1):
+            # Точка запроса может лежать у края своей ячейки, поэтому
+            # ячейки кольца ring не ближе (ring - 1) * cell_size
+            horizon = (ring - 1) * self.cell_size
+            if max_radius is not None and horizon > max_radius:
+                break
+            if len(found) >= k and found[k - 1][0] <= horizon:
+                break
+
+            for cell in self._ring(cx, cy, ring):
+                for jid in self._cells.get(cell, ()):
+                    if self._free[jid] < min_capacity:
+                        continue
+                    x, y = self._positions[jid]
+                    d = math.hypot(x - px, y - py)
+                    if max_radius is None or d <= max_radius:
+                        found.append((d, jid))
+            found.sort()
+
+        return [jid for _, jid in found[:k]]
+
+    def within(self, point, radius, min_capacity=0):
+        """Все автомобили в радиусе radius (по возрастанию расстояния)"""
+        return self.nearest(point, len(self._positions), min_capacity, max_radius=radius)
+
+    def _cell(self, position):
+        return (math.floor(position[0] / self.cell_size), math.floor(position[1] / self.cell_size))
+
+    def _discard(self, jid, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(jid)
+            if not members:
+                del self._cells[cell]
+
+    def _extend_bounds(self, cell):
+        # Границы только расширяются: это верхняя оценка числа колец поиска
+        if self._bounds is None:
+            self._bounds = (cell[0], cell[1], cell[0], cell[1])
+        else:
+            min_x, min_y, max_x, max_y = self._bounds
+            self._bounds = (min(min_x, cell[0]), min(min_y, cell[1]), max(max_x, cell[0]), max(max_y, cell[1]))
+
+    @staticmethod
+    def _ring(cx, cy, ring):
+        if ring == 0:
+            yield (cx, cy)
+            return
+        for x in range(cx - ring, cx + ring + 1):
+            yield (x, cy - ring)
+            yield (x, cy + ring)
+        for y in range(cy - ring + 1, cy + ring):
+            yield (cx - ring, y)
+            yield (cx + ring, y)
\ No newline at end of file
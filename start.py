@@ -1,116 +1,381 @@
+import argparse
 import asyncio
+import concurrent.futures
+import random
 import sys
+import time
 from pathlib import Path
 
 # Добавляем путь к модулю конфигурации
 sys.path.insert(0, str(Path(__file__).parent))
 
-from agent import ShopAgent, DeliveryVehicleAgent
+from agent import ShopAgent, DeliveryVehicleAgent, DEFAULT_TARIFF_PER_KM, DEFAULT_WAITING_COST_PER_HOUR
+from dispatcher import DispatcherAgent
 from config.config_loader import ConfigLoader
+from sim_clock import CLOCK_MODES, create_clock
+from spatial_index import SpatialIndex
+from codec import available_codecs
+from transport import TRANSPORTS, create_transport
+from log import add_logging_arguments, get_logger, setup_logging, stop_logging
+from metrics import DeliveryMetrics, add_metrics_arguments, start_metrics_export, stop_metrics_export
+from retry import RetryPolicy, add_retry_arguments, retry_policy_from_args
+from journal import Journal, add_journal_arguments
+from road_graph import RoadDistance, add_road_arguments, network_points
+from shard import add_shard_arguments, run_sharded
+from startup import StartupOrchestrator, add_startup_arguments
 
+log = get_logger("start")
 
-async def main():
-    """Главная функция запуска системы"""
 
-    print("=" * 60)
-    print("СИСТЕМА ДОСТАВКИ ТОВАРОВ ПО МАГАЗИНАМ")
-    print("=" * 60)
+def create_pricing_executor(pricing_pool=None, pricing_workers=None):
+    """Общий пул для расчета ставок по снимкам маршрутов (None - считать в цикле событий)"""
+    if pricing_pool == "thread":
+        return concurrent.futures.ThreadPoolExecutor(pricing_workers, thread_name_prefix="pricing")
+    if pricing_pool == "process":
+        return concurrent.futures.ProcessPoolExecutor(pricing_workers)
+    return None
+
+
+def create_vehicle(v_config, clock, codec="json", cost_engine=None, spatial_index=None, metrics=None,
+                   vehicle_concurrency=1, pricing_executor=None, journal=None, distance=None):
+    """Агент-автомобиль по записи из vehicles.json"""
+    return DeliveryVehicleAgent(
+        v_config["jid"],
+        v_config["password"],
+        v_config["capacity"],
+        v_config["speed"],
+        clock=clock,
+        tariff_per_km=v_config.get("tariff_per_km", DEFAULT_TARIFF_PER_KM),
+        waiting_cost_per_hour=v_config.get("waiting_cost_per_hour", DEFAULT_WAITING_COST_PER_HOUR),
+        cost_engine=cost_engine,
+        spatial_index=spatial_index,
+        codec=codec,
+        metrics=metrics,
+        position=v_config.get("position", (0, 0)),
+        max_concurrent_requests=vehicle_concurrency,
+        pricing_executor=pricing_executor,
+        journal=journal,
+        compartments=v_config.get("compartments"),
+        distance=distance
+    )
+
+
+def create_dispatcher(xmpp_server, clock, vehicle_jids, proposal_timeout=4.0, assignment="greedy",
+                      codec="json", metrics=None):
+    """Диспетчер пакетной рассылки заказов"""
+    # Диспетчер должен успеть ответить до дедлайна магазина
+    dispatcher = DispatcherAgent(
+        f"dispatcher@{xmpp_server}",
+        "dispatcherpass",
+        clock=clock,
+        order_timeout=proposal_timeout,
+        mode=assignment,
+        codec=codec,
+        metrics=metrics
+    )
+    dispatcher.set("vehicles", vehicle_jids)
+    return dispatcher
+
+
+def create_shop(s_config, clock, vehicle_jids, dispatcher_jid=None, proposal_timeout=4.0, spatial_index=None,
+                nearest=0, search_radius=None, codec="json", metrics=None, seed=None, retry_policy=None,
+                subscribe=False, journal=None):
+    """Агент-магазин по записи из shops.json"""
+    shop = ShopAgent(
+        s_config["jid"],
+        s_config["password"],
+        s_config["shop_id"],
+        tuple(s_config["location"]),
+        tuple(s_config["time_window"]),
+        s_config["needs"],
+        clock=clock,
+        proposal_timeout=proposal_timeout,
+        spatial_index=spatial_index,
+        candidate_count=nearest,
+        search_radius=search_radius,
+        codec=codec,
+        metrics=metrics,
+        rng=random.Random(f"{seed}:{s_config['shop_id']}") if seed is not None else None,
+        retry_policy=retry_policy,
+        subscribe_capacity=subscribe,
+        journal=journal
+    )
+
+    # Передаем список автомобилей магазину
+    shop.set("vehicles", vehicle_jids)
+    if dispatcher_jid:
+        shop.set("dispatcher", dispatcher_jid)
+    return shop
+
 
-    # Создание загрузчика конфигурации
+def load_config():
+    """Конфигурация автомобилей и магазинов (файлы по умолчанию создаются при отсутствии)"""
     try:
         loader = ConfigLoader("config")
     except FileNotFoundError as e:
-        print(f"\nОшибка: {e}")
-        print("\nСоздаю конфигурационные файлы по умолчанию...")
+        log.warning("Ошибка: %s", e)
+        log.info("Создаю конфигурационные файлы по умолчанию...")
         ConfigLoader.create_default_configs("config")
         loader = ConfigLoader("config")
-        print("✓ Конфигурационные файлы созданы!")
-        print("✓ Отредактируйте файлы config/vehicles.json и config/shops.json при необходимости\n")
+        log.info("✓ Конфигурационные файлы созданы!")
+        log.info("✓ Отредактируйте файлы config/vehicles.json и config/shops.json при необходимости")
+
+    return loader.load_vehicles_config(), loader.load_shops_config()
+
+
+async def main(transport_name="xmpp", clock_mode="realtime", time_scale=60.0, proposal_timeout=4.0,
+               use_dispatcher=False, use_cost_engine=False, assignment="greedy", start_hour=8.0,
+               nearest=0, search_radius=None, grid_cell=10.0, codec="json", metrics_port=None,
+               metrics_file=None, metrics_interval=10.0, seed=None, retry_policy=None, subscribe=False,
+               vehicle_concurrency=1, pricing_pool=None, pricing_workers=None, start_concurrency=50,
+               start_retries=3, start_timeout=30.0, journal_path=None, journal_fsync_interval=0.05,
+               journal_snapshot_every=10000, road_graph=None, road_matrix=None):
+    """Главная функция запуска системы"""
+
+    transport = create_transport(transport_name)
+    clock = create_clock(clock_mode, time_scale, start_hour)
+    metrics = DeliveryMetrics() if metrics_port is not None or metrics_file else None
+
+    log.info("=" * 60)
+    log.info("СИСТЕМА ДОСТАВКИ ТОВАРОВ ПО МАГАЗИНАМ")
+    log.info("=" * 60)
 
     # Загрузка конфигураций
     try:
-        vehicles_config = loader.load_vehicles_config()
-        shops_config = loader.load_shops_config()
+        vehicles_config, shops_config = load_config()
     except Exception as e:
-        print(f"\nОшибка загрузки конфигурации: {e}")
+        log.error("Ошибка загрузки конфигурации: %s", e)
         return
 
-    print(f"\nЗагружена конфигурация:")
-    print(f"   XMPP сервер: {vehicles_config['xmpp_server']}")
-    print(f"   Автомобилей: {len(vehicles_config['vehicles'])}")
-    print(f"   Магазинов: {len(shops_config['shops'])}")
+    log.info("Загружена конфигурация:")
+    log.info(f"   Транспорт: {transport.name}")
+    log.info(f"   Часы: {clock_mode}" + (f" (x{time_scale:g})" if clock_mode == "accelerated" else ""))
+    log.info(f"   Модельное время запуска: {clock.datetime():%H:%M}")
+    if clock_mode == "virtual" and transport.name != "memory":
+        log.warning("Виртуальное время рассчитано на --transport memory")
+    log.info(f"   Формат сообщений: {codec}")
+    retry_policy = retry_policy or RetryPolicy()
+    attempts = retry_policy.max_attempts if retry_policy.max_attempts is not None else "до закрытия окна"
+    log.info(f"   Повторы: {retry_policy.base_delay:g}..{retry_policy.max_delay:g} с, джиттер "
+             f"{retry_policy.jitter}, попыток: {attempts}" + (", подписка на свободное место" if subscribe else ""))
+    log.info(f"   XMPP сервер: {vehicles_config['xmpp_server']}")
+    log.info(f"   Автомобилей: {len(vehicles_config['vehicles'])}")
+    log.info(f"   Магазинов: {len(shops_config['shops'])}")
+
+    # Расстояния по графу дорог (требует numpy); без графа - по прямой
+    road = None
+    if road_graph:
+        road = RoadDistance.build(road_graph, network_points(vehicles_config, shops_config), road_matrix)
+        log.info(f"   Расстояния: по дорогам ({road_graph})")
+
+    # Общий движок матриц стоимости (требует numpy)
+    cost_engine = None
+    if use_cost_engine:
+        from cost_engine import CostEngine
+        cost_engine = CostEngine.from_config(vehicles_config, shops_config, default_tariff=DEFAULT_TARIFF_PER_KM,
+                                             road=road)
+        log.info(f"   Движок стоимости: матрица {cost_engine.distance.shape[0]} x {cost_engine.distance.shape[1]}")
+
+    # Общий пул для расчета ставок по снимкам маршрутов (необязательный)
+    pricing_executor = create_pricing_executor(pricing_pool, pricing_workers)
+    if vehicle_concurrency > 1 or pricing_executor is not None:
+        pool_info = f", пул: {pricing_pool}" if pricing_executor is not None else ""
+        log.info(f"   Параллельных запросов на автомобиль: {vehicle_concurrency}{pool_info}")
+        if pricing_executor is not None and clock_mode == "virtual":
+            log.warning("Расчет в пуле идет в реальном времени: в режиме virtual раунды могут "
+                        "закрываться по дедлайну раньше, чем придут ставки")
+
+    # Пространственный индекс для рассылки запросов ближайшим автомобилям
+    spatial_index = None
+    if nearest > 0:
+        spatial_index = SpatialIndex(cell_size=grid_cell)
+        radius_info = f", радиус {search_radius:g} км" if search_radius is not None else ""
+        log.info(f"   Рассылка запросов: {nearest} ближайших автомобилей{radius_info}")
+
+    # Журнал заказов: при перезапуске с тем же файлом агенты продолжают с места остановки
+    journal = None
+    if journal_path:
+        journal = Journal(journal_path, journal_fsync_interval, journal_snapshot_every)
+        log.info(f"   Журнал: {journal_path} (fsync раз в {journal_fsync_interval:g} с)")
+
+    exporters = []
+    if metrics is not None:
+        exporters = await start_metrics_export(metrics, metrics_port, metrics_file, metrics_interval)
+        if metrics_port is not None:
+            log.info(f"   Метрики: http://127.0.0.1:{exporters[0].port}/metrics")
+        if metrics_file:
+            log.info(f"   Метрики: файл {metrics_file} каждые {metrics_interval:g} с")
+
+    # Агенты запускаются одновременно; магазины - после готовности автомобилей
+    orchestrator = StartupOrchestrator(transport, start_concurrency, start_retries, start_timeout, metrics=metrics)
+    started = time.monotonic()
 
     # Создание и запуск агентов-автомобилей
-    vehicles = []
-    vehicle_jids = [v["jid"] for v in vehicles_config["vehicles"]]
-
-    print("\n--- ЗАПУСК АВТОМОБИЛЕЙ ---")
-    for v_config in vehicles_config["vehicles"]:
-        vehicle = DeliveryVehicleAgent(
-            v_config["jid"],
-            v_config["password"],
-            v_config["capacity"],
-            v_config["speed"]
-        )
-        await vehicle.start()
-        vehicles.append(vehicle)
-        vehicle_name = v_config.get("name", v_config["jid"])
-        print(f"✓ {vehicle_name} (вместимость: {v_config['capacity']}, скорость: {v_config['speed']} км/ч)")
-
-    # Небольшая задержка для инициализации
-    await asyncio.sleep(2)
+    log.info("--- ЗАПУСК АВТОМОБИЛЕЙ ---")
+    vehicles = [create_vehicle(v_config, clock, codec, cost_engine, spatial_index, metrics,
+                               vehicle_concurrency, pricing_executor, journal, road)
+                for v_config in vehicles_config["vehicles"]]
+    report = await orchestrator.start_all(vehicles, "vehicle")
+    for vehicle, v_config in zip(vehicles, vehicles_config["vehicles"]):
+        if vehicle.is_alive():
+            vehicle_name = v_config.get("name", v_config["jid"])
+            log.info(f"✓ {vehicle_name} (вместимость: {v_config['capacity']}, скорость: {v_config['speed']} км/ч)")
+    # Магазинам передаются только запущенные автомобили
+    vehicles = report.started
+    vehicle_jids = [str(vehicle.jid) for vehicle in vehicles]
+    if not vehicles:
+        log.error("Ни один автомобиль не запущен, магазины не запускаются")
+        return
+
+    # Диспетчер пакетной рассылки заказов (необязательный)
+    dispatcher = None
+    if use_dispatcher or assignment == "global":
+        log.info("--- ЗАПУСК ДИСПЕТЧЕРА ---")
+        dispatcher = create_dispatcher(vehicles_config["xmpp_server"], clock, vehicle_jids, proposal_timeout,
+                                       assignment, codec, metrics)
+        if (await orchestrator.start_all([dispatcher], "dispatcher")).failed:
+            log.warning("Диспетчер не запущен: магазины рассылают запросы сами")
+            dispatcher = None
+        else:
+            log.info(f"✓ Диспетчер {dispatcher.jid}")
 
     # Создание и запуск агентов-магазинов
-    shops = []
-
-    print("\n--- ЗАПУСК МАГАЗИНОВ ---")
-    for s_config in shops_config["shops"]:
-        shop = ShopAgent(
-            s_config["jid"],
-            s_config["password"],
-            s_config["shop_id"],
-            tuple(s_config["location"]),
-            tuple(s_config["time_window"]),
-            s_config["needs"]
-        )
-
-        # Передаем список автомобилей магазину
-        shop.set("vehicles", vehicle_jids)
-
-        await shop.start()
-        shops.append(shop)
-
-        total_needs = sum(s_config["needs"].values())
-        print(f"✓ {s_config['shop_id']} (позиция: {s_config['location']}, товаров: {total_needs})")
-
-    print("\n" + "=" * 60)
-    print("ВСЕ АГЕНТЫ ЗАПУЩЕНЫ - СИСТЕМА РАБОТАЕТ")
-    print("=" * 60)
-    print("\nНаблюдайте за взаимодействием агентов...")
-    print("Для остановки нажмите Ctrl+C\n")
+    log.info("--- ЗАПУСК МАГАЗИНОВ ---")
+    shops = [create_shop(s_config, clock, vehicle_jids, str(dispatcher.jid) if dispatcher else None,
+                         proposal_timeout, spatial_index, nearest, search_radius, codec, metrics, seed,
+                         retry_policy, subscribe, journal)
+             for s_config in shops_config["shops"]]
+    report = await orchestrator.start_all(shops, "shop")
+    for shop, s_config in zip(shops, shops_config["shops"]):
+        if shop.is_alive():
+            total_needs = sum(s_config["needs"].values())
+            log.info(f"✓ {s_config['shop_id']} (позиция: {s_config['location']}, товаров: {total_needs})")
+    shops = report.started
+
+    log.info("=" * 60)
+    log.info(f"ВСЕ АГЕНТЫ ЗАПУЩЕНЫ - СИСТЕМА РАБОТАЕТ (готовность за {time.monotonic() - started:.2f} с)")
+    log.info("=" * 60)
+    log.info("Наблюдайте за взаимодействием агентов...")
+    log.info("Для остановки нажмите Ctrl+C")
 
     try:
         # Работа системы
         while True:
             await asyncio.sleep(1)
 
-    except KeyboardInterrupt:
-        print("\n\n--- ОСТАНОВКА СИСТЕМЫ ---")
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        log.info("--- ОСТАНОВКА СИСТЕМЫ ---")
 
         # Остановка всех агентов
         for vehicle in vehicles:
-            await vehicle.stop()
-            print(f"✓ Автомобиль остановлен")
+            await transport.stop_agent(vehicle)
+            log.info("✓ Автомобиль остановлен")
 
         for shop in shops:
-            await shop.stop()
-            print(f"✓ Магазин остановлен")
+            await transport.stop_agent(shop)
+            log.info("✓ Магазин остановлен")
+
+        if dispatcher:
+            await transport.stop_agent(dispatcher)
 
-        print("\nСистема остановлена.")
+        log.info("Система остановлена.")
+        raise
+
+    finally:
+        # Финальная запись метрик выполняется и при остановке по Ctrl+C
+        await stop_metrics_export(exporters)
+        if pricing_executor is not None:
+            pricing_executor.shutdown(wait=False, cancel_futures=True)
+        if journal is not None:
+            journal.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Локальный запуск системы доставки")
+    parser.add_argument("--transport", choices=sorted(TRANSPORTS), default="xmpp",
+                        help="xmpp - через XMPP сервер, memory - внутрипроцессная шина без сервера")
+    parser.add_argument("--clock", choices=CLOCK_MODES, default="realtime",
+                        help="realtime - реальное время, accelerated - ускоренное, "
+                             "virtual - дискретно-событийная симуляция")
+    parser.add_argument("--time-scale", type=float, default=60.0,
+                        help="Ускорение модельного времени для режима accelerated")
+    parser.add_argument("--proposal-timeout", type=float, default=4.0,
+                        help="Дедлайн сбора предложений в раунде (секунды модельного времени)")
+    parser.add_argument("--dispatcher", action="store_true",
+                        help="Отправлять заказы через диспетчера пакетами вместо рассылки каждым магазином")
+    parser.add_argument("--cost-engine", action="store_true",
+                        help="Брать стоимость из общих матриц NumPy вместо расчета в каждом сообщении")
+    parser.add_argument("--assignment", choices=DispatcherAgent.MODES, default="greedy",
+                        help="greedy - каждый магазин выбирает сам, global - диспетчер решает "
+                             "задачу о назначениях для всех заказов (включает --dispatcher)")
+    parser.add_argument("--nearest", type=int, default=0, metavar="K",
+                        help="Отправлять запрос только K ближайшим автомобилям с достаточным "
+                             "свободным местом (0 - всем автомобилям)")
+    parser.add_argument("--search-radius", type=float, default=None,
+                        help="Радиус поиска ближайших автомобилей, км (расширяется, если никого не найдено)")
+    parser.add_argument("--grid-cell", type=float, default=10.0,
+                        help="Размер ячейки сетки пространственного индекса, км")
+    parser.add_argument("--codec", choices=available_codecs(), default="json",
+                        help="Формат тела сообщений: json, msgpack (нужен пакет msgpack) или "
+                             "schema - позиционное кодирование по схеме типа сообщения")
+    parser.add_argument("--start-hour", type=float, default=8.0,
+                        help="Модельное время суток в момент запуска, ч (окна приема магазинов "
+                             "считаются от него; по умолчанию начало рабочего дня - 8:00)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Зерно случайных задержек магазинов (для воспроизводимых запусков)")
+    parser.add_argument("--vehicle-concurrency", type=int, default=1, metavar="N",
+                        help="Сколько запросов автомобиль обрабатывает параллельно (1 - строго по очереди)")
+    parser.add_argument("--pricing-pool", choices=("thread", "process"), default=None,
+                        help="Считать вставку в маршрут в общем пуле потоков или процессов "
+                             "(для тяжелых моделей стоимости)")
+    parser.add_argument("--pricing-workers", type=int, default=None,
+                        help="Размер пула расчета ставок (по умолчанию - по числу ядер)")
+    add_shard_arguments(parser)
+    add_startup_arguments(parser)
+    add_retry_arguments(parser)
+    add_journal_arguments(parser)
+    add_road_arguments(parser)
+    add_logging_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    if args.shards != 1 and args.clock == "virtual":
+        parser.error("виртуальные часы работают только в одном процессе: используйте --clock realtime "
+                     "или accelerated вместе с --shards")
+    return args
+
+
+async def main_sharded(args):
+    """Запуск агентов в нескольких процессах (--shards)"""
+    log.info("=" * 60)
+    log.info("СИСТЕМА ДОСТАВКИ ТОВАРОВ ПО МАГАЗИНАМ (НЕСКОЛЬКО ПРОЦЕССОВ)")
+    log.info("=" * 60)
+    try:
+        vehicles_config, shops_config = load_config()
+    except Exception as e:
+        log.error("Ошибка загрузки конфигурации: %s", e)
+        return
+    log.info(f"   Транспорт: {args.transport}, автомобилей: {len(vehicles_config['vehicles'])}, "
+             f"магазинов: {len(shops_config['shops'])}")
+    await run_sharded(args, vehicles_config, shops_config)
 
 
 if __name__ == "__main__":
+    args = parse_args()
+    listener = setup_logging(args.log_level, args.log_format, args.quiet, args.log_file)
     try:
-        asyncio.run(main())
+        if args.shards != 1:
+            asyncio.run(main_sharded(args))
+        else:
+            asyncio.run(main(args.transport, args.clock, args.time_scale, args.proposal_timeout, args.dispatcher,
+                             args.cost_engine, args.assignment, args.start_hour, args.nearest,
+                             args.search_radius, args.grid_cell, args.codec, args.metrics_port,
+                             args.metrics_file, args.metrics_interval, args.seed,
+                             retry_policy_from_args(args), args.subscribe, args.vehicle_concurrency,
+                             args.pricing_pool, args.pricing_workers, args.start_concurrency,
+                             args.start_retries, args.start_timeout, args.journal,
+                             args.journal_fsync_interval, args.journal_snapshot_every, args.road_graph,
+                             args.road_matrix))
     except KeyboardInterrupt:
-        print("\nПрограмма завершена пользователем")
\ No newline at end of file
+        log.info("Программа завершена пользователем")
+    finally:
+        stop_logging(listener)
\ No newline at end of file
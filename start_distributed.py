@@ -1,5 +1,7 @@
+import argparse
 import asyncio
 import sys
+import time
 from pathlib import Path
 
 # Добавляем путь к модулю конфигурации
@@ -7,31 +9,42 @@ sys.path.insert(0, str(Path(__file__).parent))
 
 # Импорт модулей с обработкой ошибок
 try:
-    from agent import ShopAgent, DeliveryVehicleAgent
+    from agent import ShopAgent
     from config.config_loader import ConfigLoader
+    from start import create_vehicle
 except ImportError as e:
-    print(f"[CRITICAL ERROR] Ошибка импорта модулей: {e}")
-    print("Убедитесь, что файлы agent.py и config_loader.py находятся в правильных директориях.")
+    # Логирование еще не настроено: сообщение уходит прямо в stderr
+    print(f"[CRITICAL ERROR] Ошибка импорта модулей: {e}", file=sys.stderr)
+    print("Убедитесь, что файлы agent.py и config_loader.py находятся в правильных директориях.", file=sys.stderr)
     sys.exit(1)
 
+from journal import add_journal_arguments, journal_from_args
+from road_graph import RoadDistance, add_road_arguments, network_points
+from log import add_logging_arguments, get_logger, setup_logging, stop_logging
+from startup import StartupOrchestrator, add_startup_arguments
+from transport import XMPPTransport
 
-async def main():
+log = get_logger("start_distributed")
+
+
+async def main(start_concurrency=50, start_retries=3, start_timeout=30.0, journal=None, road_graph=None,
+               road_matrix=None):
     """Главная функция запуска системы"""
 
-    print("############################################################")
-    print("      ЗАПУСК МУЛЬТИАГЕНТНОЙ СИСТЕМЫ ДОСТАВКИ (MAS)          ")
-    print("############################################################")
+    log.info("############################################################")
+    log.info("      ЗАПУСК МУЛЬТИАГЕНТНОЙ СИСТЕМЫ ДОСТАВКИ (MAS)          ")
+    log.info("############################################################")
 
     # 1. Инициализация конфигурации
     try:
         loader = ConfigLoader("config")
     except FileNotFoundError:
-        print("\n[INFO] Конфигурация не найдена. Создание файлов по умолчанию...")
+        log.info("Конфигурация не найдена. Создание файлов по умолчанию...")
         ConfigLoader.create_default_configs("config")
         loader = ConfigLoader("config")
-        print("[INFO] Файлы созданы. Пожалуйста, проверьте папку config/.")
+        log.info("Файлы созданы. Пожалуйста, проверьте папку config/.")
     except ValueError as e:
-        print(f"\n[ERROR] Ошибка структуры конфигурации: {e}")
+        log.error("Ошибка структуры конфигурации: %s", e)
         return
 
     # 2. Загрузка данных
@@ -39,84 +52,80 @@ async def main():
         vehicles_config = loader.load_vehicles_config()
         shops_config = loader.load_shops_config()
     except Exception as e:
-        print(f"\n[ERROR] Не удалось загрузить конфигурацию: {e}")
+        log.error("Не удалось загрузить конфигурацию: %s", e)
         return
 
-    print(f"\n[STATUS] Конфигурация загружена успешно.")
-    print(f"   - XMPP Сервер: {vehicles_config['xmpp_server']}")
-    print(f"   - Количество автомобилей: {len(vehicles_config['vehicles'])}")
-    print(f"   - Количество магазинов: {len(shops_config['shops'])}")
+    log.info("Конфигурация загружена успешно.")
+    log.info(f"   - XMPP Сервер: {vehicles_config['xmpp_server']}")
+    log.info(f"   - Количество автомобилей: {len(vehicles_config['vehicles'])}")
+    log.info(f"   - Количество магазинов: {len(shops_config['shops'])}")
 
-    # 3. Запуск агентов-автомобилей
-    vehicles = []
-    vehicle_jids = [v["jid"] for v in vehicles_config["vehicles"]]
-
-    print("\n---------------- ЗАПУСК АГЕНТОВ-АВТОМОБИЛЕЙ ----------------")
-    for v_config in vehicles_config["vehicles"]:
-        try:
-            vehicle = DeliveryVehicleAgent(
-                v_config["jid"],
-                v_config["password"],
-                v_config["capacity"],
-                v_config["speed"]
-            )
-            # В версии SPADE 3+ start() является асинхронным
-            await vehicle.start()
-
-            vehicles.append(vehicle)
-            v_name = v_config.get("name", v_config["jid"])
-            print(f"[OK] {v_name} запущен. (Вместимость: {v_config['capacity']}, Скорость: {v_config['speed']})")
+    # Расстояния по графу дорог (без графа - по прямой)
+    road = None
+    if road_graph:
+        road = RoadDistance.build(road_graph, network_points(vehicles_config, shops_config), road_matrix)
+        log.info(f"   - Расстояния: по дорогам ({road_graph})")
 
-        except Exception as e:
-            print(f"[ERROR] Не удалось запустить автомобиль {v_config['jid']}.")
-            print(f"        Детали ошибки: {e}")
-            print("        Возможная причина: XMPP сервер не доступен или неверный пароль.")
-            # Прерываем, так как без транспорта система не имеет смысла
-            break
+    # Агенты подключаются к серверу одновременно, с повторами при ошибке
+    orchestrator = StartupOrchestrator(XMPPTransport(), start_concurrency, start_retries, start_timeout)
+    started = time.monotonic()
 
-    # Пауза для стабильной инициализации XMPP соединений
-    print("[INFO] Ожидание инициализации сети (2 сек)...")
-    await asyncio.sleep(2)
+    # 3. Запуск агентов-автомобилей
+    log.info("---------------- ЗАПУСК АГЕНТОВ-АВТОМОБИЛЕЙ ----------------")
+    # Те же параметры из vehicles.json, что и при локальном запуске (позиция, тариф, отсеки);
+    # часы - реальное время по умолчанию
+    vehicles = [create_vehicle(v_config, None, journal=journal, distance=road)
+                for v_config in vehicles_config["vehicles"]]
+    report = await orchestrator.start_all(vehicles, "vehicle")
+    for vehicle, v_config in zip(vehicles, vehicles_config["vehicles"]):
+        if vehicle.is_alive():
+            v_name = v_config.get("name", v_config["jid"])
+            log.info(f"{v_name} запущен. (Вместимость: {v_config['capacity']}, Скорость: {v_config['speed']})")
+    if report.failed:
+        log.error("Не удалось запустить автомобили: %s. Возможная причина: XMPP сервер не доступен "
+                  "или неверный пароль.", ", ".join(str(v.jid) for v in report.failed))
+    vehicles = report.started
+    if not vehicles:
+        log.error("Ни один автомобиль не запущен: без транспорта система не имеет смысла")
+        return
+    # Магазины обращаются только к запущенным автомобилям
+    vehicle_jids = [str(vehicle.jid) for vehicle in vehicles]
 
     # 4. Запуск агентов-магазинов
+    log.info("---------------- ЗАПУСК АГЕНТОВ-МАГАЗИНОВ ------------------")
     shops = []
-
-    print("\n---------------- ЗАПУСК АГЕНТОВ-МАГАЗИНОВ ------------------")
     for s_config in shops_config["shops"]:
-        try:
-            shop = ShopAgent(
-                s_config["jid"],
-                s_config["password"],
-                s_config["shop_id"],
-                tuple(s_config["location"]),
-                tuple(s_config["time_window"]),
-                s_config["needs"]
-            )
-
-            # Передаем список известных автомобилей агенту магазина
-            shop.set("vehicles", vehicle_jids)
-
-            await shop.start()
-
-            shops.append(shop)
+        shop = ShopAgent(
+            s_config["jid"],
+            s_config["password"],
+            s_config["shop_id"],
+            tuple(s_config["location"]),
+            tuple(s_config["time_window"]),
+            s_config["needs"],
+            journal=journal
+        )
+        # Передаем список известных автомобилей агенту магазина
+        shop.set("vehicles", vehicle_jids)
+        shops.append(shop)
+    report = await orchestrator.start_all(shops, "shop")
+    for shop, s_config in zip(shops, shops_config["shops"]):
+        if shop.is_alive():
             needs_count = sum(s_config["needs"].values())
-            print(
-                f"[OK] Магазин {s_config['shop_id']} запущен. (Позиция: {s_config['location']}, Потребность: {needs_count} ед.)")
-
-        except Exception as e:
-            print(f"[ERROR] Не удалось запустить магазин {s_config['jid']}: {e}")
+            log.info(f"Магазин {s_config['shop_id']} запущен. (Позиция: {s_config['location']}, "
+                     f"Потребность: {needs_count} ед.)")
+    shops = report.started
 
-    print("\n" + "=" * 60)
-    print("ВСЕ АГЕНТЫ АКТИВНЫ. НАЧАЛО ВЫПОЛНЕНИЯ СЦЕНАРИЯ.")
-    print("Для завершения работы нажмите Ctrl+C")
-    print("=" * 60 + "\n")
+    log.info("=" * 60)
+    log.info(f"ВСЕ АГЕНТЫ АКТИВНЫ ЗА {time.monotonic() - started:.1f} С. НАЧАЛО ВЫПОЛНЕНИЯ СЦЕНАРИЯ.")
+    log.info("Для завершения работы нажмите Ctrl+C")
+    log.info("=" * 60)
 
     # 5. Бесконечный цикл поддержания работы
     try:
         while True:
             await asyncio.sleep(1)
     except KeyboardInterrupt:
-        print("\n\n[USER STOP] Завершение работы системы...")
+        log.info("[USER STOP] Завершение работы системы...")
 
         # Корректная остановка агентов
         for vehicle in vehicles:
@@ -127,11 +136,28 @@ async def main():
             if shop.is_alive():
                 await shop.stop()
 
-        print("[STATUS] Система остановлена.")
+        log.info("Система остановлена.")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Распределенный запуск системы доставки")
+    add_startup_arguments(parser)
+    add_journal_arguments(parser)
+    add_road_arguments(parser)
+    add_logging_arguments(parser)
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
+    listener = setup_logging(args.log_level, args.log_format, args.quiet, args.log_file)
+    journal = journal_from_args(args)
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.start_concurrency, args.start_retries, args.start_timeout, journal, args.road_graph,
+                         args.road_matrix))
     except KeyboardInterrupt:
-        pass
\ No newline at end of file
+        pass
+    finally:
+        if journal is not None:
+            journal.close()
+        stop_logging(listener)
\ No newline at end of file
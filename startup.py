@@ -0,0 +1,135 @@
+"""Параллельный запуск агентов.
+
+Агенты запускаются одновременно, но не больше concurrency подключений
+сразу, чтобы не перегрузить XMPP сервер. Неудачный запуск повторяется
+с экспоненциальной задержкой; агент, так и не запустившийся, попадает
+в отчет и не останавливает запуск остальных. Готовность агента
+определяется по сигналу его поведения приема почты, а не по паузе.
+"""
+import asyncio
+import time
+
+from log import get_logger
+from retry import RetryPolicy
+
+log = get_logger("startup")
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+async def wait_ready(agent):
+    """Ожидание сигнала готовности: все поведения приема почты начали читать очередь"""
+    events = [b.ready for b in agent.behaviours if getattr(b, "ready", None) is not None]
+    for event in events:
+        await event.wait()
+
+
+class StartupReport:
+    """Итог запуска группы агентов: время до готовности и неудачи"""
+
+    def __init__(self, role):
+        self.role = role
+        self.started = []
+        self.failed = []
+        self.ready_times = []
+        self.attempts = 0
+        self.seconds = 0.0
+
+    def summary(self):
+        line = f"{self.role}: готово {len(self.started)}"
+        if self.failed:
+            line += f", не запущено {len(self.failed)}"
+        line += f" за {self.seconds:.2f} с"
+        if self.ready_times:
+            line += (f" (до готовности: p50 {_percentile(self.ready_times, 0.5):.3f} с, "
+                     f"p99 {_percentile(self.ready_times, 0.99):.3f} с, макс. {max(self.ready_times):.3f} с)")
+        if self.attempts > len(self.started) + len(self.failed):
+            line += f", попыток {self.attempts}"
+        return line
+
+
+class StartupOrchestrator:
+    """Одновременный запуск агентов через транспорт с ограничением и повторами.
+
+    concurrency  - сколько агентов подключаются одновременно;
+    retries      - сколько раз повторить неудачный запуск агента;
+    timeout      - ограничение одной попытки (подключение и готовность), с;
+    retry_policy - задержка между попытками, секунды реального времени.
+    """
+
+    def __init__(self, transport, concurrency=50, retries=3, timeout=30.0, retry_policy=None, metrics=None):
+        self.transport = transport
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy(base_delay=0.5, max_delay=10.0, jitter="full")
+        self.metrics = metrics
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def _start_once(self, agent):
+        await self.transport.start_agent(agent)
+        await wait_ready(agent)
+
+    async def start_agent(self, agent, report):
+        """Запуск одного агента с повторами. Возвращает True, если агент готов"""
+        attempt = 0
+        while True:
+            attempt += 1
+            report.attempts += 1
+            async with self._slots:
+                started = time.monotonic()
+                try:
+                    await asyncio.wait_for(self._start_once(agent), self.timeout)
+                except Exception as e:
+                    error = e if not isinstance(e, asyncio.TimeoutError) else f"нет готовности за {self.timeout:g} с"
+                else:
+                    elapsed = time.monotonic() - started
+                    report.ready_times.append(elapsed)
+                    if self.metrics is not None:
+                        self.metrics.agent_started(report.role, elapsed)
+                    return True
+                # Частично запущенного агента останавливаем перед повтором
+                try:
+                    await self.transport.stop_agent(agent)
+                except Exception:
+                    pass
+
+            if attempt > self.retries:
+                log.error("Не удалось запустить %s после %s попыток: %s", agent.jid, attempt, error)
+                if self.metrics is not None:
+                    self.metrics.agent_start_failed(report.role)
+                return False
+            delay = self.retry_policy.delay(attempt)
+            log.warning("Запуск %s не удался (%s), повтор через %.1f с", agent.jid, error, delay)
+            await asyncio.sleep(delay)
+
+    async def start_all(self, agents, role):
+        """Запуск группы агентов. Возвращает StartupReport"""
+        report = StartupReport(role)
+        started = time.monotonic()
+        results = await asyncio.gather(*(self.start_agent(agent, report) for agent in agents))
+        report.seconds = time.monotonic() - started
+        for agent, ok in zip(agents, results):
+            (report.started if ok else report.failed).append(agent)
+        log.info(report.summary())
+        return report
+
+
+def add_startup_arguments(parser):
+    """Параметры запуска агентов для скриптов запуска"""
+    parser.add_argument("--start-concurrency", type=int, default=50,
+                        help="Сколько агентов подключаются одновременно")
+    parser.add_argument("--start-retries", type=int, default=3,
+                        help="Повторы запуска агента при ошибке подключения")
+    parser.add_argument("--start-timeout", type=float, default=30.0,
+                        help="Ограничение одной попытки запуска агента (подключение и готовность), с")
+
+
+def orchestrator_from_args(transport, args, metrics=None):
+    return StartupOrchestrator(transport, args.start_concurrency, args.start_retries, args.start_timeout,
+                               metrics=metrics)
\ No newline at end of file
@@ -0,0 +1,106 @@
+class XMPPTransport:
+    """Стандартный транспорт SPADE: каждый агент подключается к XMPP серверу"""
+
+    name = "xmpp"
+
+    async def start_agent(self, agent):
+        """Запуск агента с подключением к XMPP серверу"""
+        await agent.start()
+
+    async def stop_agent(self, agent):
+        """Остановка агента и отключение от сервера"""
+        if agent.is_alive():
+            await agent.stop()
+
+
+class InMemoryTransport:
+    """Внутрипроцессная шина сообщений без XMPP сервера.
+
+    Шина подменяет контейнер SPADE у зарегистрированных агентов, поэтому
+    поведения продолжают использовать обычные self.send / self.receive.
+    Сообщение не сериализуется: один и тот же объект Message кладется
+    в очереди подходящих поведений получателя.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._agents = {}
+        self.delivered = 0
+        self.dropped = 0
+
+    def register(self, agent):
+        """Регистрация агента на шине"""
+        self._agents[str(agent.jid.bare)] = agent
+        agent.set_container(self)
+
+    def unregister(self, agent):
+        """Удаление агента с шины"""
+        self._agents.pop(str(agent.jid.bare), None)
+
+    def has_agent(self, jid):
+        return str(jid) in self._agents
+
+    def get_agent(self, jid):
+        return self._agents[str(jid)]
+
+    @property
+    def agents(self):
+        return list(self._agents.values())
+
+    async def start_agent(self, agent):
+        """Запуск агента без подключения к XMPP серверу.
+
+        Повторяет Agent._async_start из SPADE, пропуская создание
+        XMPP клиента: setup(), отметка агента живым и старт поведений.
+        """
+        self.register(agent)
+        await agent.setup()
+        agent._alive.set()
+        for behaviour in agent.behaviours:
+            if not behaviour.is_running:
+                behaviour.start()
+
+    async def stop_agent(self, agent):
+        """Остановка агента без отключения от сервера"""
+        for behaviour in agent.behaviours:
+            behaviour.kill()
+        agent._alive.clear()
+        self.unregister(agent)
+
+    async def send(self, msg, behaviour):
+        """Доставка сообщения (вызывается из Behaviour.send вместо контейнера SPADE)"""
+        self.deliver(msg)
+
+    def deliver(self, msg):
+        """Помещает сообщение в очереди всех подходящих поведений получателя"""
+        agent = self._agents.get(str(msg.to.bare))
+        if agent is None or not agent.is_alive():
+            self.dropped += 1
+            return False
+
+        matched = False
+        for behaviour in agent.behaviours:
+            if behaviour.queue is not None and behaviour.match(msg):
+                behaviour.queue.put_nowait(msg)
+                matched = True
+
+        if matched:
+            self.delivered += 1
+        else:
+            self.dropped += 1
+        return matched
+
+
+TRANSPORTS = {
+    XMPPTransport.name: XMPPTransport,
+    InMemoryTransport.name: InMemoryTransport,
+}
+
+
+def create_transport(name="xmpp"):
+    """Создание транспорта по имени ('xmpp' или 'memory')"""
+    try:
+        return TRANSPORTS[name]()
+    except KeyError:
+        raise ValueError(f"Неизвестный транспорт '{name}'. Доступны: {', '.join(TRANSPORTS)}")
\ No newline at end of file